@@ -0,0 +1,199 @@
+"""
+Контроль допуска запросов к инференсу (admission control)
+
+Одновременно обрабатывается не больше max_in_flight запросов, остальные ждут
+в ограниченной очереди с приоритетами. Если очередь заполнена или ожидание
+затянулось, клиент сразу получает 429/503 с заголовком Retry-After, а не
+ждет до таймаута: так задержка остается ограниченной и при перегрузке.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Dict, List, Tuple
+
+from starlette.responses import JSONResponse
+
+from metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь заполнена или ожидание превысило лимит"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Ограничитель одновременных запросов с очередью по приоритету
+
+    Меньшее значение приоритета - более важный запрос. Когда очередь
+    заполнена, новый запрос вытесняет самый неважный из ожидающих (если
+    он важнее его), иначе отклоняется сам. Работает в одном event loop.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        """
+        Args:
+            max_in_flight: Максимум одновременно обрабатываемых запросов
+            max_queue: Максимум ожидающих запросов
+            queue_timeout: Максимальное ожидание в очереди (сек)
+        """
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+        self._admitted = 0
+        self._queued_total = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._shed = 0
+        self._waited = 0
+        self._total_wait_ms = 0.0
+        self._total_service_ms = 0.0
+        self._served = 0
+
+    def _queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def retry_after(self) -> int:
+        """Оценка (сек), через сколько освободится место: очередь * среднее время / параллелизм"""
+        avg_service = (self._total_service_ms / self._served / 1000) if self._served else 1.0
+        return max(1, math.ceil((self._queued() + 1) * avg_service / self.max_in_flight))
+
+    def _reject(self, status_code: int, detail: str) -> AdmissionRejected:
+        return AdmissionRejected(status_code, detail, self.retry_after())
+
+    async def acquire(self, priority: int = 0):
+        """
+        Ждет свободного места для запроса
+
+        Args:
+            priority: Приоритет запроса (меньше - важнее)
+
+        Raises:
+            AdmissionRejected: 429, если очередь заполнена; 503, если ожидание превысило queue_timeout
+        """
+        if self._in_flight < self.max_in_flight and not self._queued():
+            self._in_flight += 1
+            self._admitted += 1
+            return
+
+        if self._queued() >= self.max_queue:
+            pending = [w for w in self._waiters if not w[2].done()]
+            worst = max(pending) if pending else None
+            if worst is None or worst[0] <= priority:
+                self._rejected_full += 1
+                raise self._reject(429, 'Сервер перегружен, повторите запрос позже')
+            # Вытесняем самый неважный запрос из очереди
+            worst[2].set_exception(self._reject(429, 'Сервер перегружен, повторите запрос позже'))
+            self._shed += 1
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued_total += 1
+        started = time.perf_counter()
+
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected_timeout += 1
+            raise self._reject(503, 'Превышено время ожидания в очереди на распознавание')
+        except BaseException:
+            # Отмена (клиент отключился) после выдачи места - место нужно вернуть
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+
+        wait_ms = (time.perf_counter() - started) * 1000
+        self._waited += 1
+        self._total_wait_ms += wait_ms
+        record_stage('admission_wait', wait_ms)
+
+    def release(self, service_ms: float = None):
+        """Освобождает место и передает его следующему запросу из очереди"""
+        self._in_flight -= 1
+        if service_ms is not None:
+            self._served += 1
+            self._total_service_ms += service_ms
+
+        while self._waiters and self._in_flight < self.max_in_flight:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Ожидание отменено или запрос вытеснен
+                continue
+            self._in_flight += 1
+            self._admitted += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        """Занятость, очередь и счетчики отказов"""
+        return {
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'queue_timeout_s': self.queue_timeout,
+            'in_flight': self._in_flight,
+            'queued': self._queued(),
+            'admitted': self._admitted,
+            'queued_total': self._queued_total,
+            'rejected_queue_full': self._rejected_full,
+            'rejected_timeout': self._rejected_timeout,
+            'shed': self._shed,
+            'avg_wait_ms': round(self._total_wait_ms / self._waited, 2) if self._waited else 0.0,
+            'avg_service_ms': round(self._total_service_ms / self._served, 2) if self._served else 0.0,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: пропускает запросы к перечисленным путям через AdmissionController
+
+    Отказ отправляется до чтения тела запроса, поэтому клиент не тратит
+    время на загрузку изображения, которое все равно не будет обработано.
+    """
+
+    def __init__(self, app, controller: AdmissionController, priorities: Dict[str, int]):
+        """
+        Args:
+            app: ASGI-приложение
+            controller: Общий контроллер допуска
+            priorities: Путь -> приоритет (пути не из словаря не ограничиваются)
+        """
+        self.app = app
+        self.controller = controller
+        self.priorities = priorities
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.priorities:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(self.priorities[scope['path']])
+        except AdmissionRejected as e:
+            logger.warning(f"Запрос {scope['path']} отклонен ({e.status_code}): {e.detail}")
+            response = JSONResponse(
+                {'detail': e.detail},
+                status_code=e.status_code,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release((time.perf_counter() - started) * 1000)
@@ -1,20 +1,69 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Tuple, Optional, Dict
+from contextlib import asynccontextmanager
+import asyncio
+import hmac
+import logging
 import os
-import shutil
-from pathlib import Path
-from use_model import detect_food, detect_food_simple
-from nutrition import get_nutrition_info
-from food_name_ru import get_russian_name
+import config
+from use_model import detect_food, detect_food_batch, detect_boxes_batch, batcher, registry
+from cascade import cascade
+from nutrition import get_nutrition_info_async
+from nutrition_cache import nutrition_cache
+from fatsecret_client import fatsecret_client
+from labels import label_table
+from name_resolver import name_resolver
+from executors import run_inference, executors_stats, shutdown_executors
+from ingest import read_upload, ImageTooLargeError, InvalidImageError
+from preprocess import PreparedImage, prepare_image, preprocess_stats
+from result_cache import prediction_cache, perceptual_hash, CacheEntry
+from memory_stats import process_memory
+from portion import estimate_portion, scale_nutrition
+from plate import prepare_plate, merge_views, build_plate
+from stream import serve_stream, streams_stats
+from admission import AdmissionController, AdmissionMiddleware
+import metrics
+from metrics import MetricsMiddleware, record_error, record_prediction, record_stage, timed
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Загружаем и прогреваем модель в фоне, готовность - в /ready
+    registry.active.manager.start_background()
+    registry.start_sync()
+    cascade.start_background()
+    metrics.registry.start_flusher()
+    yield
+    # Закрываем соединения с FatSecret и останавливаем пулы потоков
+    await fatsecret_client.aclose()
+    shutdown_executors()
+    registry.shutdown()
+    metrics.registry.write_snapshot()
+
 
 app = FastAPI(
     title="CalSnap API",
     description="API для распознавания еды на изображениях",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Контроль допуска к распознаванию (добавляется до CORS, чтобы отказы 429/503 тоже получали CORS-заголовки)
+admission = AdmissionController(
+    max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=config.ADMISSION_QUEUE_SIZE,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT
 )
+if config.ADMISSION_MAX_IN_FLIGHT > 0:
+    app.add_middleware(AdmissionMiddleware, controller=admission, priorities=config.ADMISSION_PRIORITIES)
+
+# Ответы прежней модели не должны отдаваться из кэша после переключения версии
+registry.on_switch.append(lambda version: prediction_cache.clear())
 
 # Настройка CORS
 app.add_middleware(
@@ -33,20 +82,32 @@ app.add_middleware(
     max_age=3600,
 )
 
-# Папка для временных загрузок
-UPLOAD_DIR = Path("temp_uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
+# Общее время запросов и заголовок Server-Timing (внешний middleware: учитывает и ожидание допуска)
+app.add_middleware(MetricsMiddleware)
+
+# Обращения к кэшам берутся из их статистики при сборе метрик
+metrics.registry.callback_counter(
+    'calsnap_cache_requests_total',
+    'Обращения к кэшам (prediction, nutrition) по результату',
+    ['cache', 'result'],
+    lambda: {
+        **{('prediction', result): prediction_cache.stats()[result] for result in ('hits', 'similar_hits', 'misses')},
+        **{('nutrition', result): nutrition_cache.stats()[result] for result in ('hits', 'stale_hits', 'misses', 'coalesced')},
+    }
+)
 
 class PredictionResponse(BaseModel):
     top_prediction: str
     confidence: float
     top_predictions: List[Tuple[str, float]]
+    detections: List[Dict] = []
+    stage: str = 'detector'
 
 
 class SimplePredictionResponse(BaseModel):
     product: str
     confidence: float
+    stage: str = 'detector'
 
 
 class NutritionResponse(BaseModel):
@@ -59,6 +120,8 @@ class NutritionResponse(BaseModel):
     protein_unit: str
     fat_unit: str
     carbs_unit: str
+    per_grams: Optional[float] = None
+    basis: Optional[str] = None
     error: Optional[str] = None
 
 
@@ -69,6 +132,290 @@ class PredictionWithNutritionResponse(BaseModel):
     top_predictions: List[Tuple[str, float]] = []
     top_predictions_ru: List[Tuple[str, float]] = []
     nutrition: Optional[Dict] = None
+    top_predictions_nutrition: List[Optional[Dict]] = []
+    detections: List[Dict] = []
+    portion: Optional[Dict] = None
+    portion_nutrition: Optional[Dict] = None
+    stage: str = 'detector'
+
+
+class BatchItemResponse(PredictionWithNutritionResponse):
+    filename: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchItemResponse]
+    processed: int
+    failed: int
+
+
+class PlateItemResponse(BaseModel):
+    label: str
+    label_ru: str
+    confidence: float
+    box: List[float]
+    area_fraction: float
+    portion: Dict
+    nutrition: Optional[Dict] = None
+    portion_nutrition: Optional[Dict] = None
+
+
+class PlateResponse(BaseModel):
+    items: List[PlateItemResponse]
+    counts: Dict[str, int]
+    total: Dict
+    plate: Optional[Dict] = None
+    tiled: bool
+    views: int
+
+
+class ModelVersionRequest(BaseModel):
+    name: str
+    path: str
+    backend: str = config.MODEL_BACKEND
+
+
+class ShadowRequest(BaseModel):
+    version: Optional[str] = None
+    rate: float = config.SHADOW_SAMPLE_RATE
+
+
+def cache_prefix() -> str:
+    """
+    Префикс ключей кэша предсказаний - активная версия модели (ключ: префикс + SHA-256)
+
+    Префикс берется до распознавания. Запрос, начатый на прежней модели и
+    закончившийся после переключения, сохранит результат под ключом прежней
+    версии, и новая модель его не получит.
+    """
+    return f'{registry.active.name}:'
+
+
+async def lookup_upload(file: UploadFile) -> Tuple[str, Optional[CacheEntry], Optional[PreparedImage], Optional[int]]:
+    """
+    Читает загруженное изображение и ищет готовый результат в кэше
+
+    Сначала ищем результат по SHA-256 байтов файла, затем (если включено) по
+    перцептивному хешу. При промахе изображение остается подготовленным для модели.
+
+    Args:
+        file: Загруженное изображение
+
+    Returns:
+        Tuple (ключ кэша, запись кэша или None, PreparedImage или None, dHash или None).
+        Если PreparedImage возвращен, его буфер нужно освободить через release().
+    """
+    # Проверка типа файла
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(
+            status_code=400,
+            detail="Файл должен быть изображением"
+        )
+
+    try:
+        with timed('upload_read'):
+            upload = await read_upload(file)
+        try:
+            prefix = cache_prefix()
+            key = prefix + upload.sha256
+            cached = prediction_cache.get(key)
+            if cached is not None:
+                return key, cached, None, None
+            prepared = await run_inference(prepare_image, upload.file)
+            record_stage('decode', prepared.timings['decode_ms'])
+            record_stage('preprocess', prepared.timings['resize_ms'])
+        finally:
+            upload.close()
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    phash = None
+    if prediction_cache.similarity_enabled:
+        try:
+            phash = await run_inference(perceptual_hash, prepared.content)
+        except BaseException:
+            prepared.release()
+            raise
+        similar = prediction_cache.get_similar(phash, prefix)
+        if similar is not None:
+            prepared.release()
+            entry = CacheEntry(key, phash, similar.result, similar.nutrition)
+            prediction_cache.put(entry)
+            return key, entry, None, phash
+
+    return key, None, prepared, phash
+
+
+async def analyze_upload(file: UploadFile) -> CacheEntry:
+    """
+    Читает загруженное изображение и распознает его (с использованием кэша)
+
+    Args:
+        file: Загруженное изображение
+
+    Returns:
+        CacheEntry с результатом detect_food (top_n=5) и, возможно, питательной ценностью
+    """
+    sha256, cached, prepared, phash = await lookup_upload(file)
+    if cached is not None:
+        record_prediction(cached.result['top_prediction'])
+        return cached
+
+    try:
+        result = await run_inference(detect_food, prepared.image, top_n=5, letterbox=prepared.letterbox)
+    finally:
+        # Возвращаем буфер изображения в пул
+        prepared.release()
+
+    entry = CacheEntry(sha256, phash, result)
+    prediction_cache.put(entry)
+    record_prediction(result['top_prediction'])
+    return entry
+
+
+async def fetch_nutrition(labels, deadline: float = None) -> Dict[str, Dict]:
+    """
+    Получает питательную ценность для нескольких продуктов параллельно
+
+    Продукты, не успевшие к сроку, в результат не попадают (фоновые запросы при
+    этом завершатся и заполнят кэш питательной ценности).
+
+    Args:
+        labels: Названия продуктов (без повторов)
+        deadline: Общий срок на все запросы (сек), по умолчанию NUTRITION_DEADLINE_MS
+
+    Returns:
+        Dict: название продукта -> питательная ценность
+    """
+    if deadline is None:
+        deadline = config.NUTRITION_DEADLINE_MS / 1000
+
+    nutrition_by_label = {}
+    tasks = {label: asyncio.ensure_future(get_nutrition_info_async(label)) for label in labels}
+    if not tasks:
+        return nutrition_by_label
+
+    with timed('nutrition'):
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        metrics.nutrition_total.inc(len(pending), source='timeout')
+        logger.warning(f"Nutrition deadline exceeded for {len(pending)} of {len(tasks)} products")
+
+    for label, task in tasks.items():
+        if task not in done:
+            continue
+        if task.exception() is not None:
+            metrics.nutrition_total.inc(source='error')
+            logger.warning(f"Nutrition data error for {label}: {task.exception()}")
+            continue
+        nutrition_data = task.result()
+        # Проверяем, есть ли ошибка при получении питательной информации
+        if 'error' in nutrition_data:
+            metrics.nutrition_total.inc(source='error')
+            logger.warning(f"Nutrition data error for {label}: {nutrition_data['error']}")
+            continue
+        metrics.nutrition_total.inc(source=nutrition_data.get('source', 'unknown'))
+        nutrition_by_label[label] = nutrition_data
+
+    return nutrition_by_label
+
+
+async def resolve_nutrition(entries: List[CacheEntry], deadline: float = None) -> Dict[str, Dict]:
+    """
+    Получает питательную ценность для всех топ-N предсказаний записей параллельно
+
+    Каждый продукт запрашивается один раз, даже если он встречается в нескольких
+    записях (см. fetch_nutrition).
+
+    Args:
+        entries: Записи кэша с результатами распознавания
+        deadline: Общий срок на все запросы (сек), по умолчанию NUTRITION_DEADLINE_MS
+
+    Returns:
+        Dict: название продукта -> питательная ценность
+    """
+    nutrition_by_label = {}
+    for entry in entries:
+        if entry.nutrition is not None:
+            nutrition_by_label[entry.result['top_prediction']] = entry.nutrition
+
+    labels = dict.fromkeys(
+        name
+        for entry in entries
+        for name, _ in entry.result['top_predictions']
+        if name not in nutrition_by_label
+    )
+    nutrition_by_label.update(await fetch_nutrition(labels, deadline))
+
+    # Сохраняем питательную ценность топ-предсказания в кэше результатов
+    for entry in entries:
+        label = entry.result['top_prediction']
+        if entry.nutrition is None and label in nutrition_by_label:
+            entry.nutrition = nutrition_by_label[label]
+            prediction_cache.put(entry)
+
+    return nutrition_by_label
+
+
+def build_nutrition_response(result: Dict, nutrition_by_label: Dict[str, Dict], **extra) -> Dict:
+    """
+    Собирает ответ с распознаванием, переводом названий и питательной ценностью
+
+    Args:
+        result: Результат detect_food
+        nutrition_by_label: Питательная ценность по названиям продуктов (см. resolve_nutrition)
+        **extra: Дополнительные поля ответа
+
+    Returns:
+        Dict в формате PredictionWithNutritionResponse
+    """
+    # Проверяем, нашла ли модель что-то
+    if not result['top_prediction']:
+        return dict(
+            top_prediction=None,
+            top_prediction_ru=None,
+            confidence=0.0,
+            top_predictions=[],
+            top_predictions_ru=[],
+            nutrition=None,
+            top_predictions_nutrition=[],
+            **extra
+        )
+
+    # Оценка порции по рамкам детекции (для моделей классификации - None)
+    nutrition = nutrition_by_label.get(result['top_prediction'])
+    portion = estimate_portion(result.get('detections', []), result['top_prediction'])
+
+    # Переводим названия на русский
+    with timed('name_mapping'):
+        top_prediction_ru = label_table.russian_name(result['top_prediction'])
+        top_predictions_ru = [
+            (label_table.russian_name(name), conf)
+            for name, conf in result['top_predictions']
+        ]
+
+    return dict(
+        top_prediction=result['top_prediction'],
+        top_prediction_ru=top_prediction_ru,
+        confidence=result['confidence'],
+        top_predictions=result['top_predictions'],
+        top_predictions_ru=top_predictions_ru,
+        nutrition=nutrition,
+        top_predictions_nutrition=[
+            nutrition_by_label.get(name)
+            for name, _ in result['top_predictions']
+        ],
+        detections=result.get('detections', []),
+        portion=portion,
+        portion_nutrition=scale_nutrition(nutrition, portion['grams']) if nutrition and portion else None,
+        stage=result.get('stage', 'detector'),
+        **extra
+    )
 
 
 @app.get("/")
@@ -81,8 +428,15 @@ async def root():
             "/predict": "POST - Полный анализ изображения",
             "/predict/simple": "POST - Простой анализ изображения",
             "/predict/with-nutrition": "POST - Анализ изображения с информацией о калориях",
+            "/predict/batch": "POST - Анализ нескольких изображений за один запрос",
+            "/predict/plate": "POST - Разбор тарелки на продукты с калорийностью каждого",
+            "/ws/stream": "WebSocket - Распознавание потока кадров камеры",
             "/nutrition/{food_name}": "GET - Получить информацию о калориях по названию продукта",
-            "/health": "GET - Проверка работоспособности"
+            "/health": "GET - Проверка работоспособности",
+            "/ready": "GET - Готовность к инференсу (модель загружена и прогрета)",
+            "/stats": "GET - Статистика очереди инференса и пулов потоков",
+            "/metrics": "GET - Метрики Prometheus (времена этапов, кэши, ошибки)",
+            "/admin/models": "GET/POST - Реестр версий модели, переключение и теневая проверка (ADMIN_TOKEN)"
         }
     }
 
@@ -93,6 +447,40 @@ async def health_check():
     return {"status": "healthy", "message": "API работает нормально"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Готовность к инференсу: 200 только после загрузки и прогрева модели, иначе 503"""
+    status = {**registry.active.manager.status(), 'version': registry.active.name}
+    return JSONResponse(status_code=200 if status['ready'] else 503, content=status)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики в формате Prometheus: времена этапов и запросов, кэши, ошибки, распознанные продукты"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/stats")
+async def stats():
+    """Статистика воркера: память, модель, предобработка, кэши, батчи, загрузка пулов потоков"""
+    return {
+        "pid": os.getpid(),
+        "memory": process_memory(),
+        "model": {**registry.active.manager.status(), "version": registry.active.name},
+        "admission": admission.stats(),
+        "preprocess": preprocess_stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "nutrition_cache": nutrition_cache.stats(),
+        "fatsecret": fatsecret_client.stats(),
+        "streams": streams_stats(),
+        "batching": batcher.stats(),
+        "cascade": cascade.stats(),
+        "labels": label_table.stats(),
+        "name_resolver": name_resolver.stats(),
+        "pools": executors_stats()
+    }
+
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict(file: UploadFile = File(...)):
     """
@@ -107,40 +495,28 @@ async def predict(file: UploadFile = File(...)):
         - confidence: уверенность в процентах (0-100)
         - top_predictions: список топ-5 предсказаний
     """
-    # Проверка типа файла
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(
-            status_code=400,
-            detail="Файл должен быть изображением"
-        )
-
-    # Сохраняем файл временно
-    temp_file_path = UPLOAD_DIR / file.filename
-
     try:
-        with temp_file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         # Анализируем изображение
-        result = detect_food(str(temp_file_path), top_n=5)
+        entry = await analyze_upload(file)
+        result = entry.result
 
         return PredictionResponse(
             top_prediction=result['top_prediction'],
             confidence=result['confidence'],
-            top_predictions=result['top_predictions']
+            top_predictions=result['top_predictions'],
+            detections=result.get('detections', []),
+            stage=result.get('stage', 'detector')
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
+        record_error(type(e).__name__)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при анализе изображения: {str(e)}"
         )
 
-    finally:
-        # Удаляем временный файл
-        if temp_file_path.exists():
-            temp_file_path.unlink()
-
 
 @app.post("/predict/simple", response_model=SimplePredictionResponse)
 async def predict_simple(file: UploadFile = File(...)):
@@ -155,39 +531,26 @@ async def predict_simple(file: UploadFile = File(...)):
         - product: название продукта
         - confidence: уверенность в процентах
     """
-    # Проверка типа файла
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(
-            status_code=400,
-            detail="Файл должен быть изображением"
-        )
-
-    # Сохраняем файл временно
-    temp_file_path = UPLOAD_DIR / file.filename
-
     try:
-        with temp_file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         # Анализируем изображение
-        product, confidence = detect_food_simple(str(temp_file_path))
+        result = (await analyze_upload(file)).result
+        product, confidence = result['top_prediction'], result['confidence']
 
         return SimplePredictionResponse(
             product=product,
-            confidence=confidence
+            confidence=confidence,
+            stage=result.get('stage', 'detector')
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
+        record_error(type(e).__name__)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при анализе изображения: {str(e)}"
         )
 
-    finally:
-        # Удаляем временный файл
-        if temp_file_path.exists():
-            temp_file_path.unlink()
-
 
 @app.post("/predict/with-nutrition", response_model=PredictionWithNutritionResponse)
 async def predict_with_nutrition(file: UploadFile = File(...)):
@@ -203,71 +566,214 @@ async def predict_with_nutrition(file: UploadFile = File(...)):
         - confidence: уверенность в процентах (0-100)
         - top_predictions: список топ-5 предсказаний
         - nutrition: информация о калориях и питательных веществах
+        - top_predictions_nutrition: питательная ценность для каждого из топ-5 предсказаний
+          (null, если не удалось получить за NUTRITION_DEADLINE_MS)
+        - detections: рамки детекции (для моделей детекции)
+        - portion: оценка веса порции топ-предсказания по рамкам (null для моделей классификации)
+        - portion_nutrition: питательная ценность на оцененную порцию
     """
-    # Проверка типа файла
-    if not file.content_type.startswith("image/"):
+    try:
+        # Анализируем изображение
+        entry = await analyze_upload(file)
+        result = entry.result
+
+        # Получаем информацию о питательности для всех топ-N предсказаний параллельно
+        nutrition_by_label = await resolve_nutrition([entry])
+
+        return PredictionWithNutritionResponse(**build_nutrition_response(result, nutrition_by_label))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        record_error(type(e).__name__)
         raise HTTPException(
-            status_code=400,
-            detail="Файл должен быть изображением"
+            status_code=500,
+            detail=f"Ошибка при анализе изображения: {str(e)}"
         )
 
-    # Сохраняем файл временно
-    temp_file_path = UPLOAD_DIR / file.filename
 
-    try:
-        with temp_file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_batch(files: List[UploadFile] = File(...)):
+    """
+    Анализирует несколько изображений за один запрос (например, все блюда на подносе)
 
-        # Анализируем изображение
-        result = detect_food(str(temp_file_path), top_n=5)
-
-        # Проверяем, нашла ли модель что-то
-        if not result['top_prediction']:
-            return PredictionWithNutritionResponse(
-                top_prediction=None,
-                top_prediction_ru=None,
-                confidence=0.0,
-                top_predictions=[],
-                top_predictions_ru=[],
-                nutrition=None
+    Изображения, которых нет в кэше, прогоняются через модель общими батчами,
+    а питательная ценность запрашивается один раз для каждого уникального продукта.
+    Ошибка в одном изображении не прерывает обработку остальных.
+
+    Args:
+        files: Изображения для анализа (не больше MAX_BATCH_IMAGES)
+
+    Returns:
+        JSON с результатами в порядке загрузки:
+        - results: для каждого изображения поля /predict/with-nutrition,
+          имя файла и ошибка (если изображение не удалось обработать)
+        - processed: количество успешно обработанных изображений
+        - failed: количество изображений с ошибкой
+    """
+    if len(files) > config.MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много изображений: {len(files)} (максимум {config.MAX_BATCH_IMAGES})"
+        )
+
+    entries: List[Optional[CacheEntry]] = [None] * len(files)
+    errors: List[Optional[str]] = [None] * len(files)
+
+    # Чтение, поиск в кэше и подготовка всех изображений параллельно
+    lookups = await asyncio.gather(*(lookup_upload(f) for f in files), return_exceptions=True)
+
+    pending = []
+    for i, lookup in enumerate(lookups):
+        if isinstance(lookup, BaseException):
+            if isinstance(lookup, HTTPException):
+                # Ошибка клиента (400/413) - не сбой сервиса
+                errors[i] = lookup.detail
+            else:
+                record_error(type(lookup).__name__)
+                errors[i] = str(lookup)
+            continue
+        sha256, cached, prepared, phash = lookup
+        if cached is not None:
+            entries[i] = cached
+            record_prediction(cached.result['top_prediction'])
+        else:
+            pending.append((i, sha256, prepared, phash))
+
+    # Инференс промахов кэша одним набором батчей
+    if pending:
+        try:
+            results = await run_inference(
+                detect_food_batch, [prepared.image for _, _, prepared, _ in pending],
+                top_n=5, return_exceptions=True,
+                letterboxes=[prepared.letterbox for _, _, prepared, _ in pending]
             )
+        finally:
+            for _, _, prepared, _ in pending:
+                prepared.release()
+
+        for (i, sha256, _, phash), result in zip(pending, results):
+            if isinstance(result, Exception):
+                record_error(type(result).__name__)
+                errors[i] = f"Ошибка при анализе изображения: {result}"
+                continue
+            entries[i] = CacheEntry(sha256, phash, result)
+            prediction_cache.put(entries[i])
+            record_prediction(result['top_prediction'])
+
+    # Питательная ценность - один запрос на уникальный продукт среди всех топ-N
+    nutrition_by_label = await resolve_nutrition([entry for entry in entries if entry is not None])
+
+    items = []
+    for i, file in enumerate(files):
+        entry = entries[i]
+        if entry is None:
+            items.append(BatchItemResponse(filename=file.filename, error=errors[i]))
+            continue
+        items.append(BatchItemResponse(
+            **build_nutrition_response(entry.result, nutrition_by_label, filename=file.filename)
+        ))
+
+    failed = sum(1 for error in errors if error is not None)
+    return BatchPredictionResponse(results=items, processed=len(files) - failed, failed=failed)
+
+
+@app.post("/predict/plate", response_model=PlateResponse)
+async def predict_plate(file: UploadFile = File(...), tiled: Optional[bool] = None):
+    """
+    Разбирает тарелку на отдельные продукты с порцией и калорийностью каждого
 
-        # Получаем информацию о питательности
-        nutrition_data = get_nutrition_info(result['top_prediction'])
-        
-        # Проверяем, есть ли ошибка при получении питательной информации
-        if nutrition_data and 'error' in nutrition_data:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Nutrition data error: {nutrition_data['error']}")
-            nutrition_data = None
-
-        # Переводим названия на русский
-        top_prediction_ru = get_russian_name(result['top_prediction'])
-        top_predictions_ru = [
-            (get_russian_name(name), conf)
-            for name, conf in result['top_predictions']
-        ]
+    В отличие от /predict/with-nutrition возвращаются все найденные экземпляры
+    (после NMS по классам), а не лучшая рамка класса. Для больших фото модель
+    дополнительно прогоняется по перекрывающимся фрагментам, чтобы находить
+    мелкие продукты. Работает только с моделью детекции. Результат не кэшируется.
 
-        return PredictionWithNutritionResponse(
-            top_prediction=result['top_prediction'],
-            top_prediction_ru=top_prediction_ru,
-            confidence=result['confidence'],
-            top_predictions=result['top_predictions'],
-            top_predictions_ru=top_predictions_ru,
-            nutrition=nutrition_data
+    Args:
+        file: Изображение тарелки (jpg, jpeg, png, bmp, webp)
+        tiled: Тайловый проход: true/false, по умолчанию - автоматически
+            для изображений от PLATE_TILE_MIN_SIDE пикселей
+
+    Returns:
+        JSON:
+        - items: продукты по убыванию уверенности (рамка, порция, питательная
+          ценность на 100 г и на порцию)
+        - counts: количество экземпляров каждого продукта
+        - total: суммарный вес и питательная ценность тарелки
+        - plate: рамка тарелки-эталона (если найдена)
+        - tiled, views: был ли тайловый проход и сколько проходов модели выполнено
+    """
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(
+            status_code=400,
+            detail="Файл должен быть изображением"
         )
 
+    try:
+        try:
+            with timed('upload_read'):
+                upload = await read_upload(file)
+            try:
+                plate = await run_inference(prepare_plate, upload.file, tiled)
+                record_stage('decode', plate.timings['decode_ms'])
+                record_stage('preprocess', plate.timings['resize_ms'])
+            finally:
+                upload.close()
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        try:
+            raw, names = await run_inference(
+                detect_boxes_batch,
+                [view.image for view in plate.views],
+                [view.letterbox for view in plate.views]
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            # Возвращаем буферы всех проходов в пул
+            plate.release()
+
+        with timed('postprocess'):
+            detections = merge_views(plate, raw, names)
+
+        # Питательная ценность - один запрос на уникальный продукт тарелки
+        labels = dict.fromkeys(d['label'] for d in detections if d['label'] not in config.PORTION_PLATE_LABELS)
+        nutrition_by_label = await fetch_nutrition(labels)
+
+        result = build_plate(detections, nutrition_by_label)
+        with timed('name_mapping'):
+            names_ru = {label: label_table.russian_name(label) for label in labels}
+        for item in result['items']:
+            item['label_ru'] = names_ru[item['label']]
+            record_prediction(item['label'])
+
+        return PlateResponse(**result, tiled=plate.tiled, views=len(plate.views))
+
+    except HTTPException:
+        raise
     except Exception as e:
+        record_error(type(e).__name__)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при анализе изображения: {str(e)}"
         )
 
-    finally:
-        # Удаляем временный файл
-        if temp_file_path.exists():
-            temp_file_path.unlink()
+
+@app.websocket("/ws/stream")
+async def stream_frames(websocket: WebSocket):
+    """
+    Распознает поток кадров камеры
+
+    Клиент отправляет JPEG-кадры (уменьшенные, до STREAM_MAX_FRAME_KB) бинарными
+    сообщениями. Сервер распознает только последний кадр и только если он заметно
+    отличается от предыдущего распознанного, и отвечает JSON-сообщениями:
+    - {"type": "detections", "frame", "added", "updated", "removed", ...} - изменения продуктов
+    - {"type": "stats", "received", "dropped", "skipped", "inferred", "fps", "fps_per_core", ...}
+    - {"type": "error", "frame", "detail"} - кадр не удалось обработать
+    """
+    await serve_stream(websocket)
 
 
 @app.get("/nutrition/{food_name}")
@@ -275,14 +781,23 @@ async def get_nutrition(food_name: str):
     """
     Получает информацию о калориях и питательных веществах по названию продукта
 
+    Название в свободной форме (русское, с опечатками, во множественном числе)
+    сначала ищется в локальном индексе названий (name_resolver.py); в FatSecret
+    как есть уходят только названия, для которых ничего похожего не нашлось.
+
     Args:
         food_name: Название продукта или блюда
 
     Returns:
-        JSON с информацией о питательности
+        JSON с информацией о питательности; при найденном названии также
+        resolved_name (каноническое название) и match_score (сходство 0..1)
     """
     try:
-        nutrition_data = get_nutrition_info(food_name)
+        with timed('name_mapping'):
+            match = name_resolver.resolve(food_name)
+        with timed('nutrition'):
+            nutrition_data = await get_nutrition_info_async(match.name if match else food_name)
+        metrics.nutrition_total.inc(source=nutrition_data.get('source', 'error'))
 
         if 'error' in nutrition_data:
             raise HTTPException(
@@ -290,17 +805,89 @@ async def get_nutrition(food_name: str):
                 detail=nutrition_data['error']
             )
 
+        if match is not None:
+            nutrition_data = dict(nutrition_data, original_name=food_name,
+                                  resolved_name=match.name, match_score=match.score)
         return nutrition_data
 
     except HTTPException:
         raise
     except Exception as e:
+        record_error(type(e).__name__)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при получении информации о питании: {str(e)}"
         )
 
 
+async def require_admin(authorization: Optional[str] = Header(None)):
+    """Доступ к /admin: заголовок Authorization: Bearer <ADMIN_TOKEN> (без ADMIN_TOKEN эндпоинты выключены)"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Администрирование выключено (не задан ADMIN_TOKEN)")
+    token = (authorization or '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Неверный токен администратора")
+
+
+# Обработчики /admin - обычные функции: FastAPI выполняет их в пуле потоков, потому что
+# реестр читает и блокирует файл состояния, а переключение очищает кэш предсказаний
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+def list_models():
+    """Версии модели, активная версия и результаты теневой проверки"""
+    return registry.stats()
+
+
+@app.post("/admin/models", status_code=202, dependencies=[Depends(require_admin)])
+def register_model(request: ModelVersionRequest):
+    """
+    Регистрирует версию модели; загрузка и прогрев идут в фоне (состояние - в GET /admin/models)
+
+    Args:
+        request: Имя версии, путь к модели внутри MODEL_REGISTRY_DIR и бэкенд
+    """
+    try:
+        version = registry.register(request.name, request.path, request.backend)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"name": version.name, **version.describe()}
+
+
+@app.post("/admin/models/{name}/promote", dependencies=[Depends(require_admin)])
+def promote_model(name: str):
+    """Переключает трафик на готовую версию (кэш предсказаний очищается)"""
+    try:
+        previous = registry.promote(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"active": name, "previous": previous}
+
+
+@app.put("/admin/shadow", dependencies=[Depends(require_admin)])
+def set_shadow_model(request: ShadowRequest):
+    """Включает теневую проверку версии на доле запросов rate (version=null - выключает)"""
+    try:
+        registry.set_shadow(request.version, request.rate)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return registry.stats()["shadow"]
+
+
+@app.delete("/admin/models/{name}", dependencies=[Depends(require_admin)])
+def unregister_model(name: str):
+    """Удаляет неактивную версию из реестра"""
+    try:
+        registry.unregister(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"removed": name}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,213 @@
+"""
+Бэкенды инференса модели на CPU: PyTorch, ONNX Runtime (FP32 и INT8), OpenVINO
+
+Модель обучена в PyTorch (best.pt). Для ONNX и OpenVINO она один раз
+экспортируется рядом с исходным файлом, и дальше загружается готовый граф.
+Экспорт повторяется, только если best.pt новее экспортированной модели.
+Все бэкенды загружаются через ultralytics.YOLO, поэтому результаты имеют
+одинаковый формат и разбираются одним кодом (result_parser.parse_result).
+Квантованную INT8-модель создает скрипт quantize_model.py (нужны калибровочные
+изображения), поэтому автоматически она не экспортируется.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from ultralytics import YOLO
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Потоки инференса процесса (0 - по умолчанию библиотек), см. set_inference_threads
+_inference_threads = 0
+
+# Бэкенд -> формат экспорта ultralytics (None - исходная модель PyTorch
+# или модель, которую создает отдельный скрипт)
+BACKENDS: Dict[str, str] = {
+    'torch': None,
+    'onnx': 'onnx',
+    'onnx-int8': None,
+    'openvino': 'openvino',
+}
+
+
+def exported_path(model_path: str, backend: str) -> str:
+    """
+    Путь, по которому ultralytics сохраняет экспортированную модель
+
+    Args:
+        model_path: Путь к модели PyTorch (.pt)
+        backend: Имя бэкенда из BACKENDS
+
+    Returns:
+        model/best.onnx для onnx, model/best.int8.onnx для onnx-int8,
+        model/best_openvino_model для openvino
+    """
+    stem = os.path.splitext(model_path)[0]
+    if backend == 'onnx':
+        return f'{stem}.onnx'
+    if backend == 'onnx-int8':
+        return f'{stem}.int8.onnx'
+    if backend == 'openvino':
+        return f'{stem}_openvino_model'
+    return model_path
+
+
+def _is_stale(path: str, source: str) -> bool:
+    """Нет экспортированной модели или исходная модель новее нее"""
+    if not os.path.exists(path):
+        return True
+    return os.path.getmtime(source) > os.path.getmtime(path)
+
+
+@contextmanager
+def _export_lock(model_path: str):
+    """Не дает нескольким воркерам экспортировать одну модель одновременно"""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{model_path}.export.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def set_inference_threads(threads: int):
+    """
+    Ограничивает потоки инференса процесса для всех бэкендов
+
+    PyTorch ограничивается сразу. Сессии ONNX Runtime и OpenVINO ultralytics
+    создает при первом прогоне модели, ограничение применяется к ним тогда же
+    (_limit_session_threads), поэтому вызывать функцию нужно до прогрева.
+
+    Args:
+        threads: Число потоков (0 - по умолчанию библиотек, то есть все ядра)
+    """
+    global _inference_threads
+    _inference_threads = max(0, threads)
+    if threads <= 0:
+        return
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def _limit_session_threads(predictor):
+    """
+    Пересоздает сессию ONNX Runtime или OpenVINO с ограничением потоков
+
+    Колбэк on_predict_start ultralytics: вызывается после создания AutoBackend.
+    ultralytics не передает сессии настройки потоков, и каждая сессия занимает
+    все ядра - несколько воркеров gunicorn конкурировали бы за процессор.
+    """
+    backend = predictor.model
+    threads = _inference_threads
+    if threads <= 0 or getattr(backend, 'inference_threads', None) == threads:
+        return
+
+    if getattr(backend, 'onnx', False):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        backend.session = onnxruntime.InferenceSession(
+            str(backend.w), options, providers=backend.session.get_providers()
+        )
+    elif getattr(backend, 'xml', False):
+        # Инференс только на CPU: INFERENCE_NUM_THREADS - свойство плагина CPU
+        backend.ov_compiled_model = backend.core.compile_model(
+            backend.ov_model,
+            device_name='CPU',
+            config={'PERFORMANCE_HINT': backend.inference_mode, 'INFERENCE_NUM_THREADS': threads},
+        )
+    else:
+        return
+    backend.inference_threads = threads
+    logger.info(f'Сессия {backend.w}: потоков инференса {threads}')
+
+
+def ensure_exported(model_path: str, backend: str, imgsz: int = config.MODEL_IMGSZ) -> str:
+    """
+    Экспортирует модель в формат бэкенда, если это еще не сделано
+
+    Args:
+        model_path: Путь к модели PyTorch (.pt)
+        backend: Имя бэкенда из BACKENDS
+        imgsz: Размер входа модели
+
+    Returns:
+        Путь к модели, которую нужно загрузить
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Неизвестный бэкенд модели: {backend} (доступны: {", ".join(BACKENDS)})')
+
+    if backend == 'onnx-int8':
+        target = exported_path(model_path, backend)
+        if not os.path.exists(target):
+            raise FileNotFoundError(
+                f'Квантованная модель {target} не найдена, создайте ее: python quantize_model.py'
+            )
+        if _is_stale(target, model_path):
+            logger.warning(f'{target} старше {model_path}, пересоздайте ее: python quantize_model.py')
+        return target
+
+    export_format = BACKENDS[backend]
+    if export_format is None:
+        return model_path
+
+    target = exported_path(model_path, backend)
+    if not _is_stale(target, model_path):
+        return target
+
+    with _export_lock(model_path):
+        # Пока ждали блокировку, модель мог экспортировать другой процесс
+        if not _is_stale(target, model_path):
+            return target
+
+        logger.info(f'Экспорт {model_path} в {export_format} (imgsz={imgsz})...')
+        started = time.perf_counter()
+        # dynamic=True - граф принимает батч любого размера (нужно для батчинга)
+        exported = YOLO(model_path).export(format=export_format, imgsz=imgsz, dynamic=True)
+        logger.info(f'Модель экспортирована в {exported} за {time.perf_counter() - started:.1f} с')
+        return str(exported)
+
+
+def load_model(
+    backend: str = config.MODEL_BACKEND,
+    model_path: str = config.MODEL_PATH,
+    imgsz: int = config.MODEL_IMGSZ
+) -> YOLO:
+    """
+    Загружает модель для выбранного бэкенда (при необходимости экспортируя ее)
+
+    Args:
+        backend: torch, onnx, onnx-int8 или openvino
+        model_path: Путь к модели PyTorch (.pt)
+        imgsz: Размер входа модели
+
+    Returns:
+        ultralytics.YOLO, готовая к инференсу
+    """
+    path = ensure_exported(model_path, backend, imgsz)
+    logger.info(f'Загрузка модели {path} (бэкенд {backend})')
+    model = YOLO(path)
+    if backend == 'torch':
+        # Объединяем Conv+BN сразу (иначе это делает первый прогон): при загрузке
+        # в мастер-процессе gunicorn объединенные веса будут общими для воркеров
+        model.fuse()
+    else:
+        model.add_callback('on_predict_start', _limit_session_threads)
+    return model
@@ -0,0 +1,258 @@
+"""
+Фоновый анализ папки изображений для gui.py
+
+Изображения декодируются и распознаются в пуле из GUI_BATCH_WORKERS потоков.
+Потоки вызывают detect_food одновременно, поэтому общий планировщик
+(use_model.batcher) собирает их изображения в батчи, как запросы API.
+Результаты по мере готовности кладутся в очередь, которую окно Tk забирает
+через root.after, поэтому интерфейс не блокируется.
+
+Результаты кэшируются в GUI_RESULTS_CACHE по пути файла: запись действительна,
+пока не изменились время изменения и размер файла, а также модель. Повторный
+прогон папки после правки нескольких файлов распознает только их. Строки с
+ошибкой распознавания или питательной ценности не кэшируются.
+"""
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import config
+from labels import label_table
+from nutrition import get_nutrition_info
+from preprocess import prepare_image
+from use_model import detect_food
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = (
+    'file', 'label', 'name_ru', 'confidence', 'stage', 'top_predictions',
+    'calories', 'protein', 'fat', 'carbs', 'nutrition_source', 'seconds', 'error'
+)
+
+
+def model_key() -> str:
+    """Модель, которой получены результаты (смена файла модели или бэкенда сбрасывает кэш)"""
+    try:
+        mtime = os.path.getmtime(config.MODEL_PATH)
+    except OSError:
+        mtime = 0
+    return f'{config.MODEL_BACKEND}:{os.path.abspath(config.MODEL_PATH)}:{mtime:.0f}:{config.CASCADE_MODEL_PATH}'
+
+
+def file_signature(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class ResultCache:
+    """Результаты анализа по пути файла, сохраняемые в JSON"""
+
+    def __init__(self, path: str, model: str):
+        """
+        Args:
+            path: Файл кэша ('' - кэш только в памяти)
+            model: Ключ модели (model_key); записи другой модели не используются
+        """
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = False
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('model') == model:
+                    self._entries = data.get('entries', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f'Не удалось прочитать кэш результатов {path}: {e}')
+
+    def get(self, path: str) -> Optional[Dict]:
+        """Сохраненный результат, если файл не менялся с момента анализа"""
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            if entry['signature'] != file_signature(path):
+                return None
+        except OSError:
+            return None
+        return entry['row']
+
+    def put(self, path: str, signature: List[int], row: Dict):
+        with self._lock:
+            self._entries[os.path.abspath(path)] = {'signature': signature, 'row': row}
+            self._dirty = True
+
+    def save(self):
+        """Записывает кэш на диск (атомарно, через временный файл)"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            data = {'model': self.model, 'entries': dict(self._entries)}
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def analyze_file(path: str) -> Dict:
+    """
+    Распознает одно изображение и получает питательную ценность топ-1 продукта
+
+    Returns:
+        Dict с file, result (формат detect_food), nutrition, seconds и error (None при успехе)
+    """
+    started = time.perf_counter()
+    row = {'file': path, 'result': None, 'nutrition': None, 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            prepared = prepare_image(f)
+        try:
+            result = detect_food(prepared.image, top_n=5, letterbox=prepared.letterbox)
+        finally:
+            prepared.release()
+        # Рамки и размеры не нужны для таблицы, а кэш с ними заметно больше
+        row['result'] = {key: result[key] for key in ('top_prediction', 'confidence', 'top_predictions', 'stage')}
+        if result['top_prediction']:
+            row['nutrition'] = get_nutrition_info(result['top_prediction'])
+    except Exception as e:
+        row['error'] = str(e)
+    row['seconds'] = round(time.perf_counter() - started, 3)
+    return row
+
+
+def csv_row(row: Dict) -> Dict:
+    """Строка CSV (см. CSV_COLUMNS) из результата analyze_file"""
+    result = row.get('result') or {}
+    nutrition = row.get('nutrition') or {}
+    label = result.get('top_prediction') or ''
+    return {
+        'file': row['file'],
+        'label': label,
+        'name_ru': label_table.russian_name(label) if label else '',
+        'confidence': round(result['confidence'], 2) if result else '',
+        'stage': result.get('stage', ''),
+        'top_predictions': '; '.join(f'{name} {conf:.1f}%' for name, conf in result.get('top_predictions', [])),
+        'calories': nutrition.get('calories', ''),
+        'protein': nutrition.get('protein', ''),
+        'fat': nutrition.get('fat', ''),
+        'carbs': nutrition.get('carbs', ''),
+        'nutrition_source': nutrition.get('source', ''),
+        'seconds': row.get('seconds', ''),
+        'error': row.get('error') or nutrition.get('error', ''),
+    }
+
+
+def export_csv(rows: List[Dict], path: str):
+    """Сохраняет результаты в CSV (UTF-8 с BOM, чтобы Excel показал кириллицу)"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(csv_row(row) for row in rows)
+
+
+class BatchAnalyzer:
+    """
+    Анализ списка файлов в пуле потоков
+
+    События в очереди events (забираются потоком Tk):
+        ('result', индекс, строка analyze_file, из кэша ли)
+        ('done', {'total', 'cached', 'failed', 'cancelled', 'seconds'})
+    """
+
+    def __init__(self, workers: int = config.GUI_BATCH_WORKERS, cache: Optional[ResultCache] = None):
+        self.workers = max(1, workers)
+        self.cache = cache if cache is not None else ResultCache(config.GUI_RESULTS_CACHE, model_key())
+        self.events: 'queue.Queue' = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gui-batch')
+        self._lock = threading.Lock()
+        self._run = None
+
+    @property
+    def running(self) -> bool:
+        return self._run is not None
+
+    def start(self, paths: List[str]):
+        """Запускает анализ (файлы с актуальным результатом в кэше сразу отдаются из него)"""
+        if self.running:
+            raise RuntimeError('Анализ папки уже выполняется')
+
+        run = {
+            'total': len(paths), 'remaining': len(paths), 'cached': 0, 'failed': 0,
+            'cancelled': False, 'started': time.perf_counter(),
+        }
+        self._run = run
+        if not paths:
+            self._finish(run)
+            return
+
+        for index, path in enumerate(paths):
+            row = self.cache.get(path)
+            if row is not None:
+                run['cached'] += 1
+                self.events.put(('result', index, row, True))
+                self._complete(run)
+            else:
+                self._executor.submit(self._analyze, run, index, path)
+
+    def cancel(self):
+        """Прекращает анализ: уже запущенные изображения дорабатывают, остальные пропускаются"""
+        run = self._run
+        if run is not None:
+            run['cancelled'] = True
+
+    def _analyze(self, run: Dict, index: int, path: str):
+        try:
+            if run['cancelled']:
+                return
+            signature = file_signature(path)
+            row = analyze_file(path)
+            if row['error'] is not None:
+                with self._lock:
+                    run['failed'] += 1
+            elif 'error' not in (row['nutrition'] or {}):
+                # Ошибка питательной ценности (FatSecret недоступен) временная:
+                # такую строку не кэшируем, чтобы следующий прогон запросил ее снова
+                self.cache.put(path, signature, row)
+            self.events.put(('result', index, row, False))
+        except Exception as e:
+            logger.error(f'Ошибка анализа {path}: {e}', exc_info=True)
+        finally:
+            self._complete(run)
+
+    def _complete(self, run: Dict):
+        with self._lock:
+            run['remaining'] -= 1
+            finished = run['remaining'] == 0
+        if finished:
+            self._finish(run)
+
+    def _finish(self, run: Dict):
+        try:
+            self.cache.save()
+        except OSError as e:
+            logger.warning(f'Не удалось сохранить кэш результатов: {e}')
+        self._run = None
+        self.events.put(('done', {
+            'total': run['total'],
+            'cached': run['cached'],
+            'failed': run['failed'],
+            'cancelled': run['cancelled'],
+            'seconds': round(time.perf_counter() - run['started'], 1),
+        }))
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,219 @@
+"""
+Микро-батчинг инференса: собирает одновременные запросы в один прогон модели
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingItem:
+    """Изображение, ожидающее своей очереди на инференс"""
+
+    __slots__ = ('image', 'future', 'enqueued_at', 'timings')
+
+    def __init__(self, image: Any):
+        self.image = image
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        # Заполняется до завершения future: ожидание в очереди и прогон батча (мс)
+        self.timings: Dict[str, float] = {}
+
+
+class InferenceBatcher:
+    """
+    Планировщик инференса с динамическим батчингом
+
+    Запросы складываются в очередь, фоновый поток забирает первый запрос и
+    добирает к нему остальные, пока не наберется max_batch_size изображений
+    или не истечет max_wait_ms с момента постановки первого в очередь.
+    Затем весь батч прогоняется через run_batch одним вызовом, а результаты
+    раздаются ожидающим вызывающим по порядку.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        name: str = 'inference'
+    ):
+        """
+        Args:
+            run_batch: Функция, принимающая список изображений и возвращающая
+                список результатов той же длины и в том же порядке
+            max_batch_size: Максимальный размер батча
+            max_wait_ms: Максимальное ожидание добора батча (мс)
+            name: Имя планировщика (для логов и имени потока)
+        """
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+
+        self._queue: 'queue.Queue[_PendingItem]' = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._images = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._last_batch_size = 0
+        self._last_batch_ms = 0.0
+        self._total_batch_ms = 0.0
+        self._max_batch_ms = 0.0
+        self._total_wait_ms = 0.0
+
+    def _ensure_worker(self):
+        """Запускает фоновый поток (в том числе заново после fork)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._worker_loop,
+                name=f'{self.name}-batcher',
+                daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, image: Any) -> Future:
+        """
+        Ставит изображение в очередь на инференс
+
+        Args:
+            image: Изображение в любом формате, который понимает run_batch
+
+        Returns:
+            Future, который завершится результатом для этого изображения
+        """
+        return self.submit_timed(image)[0]
+
+    def submit_timed(self, image: Any) -> Tuple[Future, Dict[str, float]]:
+        """
+        Ставит изображение в очередь на инференс и возвращает также его времена
+
+        Returns:
+            Tuple (Future с результатом, Dict с queue_wait_ms, model_forward_ms и
+            batch_started (метка батча), который заполняется к моменту завершения Future)
+        """
+        self._ensure_worker()
+        item = _PendingItem(image)
+        self._queue.put(item)
+
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            with self._stats_lock:
+                self._max_queue_depth = max(self._max_queue_depth, depth)
+
+        return item.future, item.timings
+
+    def infer(self, image: Any, timeout: float = None) -> Any:
+        """
+        Синхронно прогоняет одно изображение через модель (в составе батча)
+
+        Args:
+            image: Изображение
+            timeout: Максимальное время ожидания результата (сек)
+
+        Returns:
+            Результат модели для этого изображения
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def _collect_batch(self) -> List[_PendingItem]:
+        """Забирает из очереди следующий батч"""
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Время вышло - забираем только то, что уже лежит в очереди
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._collect_batch()
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if batch:
+                self._execute(batch)
+
+    def _execute(self, batch: List[_PendingItem]):
+        started = time.perf_counter()
+        wait_ms = sum((started - item.enqueued_at) * 1000 for item in batch)
+
+        try:
+            results = self._run_batch([item.image for item in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f'Модель вернула {len(results)} результатов для батча из {len(batch)} изображений'
+                )
+        except Exception as e:
+            logger.error(f'Ошибка инференса батча из {len(batch)} изображений: {e}', exc_info=True)
+            for item in batch:
+                item.future.set_exception(e)
+            with self._stats_lock:
+                self._errors += 1
+            return
+
+        batch_ms = (time.perf_counter() - started) * 1000
+        for item, result in zip(batch, results):
+            item.timings['queue_wait_ms'] = (started - item.enqueued_at) * 1000
+            item.timings['model_forward_ms'] = batch_ms
+            item.timings['batch_started'] = started
+            item.future.set_result(result)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._images += len(batch)
+            self._last_batch_size = len(batch)
+            self._last_batch_ms = batch_ms
+            self._total_batch_ms += batch_ms
+            self._max_batch_ms = max(self._max_batch_ms, batch_ms)
+            self._total_wait_ms += wait_ms
+
+    def stats(self) -> Dict:
+        """
+        Возвращает статистику планировщика
+
+        Returns:
+            Dict с настройками батчинга, глубиной очереди и задержками батчей
+        """
+        with self._stats_lock:
+            batches = self._batches
+            images = self._images
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': batches,
+                'images': images,
+                'errors': self._errors,
+                'avg_batch_size': round(images / batches, 2) if batches else 0.0,
+                'last_batch_size': self._last_batch_size,
+                'last_batch_ms': round(self._last_batch_ms, 2),
+                'avg_batch_ms': round(self._total_batch_ms / batches, 2) if batches else 0.0,
+                'max_batch_ms': round(self._max_batch_ms, 2),
+                'avg_queue_wait_ms': round(self._total_wait_ms / images, 2) if images else 0.0,
+            }
@@ -0,0 +1,216 @@
+"""
+Оценка точности и пропускной способности моделей на размеченном наборе изображений
+
+Для каждой конфигурации (бэкенд x размер батча) модель загружается в отдельном
+процессе, чтобы пиковый RSS не смешивался между конфигурациями. Изображения
+подготавливаются так же, как в API (prepare_image), по одному батчу перед его
+прогоном: в памяти только текущий батч, а в замеры входит только прогон модели
+и разбор результата. Отчет:
+
+- точность топ-1 и топ-k по метке подпапки;
+- самые частые пары ошибок (метка -> предсказание);
+- p50/p95/p99 задержки прогона батча, изображений в секунду;
+- прирост пикового RSS и RSS после загрузки модели относительно процесса до
+  загрузки модели и изображений.
+
+Набор - папка с подпапками по меткам (imgs/apple/1.jpg); метка сравнивается
+с предсказанием без учета регистра, '_' и '-'.
+
+Использование:
+    python benchmark.py --images dataset
+    python benchmark.py --images dataset --model model/best.pt --backend torch,onnx --batch-size 1,8 --threads 4
+    python benchmark.py --images dataset --backend onnx-int8 --report benchmark.json
+"""
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+
+import config
+from backends import BACKENDS
+from evaluation import list_labeled_images, normalize_label, percentile
+
+
+def measure(
+    backend: str,
+    model_path: str,
+    samples: List[Tuple[str, str]],
+    batch_size: int,
+    threads: int,
+    imgsz: int,
+    top_k: int
+) -> Dict:
+    """
+    Прогоняет набор через модель батчами (выполняется в отдельном процессе)
+
+    Returns:
+        Dict с предсказаниями (топ-k меток каждого изображения), задержками батчей и
+        памятью (прирост относительно процесса до загрузки модели и изображений)
+    """
+    from backends import load_model, set_inference_threads
+    from evaluation import load_images, peak_rss_mb, rss_mb
+    from result_parser import parse_result
+
+    # До загрузки модели: сессии ONNX Runtime и OpenVINO получают ограничение при создании
+    set_inference_threads(threads)
+    paths = [path for path, _ in samples]
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    model = load_model(backend, model_path, imgsz)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    model(load_images(paths[:batch_size], imgsz), verbose=False, batch=batch_size, imgsz=imgsz)  # прогрев
+    model_rss = rss_mb() - rss_before
+
+    predictions = []
+    batch_ms = []
+    for offset in range(0, len(paths), batch_size):
+        batch = load_images(paths[offset:offset + batch_size], imgsz)
+        batch_started = time.perf_counter()
+        results = model(batch, verbose=False, batch=len(batch), imgsz=imgsz)
+        parsed = [parse_result(result, model.names, top_k) for result in results]
+        batch_ms.append((time.perf_counter() - batch_started) * 1000)
+        predictions.extend([name for name, _ in p['top_predictions']] for p in parsed)
+
+    return {
+        'predictions': predictions,
+        'batch_ms': batch_ms,
+        'elapsed_s': sum(batch_ms) / 1000,
+        'load_ms': round(load_ms, 1),
+        'model_rss_mb': round(model_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def score(labels: List[str], predictions: List[List[str]], top_k: int, confusions: int) -> Dict:
+    """
+    Точность топ-1/топ-k и самые частые ошибки топ-1
+
+    Args:
+        labels: Нормализованные метки изображений
+        predictions: Топ-k меток модели для каждого изображения
+        top_k: Сколько меток учитывать для точности топ-k
+        confusions: Сколько пар ошибок вернуть
+
+    Returns:
+        Dict с top1_accuracy, topk_accuracy и confusions [(метка, предсказание, число)]
+    """
+    top1 = topk = 0
+    errors = Counter()
+    for label, names in zip(labels, predictions):
+        names = [normalize_label(name) for name in names]
+        predicted = names[0] if names else ''
+        if predicted == label:
+            top1 += 1
+        else:
+            errors[(label, predicted or '-')] += 1
+        topk += label in names[:top_k]
+    return {
+        'top1_accuracy': round(top1 / len(labels), 4),
+        'topk_accuracy': round(topk / len(labels), 4),
+        'confusions': [[label, predicted, count] for (label, predicted), count in errors.most_common(confusions)],
+    }
+
+
+def run_config(args, samples: List[Tuple[str, str]], labels: List[str], backend: str, batch_size: int) -> Dict:
+    """Замер одной конфигурации в отдельном процессе"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        m = pool.submit(
+            measure, backend, args.model, samples, batch_size, args.threads, args.imgsz, args.top_k
+        ).result()
+
+    batch_ms = m['batch_ms']
+    return {
+        'backend': backend,
+        'batch_size': batch_size,
+        'threads': args.threads,
+        **score(labels, m['predictions'], args.top_k, args.confusions),
+        'p50_ms': round(percentile(batch_ms, 50), 2),
+        'p95_ms': round(percentile(batch_ms, 95), 2),
+        'p99_ms': round(percentile(batch_ms, 99), 2),
+        'images_per_s': round(len(samples) / m['elapsed_s'], 2),
+        'load_ms': m['load_ms'],
+        'model_rss_mb': m['model_rss_mb'],
+        'peak_rss_mb': m['peak_rss_mb'],
+    }
+
+
+def print_report(report: Dict):
+    top_k = report['top_k']
+    print(f'Изображений: {report["images"]}, меток: {report["labels"]}, модель: {report["model"]}, '
+          f'потоков: {report["threads"] or "по умолчанию"}\n')
+    header = (f'{"бэкенд":10} {"батч":>5} {"top-1":>7} {f"top-{top_k}":>7} {"p50 мс":>8} {"p95 мс":>8} '
+              f'{"p99 мс":>8} {"изобр/с":>8} {"пик RSS":>8}')
+    print(header)
+    print('-' * len(header))
+    for r in report['results']:
+        print(
+            f'{r["backend"]:10} {r["batch_size"]:5d} {r["top1_accuracy"]:7.1%} {r["topk_accuracy"]:7.1%} '
+            f'{r["p50_ms"]:8.1f} {r["p95_ms"]:8.1f} {r["p99_ms"]:8.1f} {r["images_per_s"]:8.1f} '
+            f'{r["peak_rss_mb"]:8.1f}'
+        )
+
+    for r in report['results']:
+        if r['confusions']:
+            print(f'\nЧастые ошибки ({r["backend"]}, батч {r["batch_size"]}):')
+            for label, predicted, count in r['confusions']:
+                print(f'  {label:30} -> {predicted:30} {count}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Точность и пропускная способность моделей на размеченном наборе')
+    parser.add_argument('--images', required=True, help='Папка с подпапками по меткам')
+    parser.add_argument('--model', default=config.MODEL_PATH, help='Путь к модели PyTorch (.pt)')
+    parser.add_argument('--backend', default=config.MODEL_BACKEND,
+                        help=f'Бэкенды через запятую ({", ".join(BACKENDS)})')
+    parser.add_argument('--batch-size', default='1', help='Размеры батча через запятую')
+    parser.add_argument('--threads', type=int, default=config.INFERENCE_THREADS,
+                        help='Потоки инференса всех бэкендов (0 - по умолчанию библиотеки)')
+    parser.add_argument('--imgsz', type=int, default=config.MODEL_IMGSZ, help='Размер входа модели')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--confusions', type=int, default=10, help='Сколько частых ошибок показать')
+    parser.add_argument('--report', help='Сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backend.split(',') if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f'Неизвестные бэкенды: {", ".join(unknown)}')
+    batch_sizes = [int(b) for b in args.batch_size.split(',') if b.strip()]
+
+    samples = list_labeled_images(args.images)
+    if not samples:
+        print(f'В папке {args.images} нет подпапок с изображениями')
+        sys.exit(1)
+    labels = [normalize_label(label) for _, label in samples]
+
+    results = []
+    for backend in backends:
+        for batch_size in batch_sizes:
+            print(f'Замер: {backend}, батч {batch_size}...')
+            results.append(run_config(args, samples, labels, backend, batch_size))
+
+    report = {
+        'images': len(samples),
+        'labels': len(set(labels)),
+        'model': args.model,
+        'threads': args.threads,
+        'top_k': args.top_k,
+        'results': results,
+    }
+    print()
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\nОтчет сохранен в {args.report}')
+
+
+if __name__ == '__main__':
+    main()
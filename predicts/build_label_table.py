@@ -0,0 +1,58 @@
+"""
+Сборка таблицы меток модели data/label_table.csv
+
+Для каждого класса модели (model.names) в таблицу попадают английское название
+и название для поиска (food_name_mapper), русское название (food_name_ru) и
+ключ офлайн-таблицы питательной ценности (data/nutrition_table.csv). Таблица
+проверяется по model.names при загрузке модели в API и gui.py (labels.py).
+
+Скрипт выводит метки без русского названия и без офлайн-данных - пробелы
+покрытия видны до деплоя, а не по ответам API.
+
+Использование:
+    python build_label_table.py                      # модель из MODEL_PATH
+    python build_label_table.py --model model/best.pt --check  # ошибка, если есть пробелы покрытия
+"""
+import argparse
+import sys
+
+import config
+from labels import build_label_rows, write_label_table
+
+
+def model_names(model_path: str) -> dict:
+    """Названия классов модели (model.names)"""
+    from ultralytics import YOLO
+    return dict(YOLO(model_path).names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка таблицы меток модели')
+    parser.add_argument('--model', default=config.MODEL_PATH, help='Путь к модели (.pt)')
+    parser.add_argument('--output', default=config.LABEL_TABLE_PATH, help='Куда записать таблицу')
+    parser.add_argument('--check', action='store_true',
+                        help='Завершиться с ошибкой, если есть метки без русского названия или офлайн-данных')
+    args = parser.parse_args()
+
+    rows = build_label_rows(model_names(args.model))
+    write_label_table(rows, args.output)
+    print(f'Записано {len(rows)} меток в {args.output}')
+
+    missing_ru = [row.label for row in rows if not row.name_ru]
+    missing_nutrition = [row for row in rows if not row.nutrition_key]
+    if missing_ru:
+        print(f'\nНет русского названия для {len(missing_ru)} меток (добавьте их в food_name_ru.py):')
+        for label in missing_ru:
+            print(f'  {label}')
+    if missing_nutrition:
+        print(f'\nНет офлайн-данных для {len(missing_nutrition)} меток '
+              f'(добавьте их в data/nutrition_base.csv и запустите build_nutrition_table.py):')
+        for row in missing_nutrition:
+            print(f'  {row.label} -> {row.search_name}')
+
+    if args.check and (missing_ru or missing_nutrition):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Сборка офлайн-таблицы питательной ценности data/nutrition_table.csv
+
+Таблица строится из модулей маппинга (food_name_mapper, food_name_ru) и
+справочника data/nutrition_base.csv, где значения на 100 г заданы по
+каноническим названиям (значениям FOOD_NAME_MAPPING). Для каждой метки
+модели в таблицу попадает строка с каноническим названием и КБЖУ.
+
+Использование:
+    python build_nutrition_table.py                      # пересобрать таблицу
+    python build_nutrition_table.py --model model/best.pt  # дополнительно проверить model.names
+    python build_nutrition_table.py --check              # ошибка, если есть метки без данных
+"""
+import argparse
+import csv
+import os
+import sys
+from typing import Dict, List, Tuple
+
+from food_name_mapper import FOOD_NAME_MAPPING, map_food_name
+from food_name_ru import FOOD_NAME_RU
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BASE_PATH = os.path.join(DATA_DIR, 'nutrition_base.csv')
+TABLE_PATH = os.path.join(DATA_DIR, 'nutrition_table.csv')
+
+NUTRIENTS = ('calories', 'protein', 'fat', 'carbs')
+
+
+def load_base(path: str = BASE_PATH) -> Dict[str, Tuple[float, ...]]:
+    """Читает справочник: каноническое название -> (ккал, белки, жиры, углеводы) на 100 г"""
+    with open(path, encoding='utf-8', newline='') as f:
+        return {
+            row['name'].strip().lower(): tuple(float(row[n]) for n in NUTRIENTS)
+            for row in csv.DictReader(f)
+        }
+
+
+def model_labels(model_path: str) -> List[str]:
+    """Метки классов модели (model.names)"""
+    from ultralytics import YOLO
+    model = YOLO(model_path)
+    return [name.lower() for name in model.names.values()]
+
+
+def collect_labels(extra_labels: List[str] = ()) -> List[str]:
+    """Все известные метки: ключи маппингов, канонические названия и дополнительные метки"""
+    labels = set(FOOD_NAME_MAPPING) | set(FOOD_NAME_RU) | set(FOOD_NAME_MAPPING.values())
+    labels.update(extra_labels)
+    return sorted(label.strip().lower() for label in labels)
+
+
+def build_rows(labels: List[str], base: Dict[str, Tuple[float, ...]]) -> Tuple[List[List], List[str]]:
+    """
+    Сопоставляет метки со справочником
+
+    Returns:
+        Tuple (строки таблицы, метки без данных)
+    """
+    rows = []
+    missing = []
+    for label in labels:
+        if label in FOOD_NAME_MAPPING or label not in base:
+            name = map_food_name(label).strip().lower()
+        else:
+            # Метка уже является каноническим названием
+            name = label
+        values = base.get(name)
+        if values is None:
+            missing.append(label)
+            continue
+        rows.append([label, name, *(format(v, 'g') for v in values)])
+    return rows, missing
+
+
+def write_table(rows: List[List], path: str = TABLE_PATH):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['label', 'name', *NUTRIENTS])
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка офлайн-таблицы питательной ценности')
+    parser.add_argument('--model', help='Путь к модели, чьи model.names тоже должны быть покрыты')
+    parser.add_argument('--check', action='store_true', help='Завершиться с ошибкой, если есть метки без данных')
+    args = parser.parse_args()
+
+    extra = model_labels(args.model) if args.model else []
+    rows, missing = build_rows(collect_labels(extra), load_base())
+    write_table(rows)
+
+    print(f'Записано {len(rows)} меток в {TABLE_PATH}')
+    if missing:
+        print(f'Нет данных для {len(missing)} меток (добавьте их в {BASE_PATH}):')
+        for label in missing:
+            print(f'  {label} -> {map_food_name(label)}')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Каскад моделей: быстрый классификатор, и только при сомнениях - полная модель детекции
+
+Большинство фото - один очевидный продукт (яблоко, банан), для которого полная
+модель детекции избыточна. Если задан CASCADE_MODEL_PATH, изображение сначала
+проходит через маленький классификатор (например, yolov8n-cls с входом
+CASCADE_IMGSZ). Его ответ принимается, если уверенность топ-1 не ниже
+CASCADE_THRESHOLD, а второй класс ниже CASCADE_MULTI_ITEM_CONFIDENCE (иначе на
+фото, вероятно, несколько продуктов). В остальных случаях изображение
+распознает модель детекции. Поле stage результата показывает, какая модель ответила.
+
+Классификатор загружается и прогревается в фоне; пока он не готов, все
+изображения идут сразу в модель детекции. Классы классификатора при загрузке
+сверяются с таблицей меток модели детекции: при расхождении каскад не
+включается. Ошибка классификатора на изображении тоже передает его модели детекции.
+"""
+import logging
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import config
+import result_parser
+from backends import load_model
+from batching import InferenceBatcher
+from labels import label_table
+from metrics import cascade_total, record_stage
+from model_manager import ModelManager
+from preprocess import LETTERBOX_FILL
+from result_parser import Letterbox
+
+logger = logging.getLogger(__name__)
+
+STAGE_CLASSIFIER = 'classifier'
+STAGE_DETECTOR = 'detector'
+
+
+def content_view(image: np.ndarray, letterbox: Optional[Letterbox]) -> np.ndarray:
+    """Часть входа модели с самим изображением (без полей letterbox), как PreparedImage.content"""
+    if letterbox is None or not isinstance(image, np.ndarray):
+        return image
+    scale, (left, top), (width, height) = letterbox
+    return image[top:top + max(1, round(height * scale)), left:left + max(1, round(width * scale))]
+
+
+def accept_classification(parsed: Dict, threshold: float, multi_item_confidence: float) -> bool:
+    """
+    Уверен ли классификатор настолько, чтобы не запускать модель детекции
+
+    Args:
+        parsed: Результат классификатора в формате detect_food (не меньше двух предсказаний)
+        threshold: Минимальная уверенность топ-1 (%)
+        multi_item_confidence: Уверенность второго класса (%), с которой фото считается многопродуктовым
+
+    Returns:
+        True, если ответ классификатора принимается
+    """
+    predictions = parsed['top_predictions']
+    if not predictions or predictions[0][1] < threshold:
+        return False
+    return len(predictions) < 2 or predictions[1][1] < multi_item_confidence
+
+
+class ClassifierCascade:
+    """Первая ступень каскада: классификатор со своим планировщиком батчей"""
+
+    def __init__(
+        self,
+        model_path: str,
+        threshold: float,
+        multi_item_confidence: float,
+        imgsz: int = 224,
+        backend: str = config.MODEL_BACKEND
+    ):
+        """
+        Args:
+            model_path: Путь к модели классификации PyTorch (.pt); пусто - каскад выключен
+            threshold: Минимальная уверенность топ-1 (%), при которой ответ классификатора принимается
+            multi_item_confidence: Уверенность второго класса (%), начиная с которой
+                на фото, вероятно, несколько продуктов
+            imgsz: Размер входа классификатора
+            backend: Бэкенд инференса (см. backends.BACKENDS)
+        """
+        self.model_path = model_path
+        self.threshold = threshold
+        self.multi_item_confidence = multi_item_confidence
+        self.imgsz = imgsz
+        self.backend = backend
+
+        self.manager = ModelManager(self._load, self._warmup)
+        self.batcher = InferenceBatcher(
+            self._run_model,
+            max_batch_size=config.INFERENCE_BATCH_SIZE,
+            max_wait_ms=config.INFERENCE_BATCH_WAIT_MS,
+            name='cascade'
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.model_path)
+
+    @property
+    def active(self) -> bool:
+        """Каскад включен и классификатор готов (иначе изображения идут сразу в модель детекции)"""
+        return self.enabled and self.manager.ready
+
+    def _load(self):
+        model = load_model(self.backend, self.model_path, self.imgsz)
+        if getattr(model, 'task', 'classify') != 'classify':
+            raise ValueError(f'{self.model_path} - не модель классификации (task={model.task})')
+
+        # Ответы классификатора разбираются по его собственным названиям классов: метки,
+        # которых нет в таблице модели детекции, остались бы без русского названия и КБЖУ
+        if not label_table.bound:
+            # Таблица сверяется с моделью детекции при ее загрузке (без прогрева)
+            from use_model import model_manager
+            model_manager.preload()
+        unknown = [
+            name for name in (str(n).strip().lower() for n in model.names.values())
+            if label_table.get(name) is None
+        ]
+        if unknown:
+            raise ValueError(
+                f'Классы классификатора {self.model_path} отсутствуют в таблице меток модели детекции: '
+                f'{", ".join(unknown[:5])}' + (f' и еще {len(unknown) - 5}' if len(unknown) > 5 else '')
+            )
+        return model
+
+    def _warmup(self, model) -> int:
+        image = np.full((self.imgsz, self.imgsz, 3), LETTERBOX_FILL, dtype=np.uint8)
+        runs = 0
+        for batch_size in sorted({1, config.INFERENCE_BATCH_SIZE}):
+            for _ in range(config.MODEL_WARMUP_RUNS):
+                model([image] * batch_size, verbose=False, batch=batch_size, imgsz=self.imgsz)
+                runs += 1
+        return runs
+
+    def _run_model(self, images):
+        return self.manager.get()(images, verbose=False, batch=len(images), imgsz=self.imgsz)
+
+    def start_background(self):
+        """Загружает и прогревает классификатор в фоне (если каскад включен)"""
+        if self.enabled:
+            self.manager.start_background()
+
+    def submit(self, image: np.ndarray, letterbox: Optional[Letterbox] = None) -> Tuple[Future, Dict[str, float]]:
+        """Ставит изображение (без полей letterbox) в очередь классификатора"""
+        return self.batcher.submit_timed(content_view(image, letterbox))
+
+    def finish(self, future: Future, timings: Dict[str, float], top_n: int) -> Optional[Dict]:
+        """
+        Ждет ответ классификатора и решает, принимать ли его
+
+        Returns:
+            Результат в формате detect_food со stage='classifier' или None,
+            если изображение нужно передать модели детекции
+        """
+        result = future.result()
+        record_stage('classifier', timings['queue_wait_ms'] + timings['model_forward_ms'])
+        parsed = result_parser.parse_result(result, self.manager.get().names, max(top_n, 2))
+        if not accept_classification(parsed, self.threshold, self.multi_item_confidence):
+            cascade_total.inc(stage=STAGE_DETECTOR)
+            return None
+
+        cascade_total.inc(stage=STAGE_CLASSIFIER)
+        parsed['top_predictions'] = parsed['top_predictions'][:top_n]
+        parsed['stage'] = STAGE_CLASSIFIER
+        return parsed
+
+    def stats(self) -> Dict:
+        """Настройки каскада, состояние классификатора и его планировщика"""
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'model_path': self.model_path,
+            'threshold': self.threshold,
+            'multi_item_confidence': self.multi_item_confidence,
+            'model': self.manager.status(),
+            'batching': self.batcher.stats(),
+        }
+
+
+cascade = ClassifierCascade(
+    config.CASCADE_MODEL_PATH,
+    threshold=config.CASCADE_THRESHOLD,
+    multi_item_confidence=config.CASCADE_MULTI_ITEM_CONFIDENCE,
+    imgsz=config.CASCADE_IMGSZ
+)
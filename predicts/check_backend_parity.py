@@ -0,0 +1,95 @@
+"""
+Проверка совпадения результатов бэкендов инференса с исходной моделью PyTorch
+
+Для каждого изображения сравниваются топ-k метки и уверенности, которые
+возвращает detect_food (parse_result) на PyTorch и на проверяемом бэкенде.
+Изображения подготавливаются тем же кодом, что и в API (prepare_image).
+
+Использование:
+    python check_backend_parity.py --backend onnx
+    python check_backend_parity.py --backend openvino --images imgs --top-k 5 --tolerance 1.0
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List
+
+import config
+from backends import BACKENDS, load_model
+from evaluation import list_images, load_images
+from result_parser import parse_result
+
+
+def predict(model, images: List, top_k: int) -> List[Dict]:
+    """Прогоняет подготовленные изображения через модель по одному и разбирает результаты"""
+    return [
+        parse_result(model(image, verbose=False, imgsz=config.MODEL_IMGSZ)[0], model.names, top_k)
+        for image in images
+    ]
+
+
+def compare(reference: Dict, candidate: Dict, tolerance: float) -> List[str]:
+    """
+    Сравнивает два результата detect_food
+
+    Returns:
+        Список расхождений (пустой, если результаты совпадают)
+    """
+    problems = []
+    ref_labels = [name for name, _ in reference['top_predictions']]
+    cand_labels = [name for name, _ in candidate['top_predictions']]
+    if ref_labels != cand_labels:
+        problems.append(f'метки {ref_labels} != {cand_labels}')
+
+    for (name, ref_conf), (_, cand_conf) in zip(reference['top_predictions'], candidate['top_predictions']):
+        if abs(ref_conf - cand_conf) > tolerance:
+            problems.append(f'{name}: {ref_conf:.2f}% != {cand_conf:.2f}%')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение бэкенда инференса с PyTorch')
+    parser.add_argument('--backend', required=True, choices=[b for b in BACKENDS if b != 'torch'])
+    parser.add_argument('--model', default=config.MODEL_PATH, help='Путь к модели PyTorch (.pt)')
+    parser.add_argument('--images', default='imgs', help='Папка с изображениями')
+    parser.add_argument('--top-k', type=int, default=5, help='Сколько предсказаний сравнивать')
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help='Допустимая разница уверенности (в процентных пунктах)')
+    args = parser.parse_args()
+
+    paths = list_images(args.images)
+    if not paths:
+        print(f'В папке {args.images} нет изображений')
+        sys.exit(1)
+
+    images = load_images(paths)
+
+    timings = {}
+    results = {}
+    for backend in ('torch', args.backend):
+        model = load_model(backend, args.model)
+        predict(model, images[:1], args.top_k)  # прогрев
+        started = time.perf_counter()
+        results[backend] = predict(model, images, args.top_k)
+        timings[backend] = (time.perf_counter() - started) * 1000 / len(images)
+
+    mismatches = 0
+    for path, reference, candidate in zip(paths, results['torch'], results[args.backend]):
+        problems = compare(reference, candidate, args.tolerance)
+        status = 'OK' if not problems else 'РАСХОЖДЕНИЕ'
+        print(f'{status:12} {os.path.basename(path)}: {reference["top_prediction"]} / {candidate["top_prediction"]}')
+        for problem in problems:
+            print(f'             {problem}')
+        mismatches += bool(problems)
+
+    print(f'\nСовпало {len(paths) - mismatches} из {len(paths)} изображений (top-{args.top_k}, допуск {args.tolerance} п.п.)')
+    for backend, ms in timings.items():
+        print(f'  {backend:10} {ms:.1f} мс/изображение')
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Настройки сервиса CalSnap (берутся из переменных окружения и файла .env)
+"""
+import os
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из .env файла (относительно текущего скрипта)
+env_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(env_path)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Читает целое число из переменной окружения"""
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    """Читает число с плавающей точкой из переменной окружения"""
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    return float(value)
+
+
+# Модель
+MODEL_PATH = os.getenv('MODEL_PATH', 'model/best.pt')
+# Бэкенд инференса: torch, onnx, onnx-int8 или openvino (модель экспортируется из MODEL_PATH один раз)
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'torch').strip().lower()
+# Сторона квадратного входа модели (изображения приводятся к нему letterbox'ом)
+MODEL_IMGSZ = _env_int('MODEL_IMGSZ', 640)
+
+# Сколько прогревочных прогонов модели делать для каждого размера батча перед готовностью
+MODEL_WARMUP_RUNS = _env_int('MODEL_WARMUP_RUNS', 2)
+
+# Потоки инференса (PyTorch, ONNX Runtime, OpenVINO) на воркер gunicorn
+# (0 - поровну делить ядра между воркерами)
+INFERENCE_THREADS = _env_int('INFERENCE_THREADS', 0)
+
+# Микро-батчинг инференса: сколько изображений максимум собираем в один прогон
+# и сколько миллисекунд ждем остальные запросы после первого
+INFERENCE_BATCH_SIZE = _env_int('INFERENCE_BATCH_SIZE', 8)
+INFERENCE_BATCH_WAIT_MS = _env_float('INFERENCE_BATCH_WAIT_MS', 10.0)
+
+# Пулы потоков: инференс модели и сетевые запросы за питательной ценностью
+INFERENCE_POOL_SIZE = _env_int('INFERENCE_POOL_SIZE', max(INFERENCE_BATCH_SIZE * 2, 4))
+NUTRITION_POOL_SIZE = _env_int('NUTRITION_POOL_SIZE', 8)
+
+# Контроль допуска: сколько запросов распознавания обрабатывается одновременно
+# (0 - без ограничения), сколько может ждать в очереди и как долго (сек)
+ADMISSION_MAX_IN_FLIGHT = _env_int('ADMISSION_MAX_IN_FLIGHT', INFERENCE_POOL_SIZE)
+ADMISSION_QUEUE_SIZE = _env_int('ADMISSION_QUEUE_SIZE', 32)
+ADMISSION_QUEUE_TIMEOUT = _env_float('ADMISSION_QUEUE_TIMEOUT', 5.0)
+
+
+def _env_priorities(name: str, default: str) -> dict:
+    """Читает приоритеты вида '/predict/simple=0,/predict=1' (меньше - важнее)"""
+    value = os.getenv(name) or default
+    priorities = {}
+    for item in value.split(','):
+        if item.strip():
+            path, priority = item.rsplit('=', 1)
+            priorities[path.strip()] = int(priority)
+    return priorities
+
+
+# Приоритеты эндпоинтов в очереди: легкие запросы обслуживаются раньше тяжелых
+ADMISSION_PRIORITIES = _env_priorities(
+    'ADMISSION_PRIORITIES',
+    '/predict/simple=0,/predict=1,/predict/with-nutrition=2,/predict/plate=2,/predict/batch=3'
+)
+
+# Максимальное количество изображений в одном запросе /predict/batch
+MAX_BATCH_IMAGES = _env_int('MAX_BATCH_IMAGES', 16)
+
+# Прием загрузок: ограничения размера и порог, после которого файл сбрасывается на диск
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'temp_uploads')
+MAX_UPLOAD_BYTES = _env_int('MAX_UPLOAD_MB', 15) * 1024 * 1024
+UPLOAD_SPOOL_THRESHOLD = _env_int('UPLOAD_SPOOL_THRESHOLD_KB', 4096) * 1024
+MAX_IMAGE_PIXELS = _env_int('MAX_IMAGE_PIXELS', 50_000_000)
+
+# Кэш результатов распознавания: размер, время жизни (сек), порог расстояния
+# между перцептивными хешами (-1 - только точное совпадение) и файл SQLite
+# для сохранения между перезапусками (пусто - только в памяти)
+PREDICTION_CACHE_SIZE = _env_int('PREDICTION_CACHE_SIZE', 1024)
+PREDICTION_CACHE_TTL = _env_float('PREDICTION_CACHE_TTL', 3600)
+PREDICTION_CACHE_PHASH_DISTANCE = _env_int('PREDICTION_CACHE_PHASH_DISTANCE', -1)
+PREDICTION_CACHE_DB = os.getenv('PREDICTION_CACHE_DB', '')
+
+# Кэш питательной ценности: записи свежие NUTRITION_CACHE_FRESH_TTL секунд, затем
+# до NUTRITION_CACHE_STALE_TTL отдаются как есть и обновляются в фоне
+NUTRITION_CACHE_SIZE = _env_int('NUTRITION_CACHE_SIZE', 512)
+NUTRITION_CACHE_FRESH_TTL = _env_float('NUTRITION_CACHE_FRESH_TTL', 7 * 24 * 3600)
+NUTRITION_CACHE_STALE_TTL = _env_float('NUTRITION_CACHE_STALE_TTL', 90 * 24 * 3600)
+NUTRITION_CACHE_DB = os.getenv('NUTRITION_CACHE_DB', 'cache/nutrition.sqlite3')
+
+# Общий срок (мс) на получение питательной ценности всех топ-N предсказаний одного запроса
+NUTRITION_DEADLINE_MS = _env_float('NUTRITION_DEADLINE_MS', 3000.0)
+
+# Офлайн-таблица питательной ценности (основной источник) и режим FatSecret:
+# fallback - только для продуктов, которых нет в таблице; prefer - сначала FatSecret,
+# таблица как запасной вариант; off - FatSecret не используется
+NUTRITION_TABLE_PATH = os.getenv(
+    'NUTRITION_TABLE_PATH',
+    os.path.join(os.path.dirname(__file__), 'data', 'nutrition_table.csv')
+)
+FATSECRET_MODE = os.getenv('FATSECRET_MODE', 'fallback').strip().lower()
+
+# Клиент FatSecret: адрес API (для тестов - fatsecret_stub.py), срок одного запроса (сек)
+# и размер пула keep-alive соединений
+FATSECRET_URL = os.getenv('FATSECRET_URL', 'https://platform.fatsecret.com/rest/server.api')
+FATSECRET_TIMEOUT = _env_float('FATSECRET_TIMEOUT', 3.0)
+FATSECRET_MAX_CONNECTIONS = _env_int('FATSECRET_MAX_CONNECTIONS', 20)
+# Circuit breaker: после стольких ошибок подряд FatSecret не вызывается FATSECRET_BREAKER_RESET секунд
+FATSECRET_BREAKER_FAILURES = _env_int('FATSECRET_BREAKER_FAILURES', 5)
+FATSECRET_BREAKER_RESET = _env_float('FATSECRET_BREAKER_RESET', 30.0)
+
+# Метрики Prometheus (/metrics): каталог для объединения метрик воркеров gunicorn
+# (пусто - каждый воркер отдает только свои) и период сохранения снимков (сек)
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = _env_float('METRICS_FLUSH_INTERVAL', 5.0)
+
+# Оценка порции по рамкам детекции: метки эталона-тарелки, вес полной тарелки и всего кадра (г)
+# и границы оценки (г)
+PORTION_PLATE_LABELS = frozenset(
+    label.strip().lower()
+    for label in os.getenv('PORTION_PLATE_LABELS', 'plate,bowl,dish,tray').split(',')
+    if label.strip()
+)
+PORTION_PLATE_GRAMS = _env_float('PORTION_PLATE_GRAMS', 500.0)
+PORTION_FRAME_GRAMS = _env_float('PORTION_FRAME_GRAMS', 350.0)
+PORTION_MIN_GRAMS = _env_float('PORTION_MIN_GRAMS', 20.0)
+PORTION_MAX_GRAMS = _env_float('PORTION_MAX_GRAMS', 1500.0)
+# Рамки с меньшей уверенностью (%) в оценке порции не учитываются
+PORTION_MIN_CONFIDENCE = _env_float('PORTION_MIN_CONFIDENCE', 25.0)
+
+# Разбор тарелки (/predict/plate): порог IoU для NMS по классам, минимальная уверенность (%),
+# тайловый проход - сетка, перекрытие фрагментов и длинная сторона, с которой он включается автоматически
+PLATE_NMS_IOU = _env_float('PLATE_NMS_IOU', 0.5)
+PLATE_MIN_CONFIDENCE = _env_float('PLATE_MIN_CONFIDENCE', 25.0)
+PLATE_TILE_GRID = _env_int('PLATE_TILE_GRID', 2)
+PLATE_TILE_OVERLAP = _env_float('PLATE_TILE_OVERLAP', 0.2)
+PLATE_TILE_MIN_SIDE = _env_int('PLATE_TILE_MIN_SIDE', 1600)
+
+# Поток кадров камеры (/ws/stream): максимум потоков на воркер и размер кадра,
+# отсев похожих кадров (сторона серой копии и порог средней разницы яркости 0-255),
+# минимальная уверенность (%) и пороги изменения уверенности (%) и сдвига рамки (доля кадра),
+# после которых клиенту отправляется обновление, период отправки статистики (сек)
+STREAM_MAX_CONNECTIONS = _env_int('STREAM_MAX_CONNECTIONS', 8)
+STREAM_MAX_FRAME_BYTES = _env_int('STREAM_MAX_FRAME_KB', 512) * 1024
+STREAM_DIFF_SIZE = _env_int('STREAM_DIFF_SIZE', 32)
+STREAM_DIFF_THRESHOLD = _env_float('STREAM_DIFF_THRESHOLD', 6.0)
+STREAM_MIN_CONFIDENCE = _env_float('STREAM_MIN_CONFIDENCE', 25.0)
+STREAM_CONFIDENCE_DELTA = _env_float('STREAM_CONFIDENCE_DELTA', 5.0)
+STREAM_BOX_DELTA = _env_float('STREAM_BOX_DELTA', 0.03)
+STREAM_STATS_INTERVAL = _env_float('STREAM_STATS_INTERVAL', 2.0)
+
+# Каскад моделей: классификатор (пусто - каскад выключен) и размер его входа; ответ
+# классификатора принимается при уверенности топ-1 от CASCADE_THRESHOLD (%) и второго
+# класса ниже CASCADE_MULTI_ITEM_CONFIDENCE (%), иначе изображение распознает модель детекции
+CASCADE_MODEL_PATH = os.getenv('CASCADE_MODEL_PATH', '')
+CASCADE_IMGSZ = _env_int('CASCADE_IMGSZ', 224)
+CASCADE_THRESHOLD = _env_float('CASCADE_THRESHOLD', 85.0)
+CASCADE_MULTI_ITEM_CONFIDENCE = _env_float('CASCADE_MULTI_ITEM_CONFIDENCE', 10.0)
+
+# Таблица меток модели (build_label_table.py); при LABEL_TABLE_STRICT=1 расхождение
+# с model.names - ошибка загрузки модели, иначе таблица строится из model.names
+LABEL_TABLE_PATH = os.getenv(
+    'LABEL_TABLE_PATH',
+    os.path.join(os.path.dirname(__file__), 'data', 'label_table.csv')
+)
+LABEL_TABLE_STRICT = os.getenv('LABEL_TABLE_STRICT', '0') == '1'
+
+# Нечеткий поиск продукта по названию в GET /nutrition: минимальное сходство
+# триграмм (0..1), ниже которого название передается в FatSecret как есть
+NAME_RESOLVER_MIN_SCORE = _env_float('NAME_RESOLVER_MIN_SCORE', 0.5)
+
+# Реестр версий модели (model_registry.py). Эндпоинты /admin доступны только
+# при заданном ADMIN_TOKEN; модели загружаются только из MODEL_REGISTRY_DIR.
+# MODEL_REGISTRY_PATH - общий файл состояния для нескольких воркеров (пусто - только
+# воркер, получивший запрос), воркеры читают его раз в MODEL_REGISTRY_POLL_INTERVAL сек
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', os.path.dirname(MODEL_PATH) or '.')
+MODEL_REGISTRY_PATH = os.getenv('MODEL_REGISTRY_PATH', '')
+MODEL_REGISTRY_POLL_INTERVAL = _env_float('MODEL_REGISTRY_POLL_INTERVAL', 5.0)
+
+# Теневая проверка кандидата: доля запросов по умолчанию и сколько изображений
+# может ждать кандидата (остальные пропускаются, чтобы не копить память)
+SHADOW_SAMPLE_RATE = _env_float('SHADOW_SAMPLE_RATE', 0.1)
+SHADOW_MAX_PENDING = _env_int('SHADOW_MAX_PENDING', 4)
+
+# gui.py: потоки анализа папки (изображения из них собираются в общие батчи инференса)
+# и файл кэша результатов по mtime файлов (пусто - кэш только в памяти)
+GUI_BATCH_WORKERS = _env_int('GUI_BATCH_WORKERS', INFERENCE_BATCH_SIZE)
+GUI_RESULTS_CACHE = os.getenv('GUI_RESULTS_CACHE', 'cache/gui_results.json')
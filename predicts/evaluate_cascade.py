@@ -0,0 +1,139 @@
+"""
+Оценка каскада классификатор -> модель детекции на размеченном наборе изображений
+
+Каждое изображение по одному прогоняется через обе модели (как запрос API без
+батчинга), замеряются задержка и процессорное время. Затем для каждого порога
+CASCADE_THRESHOLD из --thresholds каскад моделируется по этим замерам:
+принятые классификатором изображения стоят только его прогона, остальные -
+прогона обеих моделей. Для сравнения выводится модель детекции без каскада.
+
+Набор - папка с подпапками по меткам (imgs/apple/1.jpg); метка сравнивается
+с топ-1 предсказанием без учета регистра, '_' и '-'.
+
+Использование:
+    python evaluate_cascade.py --images dataset --classifier model/cls.pt
+    python evaluate_cascade.py --images dataset --classifier model/cls.pt --thresholds 70,80,90 --report cascade.json
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List
+
+import config
+from backends import BACKENDS, load_model
+from cascade import accept_classification, content_view
+from evaluation import list_labeled_images, load_inputs, normalize_label, percentile
+from result_parser import parse_result
+
+
+def measure(model, images: List, imgsz: int) -> List[Dict]:
+    """
+    Прогоняет изображения через модель по одному
+
+    Returns:
+        Для каждого изображения: результат parse_result (top_n=5), 'ms' и 'cpu_ms'
+    """
+    model(images[0], verbose=False, imgsz=imgsz)  # прогрев
+    measured = []
+    for image in images:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        result = model(image, verbose=False, imgsz=imgsz)[0]
+        ms = (time.perf_counter() - started) * 1000
+        cpu_ms = (time.process_time() - cpu_started) * 1000
+        parsed = parse_result(result, model.names, 5)
+        parsed.update(ms=ms, cpu_ms=cpu_ms)
+        measured.append(parsed)
+    return measured
+
+
+def summarize(name: str, labels: List[str], answers: List[Dict], ms: List[float], cpu_ms: List[float]) -> Dict:
+    """Точность топ-1, задержка и процессорное время одного варианта"""
+    correct = sum(normalize_label(a['top_prediction'] or '') == label for a, label in zip(answers, labels))
+    return {
+        'variant': name,
+        'accuracy': round(correct / len(labels), 4),
+        'mean_ms': round(sum(ms) / len(ms), 2),
+        'p95_ms': round(percentile(ms, 95), 2),
+        'mean_cpu_ms': round(sum(cpu_ms) / len(cpu_ms), 2),
+    }
+
+
+def simulate(
+    labels: List[str],
+    classified: List[Dict],
+    detected: List[Dict],
+    threshold: float,
+    multi_item_confidence: float
+) -> Dict:
+    """Каскад с порогом threshold по замерам обеих моделей"""
+    answers, ms, cpu_ms = [], [], []
+    accepted = 0
+    for cls_result, det_result in zip(classified, detected):
+        if accept_classification(cls_result, threshold, multi_item_confidence):
+            accepted += 1
+            answers.append(cls_result)
+            ms.append(cls_result['ms'])
+            cpu_ms.append(cls_result['cpu_ms'])
+        else:
+            answers.append(det_result)
+            ms.append(cls_result['ms'] + det_result['ms'])
+            cpu_ms.append(cls_result['cpu_ms'] + det_result['cpu_ms'])
+
+    summary = summarize(f'cascade@{threshold:g}', labels, answers, ms, cpu_ms)
+    summary['threshold'] = threshold
+    summary['classifier_share'] = round(accepted / len(labels), 4)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Оценка каскада классификатор -> модель детекции')
+    parser.add_argument('--images', required=True, help='Папка с подпапками по меткам')
+    parser.add_argument('--classifier', default=config.CASCADE_MODEL_PATH or None, required=not config.CASCADE_MODEL_PATH,
+                        help='Модель классификации (.pt), по умолчанию CASCADE_MODEL_PATH')
+    parser.add_argument('--detector', default=config.MODEL_PATH, help='Модель детекции (.pt)')
+    parser.add_argument('--backend', default=config.MODEL_BACKEND, choices=list(BACKENDS))
+    parser.add_argument('--thresholds', default='60,70,80,85,90,95',
+                        help='Пороги уверенности классификатора (%%) через запятую')
+    parser.add_argument('--multi-item', type=float, default=config.CASCADE_MULTI_ITEM_CONFIDENCE,
+                        help='Уверенность второго класса (%%), с которой запускается модель детекции')
+    parser.add_argument('--report', help='Сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    samples = list_labeled_images(args.images)
+    if not samples:
+        print(f'В папке {args.images} нет подпапок с изображениями')
+        sys.exit(1)
+
+    paths = [path for path, _ in samples]
+    labels = [normalize_label(label) for _, label in samples]
+    inputs = load_inputs(paths)
+
+    detector = load_model(args.backend, args.detector)
+    detected = measure(detector, [image for image, _ in inputs], config.MODEL_IMGSZ)
+
+    classifier = load_model(args.backend, args.classifier, config.CASCADE_IMGSZ)
+    classified = measure(classifier, [content_view(image, letterbox) for image, letterbox in inputs], config.CASCADE_IMGSZ)
+
+    results = [summarize('detector', labels, detected, [r['ms'] for r in detected], [r['cpu_ms'] for r in detected])]
+    results[0].update(threshold=None, classifier_share=0.0)
+    for threshold in (float(t) for t in args.thresholds.split(',') if t.strip()):
+        results.append(simulate(labels, classified, detected, threshold, args.multi_item))
+
+    print(f'Изображений: {len(samples)}, меток: {len(set(labels))}, второй класс < {args.multi_item:g}%\n')
+    print(f'{"вариант":16} {"top-1":>7} {"класс.":>7} {"мс":>8} {"p95 мс":>8} {"CPU мс":>8}')
+    for r in results:
+        print(
+            f'{r["variant"]:16} {r["accuracy"]:7.1%} {r["classifier_share"]:7.1%} '
+            f'{r["mean_ms"]:8.1f} {r["p95_ms"]:8.1f} {r["mean_cpu_ms"]:8.1f}'
+        )
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'images': len(samples), 'multi_item_confidence': args.multi_item, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f'\nОтчет сохранен в {args.report}')
+
+
+if __name__ == '__main__':
+    main()
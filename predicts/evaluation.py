@@ -0,0 +1,119 @@
+"""
+Общие функции для скриптов оценки моделей: наборы изображений, память процесса, сравнение предсказаний
+"""
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import psutil
+
+import config
+from preprocess import prepare_image
+from result_parser import Letterbox
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(directory: str) -> List[str]:
+    """Все изображения в папке (без подпапок)"""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def list_labeled_images(directory: str) -> List[Tuple[str, str]]:
+    """
+    Размеченный набор: подпапка - метка, например imgs/apple/1.jpg
+
+    Returns:
+        Список (путь, метка) по алфавиту меток
+    """
+    samples = []
+    for label in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, label)
+        if os.path.isdir(folder):
+            samples.extend((path, label) for path in list_images(folder))
+    return samples
+
+
+def normalize_label(label: str) -> str:
+    """Метка для сравнения с предсказанием: без регистра, '_' и '-' как пробелы"""
+    return ' '.join(label.lower().replace('_', ' ').replace('-', ' ').split())
+
+
+def load_inputs(paths: List[str], imgsz: int = config.MODEL_IMGSZ) -> List[Tuple[np.ndarray, Letterbox]]:
+    """
+    Как load_images, но вместе с параметрами letterbox каждого изображения
+
+    Returns:
+        Список (буфер imgsz x imgsz (BGR), PreparedImage.letterbox)
+    """
+    inputs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            prepared = prepare_image(f, imgsz)
+        inputs.append((prepared.image.copy(), prepared.letterbox))
+        prepared.release()
+    return inputs
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0-100); 0.0 для пустого списка"""
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def load_images(paths: List[str], imgsz: int = config.MODEL_IMGSZ) -> List[np.ndarray]:
+    """
+    Подготавливает изображения так же, как API (prepare_image)
+
+    Returns:
+        Список буферов imgsz x imgsz (BGR), скопированных из пула
+    """
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            prepared = prepare_image(f, imgsz)
+        # Копия буфера: пул переиспользует его для следующего изображения
+        images.append(prepared.image.copy())
+        prepared.release()
+    return images
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (МБ)"""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса (МБ); на Windows - текущий"""
+    if resource is None:
+        return rss_mb()
+    # В Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def top1_agreement(reference: List[Dict], candidate: List[Dict]) -> float:
+    """Доля изображений, для которых совпадает топ-1 метка"""
+    if not reference:
+        return 0.0
+    same = sum(r['top_prediction'] == c['top_prediction'] for r, c in zip(reference, candidate))
+    return same / len(reference)
+
+
+def topk_agreement(reference: List[Dict], candidate: List[Dict], k: int = 5) -> float:
+    """Средняя доля топ-k меток эталона, которые есть в топ-k проверяемой модели"""
+    if not reference:
+        return 0.0
+    shares = []
+    for r, c in zip(reference, candidate):
+        ref_labels = {name for name, _ in r['top_predictions'][:k]}
+        cand_labels = {name for name, _ in c['top_predictions'][:k]}
+        shares.append(len(ref_labels & cand_labels) / len(ref_labels) if ref_labels else float(not cand_labels))
+    return sum(shares) / len(shares)
@@ -0,0 +1,145 @@
+"""
+Пулы потоков для блокирующей работы: инференс модели и запросы за питательной ценностью
+
+Эндпоинты FastAPI асинхронные, поэтому всё, что блокирует (модель, сетевые
+запросы к FatSecret), выполняется в отдельных ограниченных пулах и не
+останавливает event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import config
+
+
+class MonitoredExecutor:
+    """Ограниченный пул потоков с учетом загрузки"""
+
+    def __init__(self, name: str, max_workers: int):
+        """
+        Args:
+            name: Имя пула (префикс имен потоков и ключ в статистике)
+            max_workers: Максимальное количество потоков
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=f'{name}-pool'
+        )
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._max_pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_run_ms = 0.0
+        self._total_wait_ms = 0.0
+
+    def _call(self, submitted_at: float, fn: Callable, *args, **kwargs) -> Any:
+        """Выполняет функцию в потоке пула, считая время ожидания и работы"""
+        started = time.perf_counter()
+        with self._lock:
+            self._active += 1
+            self._total_wait_ms += (started - submitted_at) * 1000
+
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._failed += int(failed)
+                self._total_run_ms += (time.perf_counter() - started) * 1000
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Выполняет блокирующую функцию в пуле и ожидает результат
+
+        Контекст (contextvars) вызывающей корутины переносится в поток пула.
+
+        Args:
+            fn: Блокирующая функция
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Результат функции
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self._call, time.perf_counter(), fn, *args, **kwargs)
+
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._max_pending, self._pending)
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict:
+        """
+        Возвращает статистику загрузки пула
+
+        Returns:
+            Dict с размером пула, количеством активных и ожидающих задач
+        """
+        with self._lock:
+            completed = self._completed
+            return {
+                'max_workers': self.max_workers,
+                'active': self._active,
+                'queued': max(0, self._pending - self._active),
+                'max_in_flight': self._max_pending,
+                'saturation': round(self._active / self.max_workers, 2),
+                'completed': completed,
+                'failed': self._failed,
+                'avg_run_ms': round(self._total_run_ms / completed, 2) if completed else 0.0,
+                'avg_wait_ms': round(self._total_wait_ms / completed, 2) if completed else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Останавливает пул"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Пул для инференса: потоки ждут результат в планировщике батчей,
+# поэтому размер пула должен быть не меньше INFERENCE_BATCH_SIZE
+inference_executor = MonitoredExecutor('inference', config.INFERENCE_POOL_SIZE)
+
+# Пул для сетевых запросов к сервисам питательной ценности
+nutrition_executor = MonitoredExecutor('nutrition', config.NUTRITION_POOL_SIZE)
+
+
+async def run_inference(fn: Callable, *args, **kwargs) -> Any:
+    """Выполняет функцию, работающую с моделью, в пуле инференса"""
+    return await inference_executor.run(fn, *args, **kwargs)
+
+
+async def run_nutrition(fn: Callable, *args, **kwargs) -> Any:
+    """Выполняет запрос за питательной ценностью в сетевом пуле"""
+    return await nutrition_executor.run(fn, *args, **kwargs)
+
+
+def executors_stats() -> Dict:
+    """Статистика всех пулов"""
+    return {
+        inference_executor.name: inference_executor.stats(),
+        nutrition_executor.name: nutrition_executor.stats(),
+    }
+
+
+def shutdown_executors():
+    """Останавливает все пулы (при остановке приложения)"""
+    inference_executor.shutdown(wait=False)
+    nutrition_executor.shutdown(wait=False)
@@ -0,0 +1,314 @@
+"""
+Асинхронный клиент FatSecret API: пул соединений с keep-alive, подпись OAuth1 и circuit breaker
+
+Один долгоживущий httpx.AsyncClient на процесс переиспользует TCP/TLS-соединения
+между запросами. Если FatSecret недоступен, circuit breaker после нескольких
+ошибок подряд на время перестает обращаться к нему и сразу возвращает ошибку,
+чтобы запросы не занимали воркеры до таймаута.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+import httpx
+from oauthlib.oauth1 import Client as OAuth1Client
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_NUTRIENT_PATTERNS = {
+    'calories': re.compile(r'Calories:\s*([\d.]+)'),
+    'fat': re.compile(r'Fat:\s*([\d.]+)'),
+    'carbs': re.compile(r'Carbs:\s*([\d.]+)'),
+    'protein': re.compile(r'Protein:\s*([\d.]+)'),
+}
+# Основа значений в начале описания: "Per 100g", "Per 28g" (граммы) или "Per 1 serving", "Per 1 cup"
+_BASIS_PATTERN = re.compile(r'Per\s+(.+?)\s+-')
+_GRAMS_PATTERN = re.compile(r'([\d.]+)\s*g$')
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker: closed -> (failure_threshold ошибок подряд) -> open ->
+    (через reset_timeout) -> half_open -> один пробный запрос -> closed или open
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Сколько ошибок подряд размыкают цепь
+            reset_timeout: Через сколько секунд пробовать снова (сек)
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._opened_total = 0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return self._state
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = 'half_open'
+            if self._state == 'half_open' and not self._trial_in_flight:
+                # Пропускаем один пробный запрос
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Запрос прерван без результата (например, отменен): пробным может стать следующий"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self._opened_total += 1
+                    logger.warning(f'FatSecret недоступен, запросы приостановлены на {self.reset_timeout:.0f} с')
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'opened_total': self._opened_total,
+                'rejected': self._rejected,
+            }
+
+
+def search_params(mapped_name: str) -> Dict[str, str]:
+    """Параметры метода foods.search (первый найденный продукт)"""
+    return {
+        'method': 'foods.search',
+        'search_expression': mapped_name,
+        'max_results': '1',
+        'format': 'json'
+    }
+
+
+def parse_search_response(data: Dict, mapped_name: str) -> Dict:
+    """
+    Разбирает ответ foods.search в формат get_nutrition_info
+
+    Args:
+        data: JSON-ответ FatSecret
+        mapped_name: Название продукта после маппинга
+
+    Returns:
+        Dict с информацией о калориях и питательных веществах или с ключом 'error'.
+        Если основа описания в граммах, значения приводятся к 100 г (per_grams=100);
+        для основы не в граммах (порция, чашка) per_grams=None, а basis - основа FatSecret
+    """
+    # Проверяем, есть ли результаты
+    if 'foods' not in data or 'food' not in data['foods']:
+        return {
+            'error': f'Блюдо "{mapped_name}" не найдено в базе данных FatSecret'
+        }
+
+    food = data['foods']['food']
+    if isinstance(food, list):
+        food = food[0]
+
+    # Формат описания: "Per 100g - Calories: 254kcal | Fat: 20.00g | Carbs: 0.00g | Protein: 17.17g"
+    description = food.get('food_description', '')
+    values = {}
+    for name, pattern in _NUTRIENT_PATTERNS.items():
+        match = pattern.search(description)
+        values[name] = float(match.group(1)) if match else 0
+
+    match = _BASIS_PATTERN.match(description)
+    basis = match.group(1) if match else None
+    grams = _GRAMS_PATTERN.match(basis) if basis else None
+    per_grams = None
+    if grams is not None and float(grams.group(1)) > 0:
+        factor = 100 / float(grams.group(1))
+        values = {name: round(value * factor, 2) for name, value in values.items()}
+        per_grams = 100
+
+    return {
+        'title': food.get('food_name', mapped_name),
+        'calories': values['calories'],
+        'protein': values['protein'],
+        'fat': values['fat'],
+        'carbs': values['carbs'],
+        'calories_unit': 'kcal',
+        'protein_unit': 'g',
+        'fat_unit': 'g',
+        'carbs_unit': 'g',
+        'per_grams': per_grams,
+        'basis': basis,
+        'source': 'fatsecret'
+    }
+
+
+class FatSecretClient:
+    """Асинхронный клиент FatSecret с пулом соединений (один на процесс)"""
+
+    def __init__(
+        self,
+        consumer_key: str,
+        consumer_secret: str,
+        url: str = config.FATSECRET_URL,
+        timeout: float = config.FATSECRET_TIMEOUT,
+        max_connections: int = config.FATSECRET_MAX_CONNECTIONS,
+        breaker: CircuitBreaker = None
+    ):
+        """
+        Args:
+            consumer_key: FATSECRET_CONSUMER_KEY
+            consumer_secret: FATSECRET_CONSUMER_SECRET
+            url: Адрес REST API (для тестов - адрес fatsecret_stub.py)
+            timeout: Срок одного запроса по умолчанию (сек)
+            max_connections: Максимум одновременных соединений в пуле
+            breaker: Circuit breaker (общий с синхронным клиентом)
+        """
+        self.url = url
+        self.timeout = timeout
+        self.max_connections = max(1, int(max_connections))
+        self.breaker = breaker or CircuitBreaker()
+        self._signer = OAuth1Client(consumer_key, client_secret=consumer_secret) if consumer_key else None
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_pid = None
+
+        self._requests = 0
+        self._errors = 0
+        self._total_ms = 0.0
+
+    @property
+    def configured(self) -> bool:
+        return self._signer is not None
+
+    def _http(self) -> httpx.AsyncClient:
+        """HTTP-клиент текущего процесса (создается при первом запросе и заново после fork)"""
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0
+                )
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    def _signed_request(self, params: Dict[str, str]):
+        """Подписывает POST-запрос OAuth1 (HMAC-SHA1, подпись в заголовке Authorization)"""
+        body = urlencode(params)
+        _, headers, body = self._signer.sign(
+            self.url,
+            http_method='POST',
+            body=body,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        return headers, body
+
+    async def search(self, mapped_name: str, deadline: float = None) -> Dict:
+        """
+        Ищет продукт в FatSecret и возвращает его питательную ценность
+
+        Args:
+            mapped_name: Название продукта после маппинга
+            deadline: Срок запроса (сек), по умолчанию timeout клиента
+
+        Returns:
+            Dict в формате get_nutrition_info или с ключом 'error'
+        """
+        if not self.configured:
+            return {
+                'error': 'FatSecret API ключи не найдены. Добавьте FATSECRET_CONSUMER_KEY и FATSECRET_CONSUMER_SECRET в .env файл'
+            }
+        if not self.breaker.allow():
+            return {'error': 'FatSecret временно недоступен'}
+
+        headers, body = self._signed_request(search_params(mapped_name))
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self._http().post(self.url, content=body, headers=headers),
+                deadline or self.timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            self.breaker.record_failure()
+            self._errors += 1
+            # Первая строка: сообщения httpx многострочные, у таймаута сообщения нет
+            reason = str(e).splitlines()[0] if str(e) else type(e).__name__
+            error_msg = f'Ошибка при запросе к API: {reason}'
+            logger.error(error_msg)
+            return {'error': error_msg}
+        except BaseException:
+            # CancelledError (клиент отключился, истек срок запроса API): без этого
+            # пробный запрос half_open считался бы выполняющимся навсегда
+            self.breaker.release()
+            raise
+        finally:
+            self._requests += 1
+            self._total_ms += (time.perf_counter() - started) * 1000
+
+        self.breaker.record_success()
+        return parse_search_response(data, mapped_name)
+
+    async def aclose(self):
+        """Закрывает соединения (при остановке приложения)"""
+        if self._client is not None and self._client_pid == os.getpid():
+            await self._client.aclose()
+        self._client = None
+
+    def stats(self) -> Dict:
+        """Количество запросов, ошибок, средняя задержка и состояние circuit breaker"""
+        return {
+            'configured': self.configured,
+            'requests': self._requests,
+            'errors': self._errors,
+            'avg_ms': round(self._total_ms / self._requests, 2) if self._requests else 0.0,
+            'breaker': self.breaker.stats(),
+        }
+
+
+# Общий circuit breaker для асинхронного и синхронного (nutrition.fetch_fatsecret_nutrition) клиентов
+breaker = CircuitBreaker(
+    failure_threshold=config.FATSECRET_BREAKER_FAILURES,
+    reset_timeout=config.FATSECRET_BREAKER_RESET
+)
+
+fatsecret_client = FatSecretClient(
+    os.getenv('FATSECRET_CONSUMER_KEY', ''),
+    os.getenv('FATSECRET_CONSUMER_SECRET', ''),
+    breaker=breaker
+)
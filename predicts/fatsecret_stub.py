@@ -0,0 +1,105 @@
+"""
+Локальная заглушка FatSecret API для проверки клиента без ключей и сети
+
+Отвечает на foods.search данными из data/nutrition_base.csv в формате FatSecret,
+проверяет наличие подписи OAuth1 и умеет имитировать задержку и сбои.
+
+Использование:
+    python fatsecret_stub.py --port 8900 --latency-ms 200 --fail-rate 0.3
+    FATSECRET_URL=http://127.0.0.1:8900/rest/server.api FATSECRET_MODE=prefer \\
+        FATSECRET_CONSUMER_KEY=stub FATSECRET_CONSUMER_SECRET=stub uvicorn app:app
+
+Режим можно менять на ходу (например, чтобы разомкнуть circuit breaker):
+    curl -X POST 'http://127.0.0.1:8900/control?fail_rate=1'
+"""
+import argparse
+import asyncio
+import csv
+import os
+import random
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BASE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'nutrition_base.csv')
+
+app = FastAPI(title='FatSecret stub')
+
+settings = {'latency_ms': 0.0, 'fail_rate': 0.0}
+counters = {'requests': 0, 'failed': 0, 'unsigned': 0}
+
+
+def _load_foods(path: str) -> Dict[str, Dict]:
+    """Название (в нижнем регистре) -> строка базовой таблицы"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return {row['name'].strip().lower(): row for row in csv.DictReader(f)}
+
+
+foods = _load_foods(BASE_PATH)
+
+
+@app.post('/rest/server.api')
+async def server_api(request: Request):
+    counters['requests'] += 1
+    if not request.headers.get('authorization', '').startswith('OAuth '):
+        counters['unsigned'] += 1
+        return JSONResponse({'error': {'code': 2, 'message': 'Missing OAuth signature'}}, status_code=401)
+
+    if settings['latency_ms']:
+        await asyncio.sleep(settings['latency_ms'] / 1000)
+    if random.random() < settings['fail_rate']:
+        counters['failed'] += 1
+        return JSONResponse({'error': {'code': 12, 'message': 'Stub failure'}}, status_code=503)
+
+    form = await request.form()
+    query = str(form.get('search_expression', '')).strip().lower()
+    row = foods.get(query)
+    if row is None:
+        return {'foods': {'max_results': '1', 'total_results': '0', 'page_number': '0'}}
+
+    return {
+        'foods': {
+            'food': {
+                'food_id': str(abs(hash(query)) % 10 ** 7),
+                'food_name': row['name'],
+                'food_type': 'Generic',
+                'food_description': (
+                    f"Per 100g - Calories: {float(row['calories']):.0f}kcal | Fat: {float(row['fat']):.2f}g"
+                    f" | Carbs: {float(row['carbs']):.2f}g | Protein: {float(row['protein']):.2f}g"
+                ),
+            },
+            'max_results': '1',
+            'total_results': '1',
+            'page_number': '0',
+        }
+    }
+
+
+@app.post('/control')
+async def control(latency_ms: float = None, fail_rate: float = None):
+    """Меняет задержку и долю сбоев"""
+    if latency_ms is not None:
+        settings['latency_ms'] = latency_ms
+    if fail_rate is not None:
+        settings['fail_rate'] = fail_rate
+    return {'settings': settings, 'counters': counters}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Заглушка FatSecret API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Задержка каждого ответа')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Доля ответов 503 (0..1)')
+    args = parser.parse_args()
+
+    settings['latency_ms'] = args.latency_ms
+    settings['fail_rate'] = args.fail_rate
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -322,6 +322,13 @@ FOOD_NAME_MAPPING = {
     'veggie-burger': 'veggie burger',
     'white-bread-with-butter-eggs-and-milk': 'brioche',
     'wienerli-swiss-sausage': 'swiss sausage',
+
+    # Классы, для которых раньше был только перевод в food_name_ru
+    'fried-egg-without-addition-of-fat': 'fried egg',
+    'grapes': 'grape',
+    'macadamia-nut': 'macadamia nuts',
+    'shrimp-prawn-large': 'shrimp',
+    'strawberries': 'strawberry',
 }
 
 
@@ -2,8 +2,11 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import os
+import queue
 from use_model import detect_food
+from labels import label_table
 from nutrition import get_nutrition_info, format_nutrition_info
+from batch_analysis import BatchAnalyzer, export_csv
 
 
 class FoodDetectionApp:
@@ -18,8 +21,13 @@ class FoodDetectionApp:
         self.images_folder = "imgs"
         self.image_list = []
 
+        # Пакетный анализ папки в фоне (batch_analysis.py)
+        self.batch_analyzer = BatchAnalyzer()
+        self.batch_rows = []
+
         self.setup_ui()
         self.load_images_from_folder()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_ui(self):
         # Заголовок
@@ -59,6 +67,21 @@ class FoodDetectionApp:
         )
         self.clear_button.pack(side=tk.LEFT, padx=5)
 
+        self.batch_button = ttk.Button(
+            button_frame,
+            text="Анализировать папку",
+            command=self.toggle_batch
+        )
+        self.batch_button.pack(side=tk.LEFT, padx=5)
+
+        self.export_button = ttk.Button(
+            button_frame,
+            text="Экспорт CSV",
+            command=self.export_batch,
+            state=tk.DISABLED
+        )
+        self.export_button.pack(side=tk.LEFT, padx=5)
+
         # Основной контейнер с разделением
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -188,6 +211,33 @@ class FoodDetectionApp:
         )
         self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # Нижняя часть - результаты анализа папки
+        batch_frame = ttk.LabelFrame(self.root, text="Анализ папки", padding="10")
+        batch_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 5))
+
+        self.batch_progress = ttk.Progressbar(batch_frame, mode='determinate')
+        self.batch_progress.pack(fill=tk.X, pady=(0, 5))
+
+        columns = ("file", "product", "confidence", "calories", "stage", "seconds")
+        headings = ("Файл", "Продукт", "Уверенность, %", "Ккал/100 г", "Модель", "Время, с")
+        widths = (220, 220, 110, 100, 90, 80)
+
+        tree_frame = ttk.Frame(batch_frame)
+        tree_frame.pack(fill=tk.X)
+
+        self.batch_tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=7)
+        for column, heading, width in zip(columns, headings, widths):
+            self.batch_tree.heading(column, text=heading)
+            self.batch_tree.column(column, width=width, anchor=tk.W)
+        self.batch_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        tree_scroll = ttk.Scrollbar(tree_frame, command=self.batch_tree.yview)
+        tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.batch_tree.config(yscrollcommand=tree_scroll.set)
+
+        # Выбор строки показывает изображение и его результаты без повторного анализа
+        self.batch_tree.bind('<<TreeviewSelect>>', self.on_batch_select)
+
     def load_image(self):
         file_path = filedialog.askopenfilename(
             title="Выберите изображение",
@@ -252,23 +302,25 @@ class FoodDetectionApp:
             messagebox.showerror("Ошибка", f"Ошибка при анализе изображения:\n{str(e)}")
             self.status_label.config(text="Ошибка анализа")
 
-    def display_results(self, result):
+    def display_results(self, result, nutrition_data=None):
         # Основной результат
-        self.main_result_label.config(text=result['top_prediction'])
+        label = result['top_prediction']
+        self.main_result_label.config(text=f"{label_table.russian_name(label)} ({label})" if label else "-")
         self.confidence_label.config(text=f"{result['confidence']:.2f}%")
 
         # Прогресс бар
         self.confidence_progress['value'] = result['confidence']
 
-        # Получаем информацию о питательности
-        self.nutrition_text.config(state=tk.NORMAL)
-        self.nutrition_text.delete(1.0, tk.END)
-        self.nutrition_text.insert(tk.END, "Загрузка информации о калориях...")
-        self.nutrition_text.config(state=tk.DISABLED)
-        self.root.update()
+        # Получаем информацию о питательности (результаты анализа папки уже содержат ее)
+        if nutrition_data is None:
+            self.nutrition_text.config(state=tk.NORMAL)
+            self.nutrition_text.delete(1.0, tk.END)
+            self.nutrition_text.insert(tk.END, "Загрузка информации о калориях...")
+            self.nutrition_text.config(state=tk.DISABLED)
+            self.root.update()
 
-        # Запрашиваем информацию о калориях
-        nutrition_data = get_nutrition_info(result['top_prediction'])
+            # Запрашиваем информацию о калориях
+            nutrition_data = get_nutrition_info(result['top_prediction'])
         nutrition_info = format_nutrition_info(nutrition_data)
 
         # Отображаем информацию о питательности
@@ -282,7 +334,7 @@ class FoodDetectionApp:
         self.predictions_text.delete(1.0, tk.END)
 
         for i, (name, conf) in enumerate(result['top_predictions'], 1):
-            self.predictions_text.insert(tk.END, f"{i}. {name}\n")
+            self.predictions_text.insert(tk.END, f"{i}. {label_table.russian_name(name)} ({name})\n")
             self.predictions_text.insert(tk.END, f"   Уверенность: {conf:.2f}%\n\n")
 
         self.predictions_text.config(state=tk.DISABLED)
@@ -355,6 +407,115 @@ class FoodDetectionApp:
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось загрузить изображение:\n{str(e)}")
 
+    def toggle_batch(self):
+        """Запускает анализ всех изображений папки в фоне или останавливает его"""
+        if self.batch_analyzer.running:
+            self.batch_analyzer.cancel()
+            self.batch_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Остановка анализа папки...")
+            return
+
+        self.load_images_from_folder()
+        if not self.image_list:
+            messagebox.showwarning("Предупреждение", "В папке нет изображений")
+            return
+
+        self.batch_rows = [None] * len(self.image_list)
+        self.batch_tree.delete(*self.batch_tree.get_children())
+        self.batch_progress.config(maximum=len(self.image_list), value=0)
+        self.batch_button.config(text="Остановить")
+        self.export_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"Анализ папки: 0 из {len(self.image_list)}")
+
+        self.batch_analyzer.start(self.image_list)
+        self.root.after(100, self.poll_batch)
+
+    def poll_batch(self):
+        """Забирает готовые результаты из очереди анализа (в потоке Tk)"""
+        done = None
+        while True:
+            try:
+                event = self.batch_analyzer.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'result':
+                _, index, row, cached = event
+                self.add_batch_row(index, row, cached)
+            else:
+                done = event[1]
+
+        finished = sum(row is not None for row in self.batch_rows)
+        self.batch_progress.config(value=finished)
+
+        if done is None:
+            self.status_label.config(text=f"Анализ папки: {finished} из {len(self.batch_rows)}")
+            self.root.after(100, self.poll_batch)
+            return
+
+        self.batch_button.config(text="Анализировать папку", state=tk.NORMAL)
+        self.export_button.config(state=tk.NORMAL if finished else tk.DISABLED)
+        state = "остановлен" if done['cancelled'] else "завершен"
+        self.status_label.config(
+            text=f"Анализ папки {state}: {finished} из {done['total']} за {done['seconds']} с "
+                 f"(из кэша {done['cached']}, ошибок {done['failed']})"
+        )
+
+    def add_batch_row(self, index, row, cached):
+        self.batch_rows[index] = row
+        result = row['result']
+        if row['error']:
+            values = (os.path.basename(row['file']), f"Ошибка: {row['error']}", "", "", "", row['seconds'])
+        else:
+            label = result['top_prediction']
+            calories = (row['nutrition'] or {}).get('calories', '')
+            values = (
+                os.path.basename(row['file']),
+                f"{label_table.russian_name(label)} ({label})" if label else "-",
+                f"{result['confidence']:.1f}",
+                calories,
+                result.get('stage', ''),
+                "кэш" if cached else row['seconds'],
+            )
+
+        # Строки в порядке файлов папки, хотя результаты приходят в порядке готовности
+        position = sum(1 for i in range(index) if self.batch_rows[i] is not None)
+        self.batch_tree.insert("", position, iid=str(index), values=values)
+
+    def on_batch_select(self, event):
+        """Показывает изображение и результат выбранной строки анализа папки"""
+        selection = self.batch_tree.selection()
+        if not selection:
+            return
+        row = self.batch_rows[int(selection[0])]
+        self.current_image_path = row['file']
+        self.display_image(row['file'])
+        self.analyze_button.config(state=tk.NORMAL)
+        if row['result'] is not None:
+            self.display_results(row['result'], row['nutrition'] or {'error': 'Нет данных о питательной ценности'})
+
+    def export_batch(self):
+        """Сохраняет результаты анализа папки в CSV"""
+        rows = [row for row in self.batch_rows if row is not None]
+        if not rows:
+            return
+        path = filedialog.asksaveasfilename(
+            title="Экспорт результатов",
+            defaultextension=".csv",
+            initialfile="calsnap_results.csv",
+            filetypes=[("CSV", "*.csv")]
+        )
+        if not path:
+            return
+        try:
+            export_csv(rows, path)
+            self.status_label.config(text=f"Сохранено {len(rows)} результатов в {path}")
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить CSV:\n{str(e)}")
+
+    def on_close(self):
+        self.batch_analyzer.shutdown()
+        self.root.destroy()
+
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,69 @@
+"""
+Конфигурация gunicorn: несколько воркеров uvicorn с общей моделью
+
+С preload_app мастер-процесс импортирует приложение и загружает модель до
+запуска воркеров. Воркеры создаются через fork и получают веса модели как
+общие страницы (copy-on-write), поэтому память на воркер растет только на
+буферы инференса, а не на полную копию модели.
+
+Запуск:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_class = 'uvicorn_worker.UvicornWorker'
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+# Загрузка модели и прогрев в воркере занимают время
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+
+def _set_torch_threads(threads: int):
+    """Ограничивает потоки PyTorch (если он установлен)"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def when_ready(server):
+    """Мастер-процесс: загружаем модель один раз перед запуском воркеров"""
+    # Снимки метрик прошлого запуска не должны складываться с метриками новых воркеров
+    from metrics import registry
+    registry.clear_snapshots()
+
+    if not preload_app:
+        return
+
+    # Один поток в мастере: пул потоков OpenMP, созданный до fork, ломает инференс в воркерах
+    _set_torch_threads(1)
+
+    from use_model import model_manager
+    from cascade import cascade
+    model_manager.preload()
+    if cascade.enabled:
+        cascade.manager.preload()
+
+    # Переносим все объекты мастера в постоянное поколение GC: сборщик мусора
+    # в воркерах не будет их обходить и не превратит общие страницы в копии
+    gc.collect()
+    gc.freeze()
+    server.log.info(f'Модель загружена в мастер-процессе, воркеров: {workers}')
+
+
+def post_fork(server, worker):
+    """Воркер: делим ядра между воркерами; прогрев запускается из lifespan приложения"""
+    # Импорт внутри хука: имя config на уровне модуля gunicorn считает своей настройкой
+    import config
+    from backends import set_inference_threads
+
+    threads = config.INFERENCE_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    # PyTorch ограничивается сразу, сессии ONNX Runtime/OpenVINO - при создании в прогреве
+    set_inference_threads(threads)
+    server.log.info(f'Воркер {worker.pid}: потоков инференса {threads}')
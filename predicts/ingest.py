@@ -0,0 +1,97 @@
+"""
+Прием загруженных изображений: небольшие файлы читаются в память, файлы больше
+UPLOAD_SPOOL_THRESHOLD сбрасываются во временный файл в UPLOAD_DIR
+"""
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+import config
+
+# Размер порции при чтении загрузки
+CHUNK_SIZE = 256 * 1024
+
+# Папка для крупных загрузок создается один раз при импорте, а не на каждый запрос
+os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+
+
+class ImageTooLargeError(ValueError):
+    """Файл или изображение превышает допустимый размер"""
+
+
+class InvalidImageError(ValueError):
+    """Файл не удалось декодировать как изображение"""
+
+
+class UploadedImage:
+    """Байты загруженного изображения вместе с размером и хешем содержимого"""
+
+    def __init__(self, file: BinaryIO, size: int, sha256: str):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+
+    def close(self):
+        self.file.close()
+
+
+async def read_upload(
+    upload: UploadFile,
+    max_bytes: int = config.MAX_UPLOAD_BYTES,
+    spool_threshold: int = config.UPLOAD_SPOOL_THRESHOLD
+) -> UploadedImage:
+    """
+    Читает загруженный файл в память (крупные файлы - во временный файл на диске)
+
+    Файлы до spool_threshold байт целиком остаются в памяти; более крупные
+    сбрасываются на диск в анонимный временный файл с уникальным именем,
+    поэтому одинаковые имена файлов от разных клиентов не конфликтуют.
+
+    Args:
+        upload: Загруженный файл FastAPI
+        max_bytes: Максимальный размер файла в байтах
+        spool_threshold: Порог, после которого данные сбрасываются на диск
+
+    Returns:
+        UploadedImage с файловым объектом, спозиционированным на начало
+
+    Raises:
+        ImageTooLargeError: Если файл больше max_bytes
+    """
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=spool_threshold,
+        prefix='upload-',
+        dir=config.UPLOAD_DIR
+    )
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageTooLargeError(
+                    f'Файл больше допустимого размера {max_bytes // (1024 * 1024)} МБ'
+                )
+
+            hasher.update(chunk)
+            if size > spool_threshold:
+                # Данные уже на диске - пишем вне event loop
+                await run_in_threadpool(spool.write, chunk)
+            else:
+                spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return UploadedImage(spool, size, hasher.hexdigest())
+
@@ -0,0 +1,206 @@
+"""
+Таблица меток модели: по номеру класса - английское и русское название, название
+для поиска в FatSecret и ключ офлайн-таблицы питательной ценности
+
+Раньше каждое предсказание проходило через map_food_name и get_russian_name
+(приведение регистра, поиск в двух словарях, замена дефисов при промахе), а
+словари поддерживались отдельно и расходились с model.names. Таблица
+data/label_table.csv собирается скриптом build_label_table.py из тех же
+словарей и проверяется при загрузке модели (bind): метки должны совпадать с
+model.names по номерам классов. Если файла нет или он устарел, таблица
+строится в памяти из model.names (при LABEL_TABLE_STRICT=1 загрузка модели
+завершается ошибкой, и /ready показывает ее).
+"""
+import csv
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+import config
+from food_name_mapper import map_food_name
+from food_name_ru import FOOD_NAME_RU, get_russian_name
+from offline_nutrition import nutrition_table
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('class_id', 'label', 'name_en', 'search_name', 'name_ru', 'nutrition_key')
+
+
+class LabelInfo(NamedTuple):
+    """Строка таблицы меток (пустые name_ru/nutrition_key - нет перевода/данных)"""
+    class_id: int
+    label: str
+    name_en: str
+    search_name: str
+    name_ru: str
+    nutrition_key: str
+
+
+def build_label_rows(names: Dict[int, str]) -> List[LabelInfo]:
+    """
+    Строит строки таблицы по model.names из словарей маппинга и офлайн-таблицы
+
+    Args:
+        names: Названия классов модели (model.names)
+
+    Returns:
+        Строки по возрастанию номера класса
+    """
+    rows = []
+    for class_id in sorted(names):
+        label = names[class_id].strip().lower()
+        name_en = map_food_name(label)
+        rows.append(LabelInfo(
+            class_id=class_id,
+            label=label,
+            name_en=name_en,
+            search_name=name_en,
+            name_ru=FOOD_NAME_RU.get(label) or FOOD_NAME_RU.get(name_en, ''),
+            nutrition_key=nutrition_table.key(label) or nutrition_table.key(name_en) or '',
+        ))
+    return rows
+
+
+class LabelTable:
+    """Метки модели, индексированные номером класса и названием"""
+
+    def __init__(self, rows: List[LabelInfo], source: str = 'memory'):
+        """
+        Args:
+            rows: Строки таблицы (номера классов 0..N-1 по порядку)
+            source: Откуда взята таблица (путь к CSV или 'memory')
+        """
+        self._set_rows(rows, source)
+        self.bound = False
+
+    def _set_rows(self, rows: List[LabelInfo], source: str):
+        self.rows = rows
+        self.source = source
+        # Названия по номеру класса - подставляются вместо model.names при разборе результатов
+        self.labels = [row.label for row in rows]
+        self._by_label = {row.label: row for row in rows}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, label: str) -> Optional[LabelInfo]:
+        return self._by_label.get(label)
+
+    def russian_name(self, label: str) -> str:
+        """Русское название метки (для неизвестных меток - как get_russian_name)"""
+        row = self._by_label.get(label)
+        if row is not None and row.name_ru:
+            return row.name_ru
+        return get_russian_name(label)
+
+    def search_name(self, label: str) -> str:
+        """Название для поиска питательной ценности (для неизвестных меток - map_food_name)"""
+        row = self._by_label.get(label)
+        return row.search_name if row is not None else map_food_name(label)
+
+    def nutrition_key(self, label: str) -> Optional[str]:
+        """Строка офлайн-таблицы питательной ценности (None - данных нет или метка неизвестна)"""
+        row = self._by_label.get(label)
+        if row is None or not row.nutrition_key:
+            return None
+        return row.nutrition_key
+
+    def validate(self, names: Dict[int, str]) -> List[str]:
+        """
+        Сверяет таблицу с model.names
+
+        Returns:
+            Список расхождений (пустой, если таблица соответствует модели)
+        """
+        problems = []
+        if len(self.rows) != len(names):
+            problems.append(f'в таблице {len(self.rows)} меток, в модели {len(names)}')
+        for class_id, name in sorted(names.items()):
+            expected = name.strip().lower()
+            if class_id >= len(self.rows):
+                problems.append(f'класс {class_id} ({expected}) отсутствует в таблице')
+            elif self.rows[class_id].label != expected:
+                problems.append(f'класс {class_id}: в таблице {self.rows[class_id].label}, в модели {expected}')
+        return problems
+
+    def coverage_gaps(self) -> Dict[str, List[str]]:
+        """Метки без русского названия и без данных офлайн-таблицы"""
+        return {
+            'name_ru': [row.label for row in self.rows if not row.name_ru],
+            'nutrition': [row.label for row in self.rows if not row.nutrition_key],
+        }
+
+    def bind(self, names: Dict[int, str], strict: bool = config.LABEL_TABLE_STRICT):
+        """
+        Проверяет таблицу по загруженной модели; при расхождении строит ее из model.names
+
+        Args:
+            names: Названия классов модели (model.names)
+            strict: Выбросить ошибку, а не перестраивать таблицу
+
+        Raises:
+            ValueError: Если strict и таблица не соответствует модели
+        """
+        problems = self.validate(names)
+        if problems:
+            message = f'Таблица меток {self.source} не соответствует модели: ' + '; '.join(problems[:5])
+            if strict:
+                raise ValueError(f'{message}. Пересоберите ее: python build_label_table.py')
+            logger.warning(f'{message}. Таблица построена из model.names, пересоберите ее: python build_label_table.py')
+            self._set_rows(build_label_rows(names), 'memory')
+
+        gaps = self.coverage_gaps()
+        if gaps['name_ru'] or gaps['nutrition']:
+            logger.warning(
+                f"Таблица меток: без русского названия {len(gaps['name_ru'])}, "
+                f"без офлайн-данных {len(gaps['nutrition'])} из {len(self.rows)} меток"
+            )
+        self.bound = True
+
+    def stats(self) -> Dict:
+        gaps = self.coverage_gaps()
+        return {
+            'source': self.source,
+            'labels': len(self.rows),
+            'bound': self.bound,
+            'missing_name_ru': len(gaps['name_ru']),
+            'missing_nutrition': len(gaps['nutrition']),
+        }
+
+
+def load_label_table(path: str = config.LABEL_TABLE_PATH) -> LabelTable:
+    """
+    Загружает таблицу меток из CSV (см. COLUMNS)
+
+    Returns:
+        LabelTable (пустая, если файла нет - тогда она будет построена при загрузке модели)
+    """
+    if not os.path.exists(path):
+        logger.info(f'Таблица меток не найдена: {path}, она будет построена из model.names')
+        return LabelTable([])
+
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = [
+            LabelInfo(
+                class_id=int(record['class_id']),
+                label=record['label'],
+                name_en=record['name_en'],
+                search_name=record['search_name'],
+                name_ru=record['name_ru'],
+                nutrition_key=record['nutrition_key'],
+            )
+            for record in csv.DictReader(f)
+        ]
+    rows.sort(key=lambda row: row.class_id)
+    return LabelTable(rows, source=path)
+
+
+def write_label_table(rows: List[LabelInfo], path: str = config.LABEL_TABLE_PATH):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+# Таблица загружается при импорте и проверяется при загрузке модели (use_model)
+label_table = load_label_table()
@@ -0,0 +1,97 @@
+"""
+Память процессов сервиса: RSS, PSS и USS
+
+RSS считает общие страницы (веса модели, загруженные мастер-процессом gunicorn
+до fork) в каждом воркере, поэтому сумма RSS воркеров завышена. PSS делит
+общие страницы между процессами, USS - только собственная память процесса.
+
+Использование (сравнить память до и после включения preload):
+    python memory_stats.py --pid <pid мастер-процесса gunicorn>
+"""
+import argparse
+import os
+from typing import Dict
+
+import psutil
+
+# Поля /proc/<pid>/smaps_rollup (в кБ)
+_SMAPS_FIELDS = {
+    'Rss': 'rss_mb',
+    'Pss': 'pss_mb',
+    'Shared_Clean': 'shared_clean_mb',
+    'Shared_Dirty': 'shared_dirty_mb',
+    'Private_Clean': 'private_clean_mb',
+    'Private_Dirty': 'private_dirty_mb',
+}
+
+
+def process_memory(pid: int = None) -> Dict:
+    """
+    Память процесса в МБ
+
+    Args:
+        pid: Идентификатор процесса (по умолчанию - текущий)
+
+    Returns:
+        Dict с rss_mb, pss_mb, uss_mb и разбивкой на общие/собственные страницы
+        (на системах без /proc/<pid>/smaps_rollup - только rss_mb)
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        return {'rss_mb': round(psutil.Process(pid).memory_info().rss / (1024 * 1024), 1)}
+
+    memory = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].rstrip(':') in _SMAPS_FIELDS:
+            memory[_SMAPS_FIELDS[parts[0].rstrip(':')]] = round(int(parts[1]) / 1024, 1)
+
+    memory['uss_mb'] = round(memory.get('private_clean_mb', 0) + memory.get('private_dirty_mb', 0), 1)
+    return memory
+
+
+def tree_memory(pid: int) -> Dict:
+    """
+    Память процесса и всех его потомков (мастер gunicorn и воркеры)
+
+    Returns:
+        Dict с памятью каждого процесса и суммами RSS/PSS/USS
+    """
+    root = psutil.Process(pid)
+    processes = [root] + root.children(recursive=True)
+
+    per_process = {}
+    for process in processes:
+        try:
+            per_process[process.pid] = {'name': ' '.join(process.cmdline()[:3]), **process_memory(process.pid)}
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+
+    totals = {
+        key: round(sum(m.get(key, 0) for m in per_process.values()), 1)
+        for key in ('rss_mb', 'pss_mb', 'uss_mb')
+    }
+    workers = max(1, len(per_process) - 1)
+    totals['pss_per_worker_mb'] = round(totals['pss_mb'] / workers, 1)
+    return {'processes': per_process, 'workers': workers, 'totals': totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память мастер-процесса gunicorn и воркеров')
+    parser.add_argument('--pid', type=int, required=True, help='PID мастер-процесса')
+    args = parser.parse_args()
+
+    report = tree_memory(args.pid)
+    print(f'{"PID":>8} {"RSS МБ":>9} {"PSS МБ":>9} {"USS МБ":>9}  процесс')
+    for pid, m in report['processes'].items():
+        print(f'{pid:>8} {m.get("rss_mb", 0):9.1f} {m.get("pss_mb", 0):9.1f} {m.get("uss_mb", 0):9.1f}  {m["name"]}')
+    totals = report['totals']
+    print(f'{"итого":>8} {totals["rss_mb"]:9.1f} {totals["pss_mb"]:9.1f} {totals["uss_mb"]:9.1f}')
+    print(f'\nВоркеров: {report["workers"]}, PSS на воркер (с долей мастера): {totals["pss_per_worker_mb"]} МБ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+Метрики сервиса в формате Prometheus и время этапов обработки запроса
+
+- гистограммы времени этапов (чтение загрузки, декодирование, предобработка,
+  ожидание батча, прогон модели, разбор результата, маппинг названий, питательная
+  ценность) и общего времени запроса;
+- счетчики попаданий в кэши, ошибок по типам и распознанных продуктов.
+
+Времена этапов текущего запроса дополнительно отдаются клиенту в заголовке
+Server-Timing. Этапы, выполняемые в пулах потоков, попадают в запрос через
+contextvars (см. executors.MonitoredExecutor.run).
+
+Каждый воркер gunicorn считает метрики сам. Если задан METRICS_DIR, воркеры
+периодически сохраняют снимок метрик в этот каталог, а /metrics суммирует снимки
+всех воркеров, поэтому ответ не зависит от того, какой воркер принял запрос.
+"""
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы гистограмм времени (сек): от 1 мс до 10 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else f'{int(value)}.0'
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total: float, value: float) -> float:
+        return total + value
+
+    def render(self, values: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in sorted(values.items())
+        ]
+
+
+class CallbackCounter(Counter):
+    """Счетчик, значения которого при сборе берутся из функции (например, из stats() кэша)"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[Tuple[str, ...], float]]
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        return {tuple(map(str, key)): float(value) for key, value in self._callback().items()}
+
+
+class Histogram:
+    """Гистограмма с метками (значения в секундах)"""
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики по корзинам (последняя - +Inf) и сумма
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+    @staticmethod
+    def merge(total: List[float], value: List[float]) -> List[float]:
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, values: Dict[Tuple[str, ...], List[float]]) -> List[str]:
+        lines = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {_format_value(cumulative)}')
+            total = cumulative + counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {_format_value(total)}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(total)}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса; при заданном каталоге - с объединением снимков воркеров"""
+
+    def __init__(self, directory: str = None, flush_interval: float = 5.0):
+        """
+        Args:
+            directory: Каталог снимков метрик воркеров (None - только метрики процесса)
+            flush_interval: Как часто сохранять снимок (сек)
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._flusher = None
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def callback_counter(self, name: str, documentation: str, labelnames: Sequence[str], callback) -> Counter:
+        return self.register(CallbackCounter(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """Текущие значения всех метрик процесса"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def write_snapshot(self):
+        """Сохраняет снимок метрик процесса в каталог (атомарно)"""
+        if not self.directory:
+            return
+        data = {
+            name: [[list(key), value] for key, value in values.items()]
+            for name, values in self.snapshot().items()
+        }
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f'Не удалось сохранить метрики в {self.directory}: {e}')
+
+    def clear_snapshots(self):
+        """Удаляет снимки прошлых запусков (вызывается мастер-процессом до запуска воркеров)"""
+        if not self.directory:
+            return
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def start_flusher(self):
+        """Запускает фоновое сохранение снимков в текущем процессе"""
+        if not self.directory or (self._flusher_pid == os.getpid() and self._flusher.is_alive()):
+            return
+
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.write_snapshot()
+
+        self._flusher = threading.Thread(target=flush_loop, name='metrics-flush', daemon=True)
+        self._flusher_pid = os.getpid()
+        self._flusher.start()
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """Метрики процесса, сложенные с последними снимками остальных воркеров"""
+        merged = self.snapshot()
+        if not self.directory:
+            return merged
+
+        by_name = {metric.name: metric for metric in self._metrics}
+        own = self._snapshot_path(os.getpid())
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, values in data.items():
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                target = merged[name]
+                for key, value in values:
+                    key = tuple(key)
+                    target[key] = metric.merge(target[key], value) if key in target else value
+        return merged
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        values = self.collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render(values.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(config.METRICS_DIR or None, config.METRICS_FLUSH_INTERVAL)
+
+stage_seconds = registry.histogram(
+    'calsnap_stage_seconds',
+    'Время этапа обработки (admission_wait, upload_read, decode, preprocess, classifier, queue_wait, model_forward, postprocess, name_mapping, nutrition)',
+    ['stage']
+)
+request_seconds = registry.histogram(
+    'calsnap_request_seconds',
+    'Общее время обработки запроса',
+    ['method', 'endpoint', 'status']
+)
+errors_total = registry.counter(
+    'calsnap_errors_total',
+    'Сбои обработки по классу исключения (каждый сбой учитывается один раз)',
+    ['type']
+)
+predictions_total = registry.counter(
+    'calsnap_predictions_total',
+    'Распознанные продукты (топ-предсказание каждого изображения)',
+    ['label']
+)
+nutrition_total = registry.counter(
+    'calsnap_nutrition_lookups_total',
+    'Полученная питательная ценность по источникам (offline, fatsecret, error, timeout)',
+    ['source']
+)
+cascade_total = registry.counter(
+    'calsnap_cascade_total',
+    'Изображения каскада по модели, которая дала ответ (classifier, detector)',
+    ['stage']
+)
+shadow_total = registry.counter(
+    'calsnap_shadow_total',
+    'Сравнения теневой проверки кандидата по результату (agree, disagree, dropped, error)',
+    ['result']
+)
+stream_frames_total = registry.counter(
+    'calsnap_stream_frames_total',
+    'Кадры потока /ws/stream по результату (received, dropped, skipped, inferred, error)',
+    ['result']
+)
+
+
+class StageTimings:
+    """Времена этапов одного запроса (мс); этапы могут повторяться и выполняться в разных потоках"""
+
+    def __init__(self):
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + ms
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stages)
+
+    def server_timing(self, total_ms: float) -> str:
+        """Значение заголовка Server-Timing"""
+        parts = [f'{stage};dur={ms:.2f}' for stage, ms in self.as_dict().items()]
+        parts.append(f'total;dur={total_ms:.2f}')
+        return ', '.join(parts)
+
+
+_current_timings: contextvars.ContextVar[Optional[StageTimings]] = contextvars.ContextVar(
+    'calsnap_stage_timings', default=None
+)
+
+
+def record_stage(stage: str, ms: float):
+    """
+    Учитывает время этапа в гистограмме и во временах текущего запроса
+
+    Args:
+        stage: Название этапа
+        ms: Время (мс)
+    """
+    stage_seconds.observe(ms / 1000, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, ms)
+
+
+@contextmanager
+def timed(stage: str):
+    """Измеряет время блока как этап stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, (time.perf_counter() - started) * 1000)
+
+
+def record_error(kind: str):
+    """Учитывает ошибку типа kind (например, класс исключения)"""
+    errors_total.inc(type=kind)
+
+
+def record_prediction(label: str):
+    """Учитывает распознанный продукт"""
+    predictions_total.inc(label=label)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: общее время запроса, необработанные исключения и заголовок Server-Timing
+
+    Подключается последним (внешним), чтобы учитывать и ожидание в контроле допуска.
+    Ошибки по статусам не считаются: отказы допуска (429/503) и ошибки клиента
+    (400/413) видны в calsnap_request_seconds{status}, а сбои, которые обработчики
+    превращают в 500, они сами учитывают по классу исключения.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        token = _current_timings.set(timings)
+        started = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                total_ms = (time.perf_counter() - started) * 1000
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', timings.server_timing(total_ms).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            record_error(type(e).__name__)
+            raise
+        finally:
+            _current_timings.reset(token)
+            # Шаблон пути маршрута, а не сам путь: /nutrition/{food_name} - одна серия
+            route = scope.get('route')
+            endpoint = getattr(route, 'path', None) or 'unmatched'
+            request_seconds.observe(
+                time.perf_counter() - started,
+                method=scope['method'], endpoint=endpoint, status=status['code']
+            )
@@ -0,0 +1,136 @@
+"""
+Жизненный цикл модели: ленивая загрузка, прогрев и готовность к инференсу
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelManager:
+    """
+    Загружает модель один раз (в фоне при старте сервиса или при первом обращении)
+
+    Модель становится доступной только после прогрева: первые прогоны
+    выделяют память и инициализируют граф, и платить за это должен не
+    первый пользовательский запрос. Состояния: not_loaded -> loading ->
+    (loaded) -> warming_up -> ready (или failed, после чего get() пробует загрузить снова).
+
+    preload() загружает модель без прогрева: так делает мастер-процесс gunicorn
+    перед fork, чтобы веса были общими (copy-on-write) для всех воркеров, а
+    прогрев (с потоками инференса) выполнялся уже в каждом воркере.
+    """
+
+    def __init__(self, loader: Callable[[], Any], warmup: Optional[Callable[[Any], int]] = None):
+        """
+        Args:
+            loader: Функция без аргументов, загружающая модель
+            warmup: Функция, прогревающая загруженную модель; возвращает число прогонов
+        """
+        self._loader = loader
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._model = None
+        self._loaded_model = None
+        self._thread = None
+
+        self.state = 'not_loaded'
+        self.error: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        self.warmup_runs = 0
+        self.ready_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def _load_only_locked(self):
+        """Загружает модель без прогрева (вызывается под self._lock)"""
+        if self._loaded_model is not None:
+            return self._loaded_model
+
+        try:
+            self.state = 'loading'
+            self.error = None
+            started = time.perf_counter()
+            self._loaded_model = self._loader()
+            self.load_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f'Не удалось загрузить модель: {e}', exc_info=True)
+            raise
+
+        self.state = 'loaded'
+        logger.info(f'Модель загружена за {self.load_ms:.0f} мс')
+        return self._loaded_model
+
+    def _load_locked(self):
+        """Загружает и прогревает модель (вызывается под self._lock)"""
+        model = self._load_only_locked()
+        try:
+            if self._warmup is not None:
+                self.state = 'warming_up'
+                started = time.perf_counter()
+                self.warmup_runs = self._warmup(model)
+                self.warmup_ms = (time.perf_counter() - started) * 1000
+                logger.info(f'Прогрев модели: {self.warmup_runs} прогонов за {self.warmup_ms:.0f} мс')
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f'Не удалось прогреть модель: {e}', exc_info=True)
+            raise
+
+        self._model = model
+        self.ready_at = time.time()
+        self.state = 'ready'
+
+    def get(self) -> Any:
+        """
+        Возвращает прогретую модель, при необходимости загружая ее (блокирующий вызов)
+
+        Если модель уже загружается в фоне, вызов дождется окончания загрузки.
+        """
+        model = self._model
+        if model is not None:
+            return model
+
+        with self._lock:
+            if self._model is None:
+                self._load_locked()
+            return self._model
+
+    def preload(self):
+        """Загружает модель без прогрева (в мастер-процессе перед fork воркеров)"""
+        with self._lock:
+            self._load_only_locked()
+
+    def start_background(self):
+        """Запускает загрузку и прогрев в фоновом потоке (повторные вызовы ничего не делают)"""
+        if self._model is not None or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        def load():
+            try:
+                self.get()
+            except Exception:
+                # Ошибка уже записана в state/error и видна в /ready
+                pass
+
+        self._thread = threading.Thread(target=load, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def status(self) -> Dict:
+        """Состояние модели и длительности загрузки и прогрева"""
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'load_ms': round(self.load_ms, 1) if self.load_ms is not None else None,
+            'warmup_ms': round(self.warmup_ms, 1) if self.warmup_ms is not None else None,
+            'warmup_runs': self.warmup_runs,
+            'ready_at': self.ready_at,
+            'error': self.error,
+        }
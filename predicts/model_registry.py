@@ -0,0 +1,555 @@
+"""
+Реестр версий модели: загрузка новой версии рядом с текущей, переключение
+трафика без перезапуска и теневая проверка кандидата на живых запросах
+
+Раньше смена best.pt требовала правки кода и перезапуска контейнера. Теперь
+версия регистрируется через /admin/models (см. app.py), загружается и
+прогревается в фоне, а promote переключает на нее планировщик одной заменой
+ссылки: батч, уже запущенный на прежней модели, дорабатывает на ней, и его
+результаты разбираются по названиям классов той же модели.
+
+В теневом режиме доля SHADOW_SAMPLE_RATE запросов (после ответа основной
+модели) повторно распознается кандидатом в отдельном фоновом потоке; ответ
+пользователю от этого не зависит. Совпадение топ-1/топ-k и задержки обеих
+моделей пишутся в лог каждые SHADOW_LOG_EVERY сравнений и видны в /admin/models.
+
+При нескольких воркерах gunicorn запрос к /admin попадает в один из них,
+поэтому состояние реестра сохраняется в MODEL_REGISTRY_PATH, и каждый воркер
+раз в MODEL_REGISTRY_POLL_INTERVAL секунд применяет его (загружает версии и
+переключается, когда нужная версия готова). Изменение через /admin сначала
+применяет файл, а затем записывает в него только свою правку под блокировкой
+файла, поэтому изменения из разных воркеров не затирают друг друга.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+import config
+import result_parser
+from backends import BACKENDS, load_model
+from labels import label_table
+from metrics import shadow_total
+from model_manager import ModelManager
+from result_parser import Letterbox
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERSION = 'default'
+SHADOW_LOG_EVERY = 100
+
+
+@contextmanager
+def _state_lock(state_path: str):
+    """Не дает воркерам одновременно изменять файл состояния (как backends._export_lock)"""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{state_path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def model_labels(names: Dict[int, str]) -> List[str]:
+    """Названия классов по номеру, как в таблице меток (нижний регистр, без пробелов по краям)"""
+    return [str(names[class_id]).strip().lower() for class_id in sorted(names)]
+
+
+class ModelVersion:
+    """Одна версия модели со своим жизненным циклом (загрузка, прогрев, готовность)"""
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        backend: str,
+        warmup: Optional[Callable[[Any], int]] = None,
+        loader: Optional[Callable[[], Any]] = None
+    ):
+        """
+        Args:
+            name: Имя версии (ключ в реестре)
+            path: Путь к модели PyTorch (.pt)
+            backend: Бэкенд инференса (см. backends.BACKENDS)
+            warmup: Функция прогрева модели
+            loader: Функция загрузки (по умолчанию backends.load_model(backend, path))
+        """
+        self.name = name
+        self.path = path
+        self.backend = backend
+        self.labels: Optional[List[str]] = None
+        self.registered_at = time.time()
+        self._loader = loader
+        self.manager = ModelManager(self._load, warmup)
+
+    def _load(self):
+        model = self._loader() if self._loader is not None else load_model(self.backend, self.path)
+        self.labels = model_labels(model.names)
+        return model
+
+    @property
+    def ready(self) -> bool:
+        return self.manager.ready
+
+    @property
+    def model(self):
+        """Прогретая модель (при необходимости загружается, блокирующий вызов)"""
+        return self.manager.get()
+
+    def describe(self) -> Dict:
+        return {
+            'path': self.path,
+            'backend': self.backend,
+            'classes': len(self.labels) if self.labels is not None else None,
+            'registered_at': self.registered_at,
+            'model': self.manager.status(),
+        }
+
+
+class ShadowStats:
+    """Совпадение ответов и задержки основной модели и кандидата"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.top1_agree = 0
+        self.topk_overlap = 0.0
+        self.dropped = 0
+        self.errors = 0
+        self.primary_ms = deque(maxlen=window)
+        self.candidate_ms = deque(maxlen=window)
+
+    def record(self, primary: Dict, candidate: Dict, primary_ms: float, candidate_ms: float) -> int:
+        """Учитывает одно сравнение; возвращает число сравнений"""
+        top1 = primary['top_prediction'] == candidate['top_prediction']
+        primary_top = {name for name, _ in primary['top_predictions']}
+        candidate_top = {name for name, _ in candidate['top_predictions']}
+        overlap = len(primary_top & candidate_top) / len(primary_top) if primary_top else float(not candidate_top)
+        with self._lock:
+            self.samples += 1
+            self.top1_agree += int(top1)
+            self.topk_overlap += overlap
+            self.primary_ms.append(primary_ms)
+            self.candidate_ms.append(candidate_ms)
+            return self.samples
+
+    def count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            samples = self.samples
+            primary_ms = list(self.primary_ms)
+            candidate_ms = list(self.candidate_ms)
+            return {
+                'samples': samples,
+                'top1_agreement': round(self.top1_agree / samples, 4) if samples else None,
+                'topk_overlap': round(self.topk_overlap / samples, 4) if samples else None,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                # Основная модель - прогон всего батча, в который попало изображение
+                'primary_p50_ms': round(float(np.percentile(primary_ms, 50)), 2) if primary_ms else None,
+                'primary_p95_ms': round(float(np.percentile(primary_ms, 95)), 2) if primary_ms else None,
+                'candidate_p50_ms': round(float(np.percentile(candidate_ms, 50)), 2) if candidate_ms else None,
+                'candidate_p95_ms': round(float(np.percentile(candidate_ms, 95)), 2) if candidate_ms else None,
+            }
+
+
+class ModelRegistry:
+    """Версии модели, активная версия (обслуживает трафик) и теневой кандидат"""
+
+    def __init__(
+        self,
+        default: ModelVersion,
+        warmup: Optional[Callable[[Any], int]] = None,
+        state_path: str = '',
+        model_dir: str = '',
+        poll_interval: float = 5.0
+    ):
+        """
+        Args:
+            default: Версия из MODEL_PATH (активна при старте)
+            warmup: Функция прогрева для новых версий
+            state_path: Файл состояния реестра для нескольких воркеров ('' - только этот процесс)
+            model_dir: Папка, из которой разрешено загружать модели (относительные пути - от нее)
+            poll_interval: Период чтения файла состояния (сек)
+        """
+        self._warmup = warmup
+        self.state_path = state_path
+        self.model_dir = os.path.abspath(model_dir or '.')
+        self.poll_interval = poll_interval
+
+        self._lock = threading.RLock()
+        self._versions: Dict[str, ModelVersion] = {default.name: default}
+        # Планировщик читает active один раз на батч; переключение - замена ссылки
+        self.active = default
+        self.shadow: Optional[ModelVersion] = None
+        self.shadow_rate = 0.0
+        self.shadow_stats = ShadowStats()
+        self._target = default.name
+        self.switched_at: Optional[float] = None
+        # Вызываются после переключения активной версии (например, очистка кэша предсказаний)
+        self.on_switch: List[Callable[[ModelVersion], None]] = []
+
+        # Отдельный пул из одного потока: кандидат не занимает пул инференса основной модели
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        self._shadow_pending = 0
+        self._state: Optional[Dict] = None
+        self._state_mtime: Optional[float] = None
+        self._sync_thread = None
+
+    def get(self, name: str) -> ModelVersion:
+        version = self._versions.get(name)
+        if version is None:
+            raise KeyError(f'Версия модели {name} не зарегистрирована')
+        return version
+
+    def resolve_path(self, path: str) -> str:
+        """
+        Абсолютный путь к модели внутри model_dir
+
+        Raises:
+            ValueError: Если путь ведет за пределы model_dir или файла нет
+        """
+        resolved = os.path.abspath(os.path.join(self.model_dir, path))
+        if os.path.commonpath([resolved, self.model_dir]) != self.model_dir:
+            raise ValueError(f'Модель должна находиться в {self.model_dir}')
+        if not os.path.exists(resolved):
+            raise ValueError(f'Файл модели не найден: {resolved}')
+        return resolved
+
+    def register(self, name: str, path: str, backend: str = config.MODEL_BACKEND, persist: bool = True) -> ModelVersion:
+        """
+        Регистрирует версию и запускает ее загрузку и прогрев в фоне
+
+        Raises:
+            ValueError: Если имя занято, бэкенд неизвестен или файла модели нет
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'Неизвестный бэкенд {backend}, доступны: {", ".join(BACKENDS)}')
+        resolved = self.resolve_path(path)
+        if persist:
+            self.sync()
+        with self._lock:
+            if name in self._versions:
+                raise ValueError(f'Версия {name} уже зарегистрирована')
+            if persist:
+                def change(state):
+                    if name in state['versions']:
+                        raise ValueError(f'Версия {name} уже зарегистрирована')
+                    state['versions'][name] = {'path': resolved, 'backend': backend}
+                self._update_state(change)
+            version = ModelVersion(name, resolved, backend, self._warmup)
+            self._versions[name] = version
+        logger.info(f'Версия модели {name} зарегистрирована: {resolved} ({backend}), загрузка в фоне')
+        version.manager.start_background()
+        return version
+
+    def unregister(self, name: str, persist: bool = True):
+        """
+        Удаляет неактивную версию (память освобождается, когда завершатся ее прогоны)
+
+        Raises:
+            KeyError: Если версии нет
+            ValueError: Если версия активна
+        """
+        if persist:
+            self.sync()
+        with self._lock:
+            version = self.get(name)
+            if name == DEFAULT_VERSION:
+                raise ValueError(f'Версия {DEFAULT_VERSION} (MODEL_PATH) не удаляется')
+            if version is self.active or name == self._target:
+                raise ValueError(f'Версия {name} активна, сначала переключитесь на другую')
+            if persist:
+                def change(state):
+                    if state['active'] == name:
+                        raise ValueError(f'Версия {name} активна, сначала переключитесь на другую')
+                    state['versions'].pop(name, None)
+                    if state['shadow'] == name:
+                        state['shadow'], state['shadow_rate'] = None, 0.0
+                self._update_state(change)
+            if version is self.shadow:
+                self.shadow, self.shadow_rate = None, 0.0
+            del self._versions[name]
+        logger.info(f'Версия модели {name} удалена из реестра')
+
+    def promote(self, name: str, persist: bool = True) -> str:
+        """
+        Переключает трафик на готовую версию
+
+        Таблица меток сверяется с новой моделью до переключения (при
+        LABEL_TABLE_STRICT=1 расхождение - ошибка, и трафик остается на прежней версии).
+
+        Returns:
+            Имя прежней активной версии (на нее можно вернуться тем же вызовом)
+
+        Raises:
+            KeyError: Если версии нет
+            ValueError: Если версия еще не готова или таблица меток ей не соответствует
+        """
+        if persist:
+            self.sync()
+        with self._lock:
+            version = self.get(name)
+            if not version.ready:
+                raise ValueError(f'Версия {name} еще не готова (состояние {version.manager.state})')
+            previous = self.active
+            if version is previous:
+                return previous.name
+
+            label_table.bind(version.model.names)
+            if persist:
+                def change(state):
+                    if name != DEFAULT_VERSION and name not in state['versions']:
+                        raise KeyError(f'Версия модели {name} не зарегистрирована')
+                    state['active'] = name
+                    if state['shadow'] == name:
+                        state['shadow'], state['shadow_rate'] = None, 0.0
+                try:
+                    self._update_state(change)
+                except Exception:
+                    label_table.bind(previous.model.names)
+                    raise
+            self.active = version
+            self._target = name
+            self.switched_at = time.time()
+            if self.shadow is version:
+                self.shadow, self.shadow_rate = None, 0.0
+
+        logger.info(f'Трафик переключен с версии {previous.name} на {name}')
+        for callback in self.on_switch:
+            try:
+                callback(version)
+            except Exception as e:
+                logger.error(f'Ошибка обработчика переключения модели: {e}', exc_info=True)
+        return previous.name
+
+    def set_shadow(self, name: Optional[str], rate: float = config.SHADOW_SAMPLE_RATE, persist: bool = True):
+        """
+        Включает теневую проверку версии name на доле rate запросов (name=None - выключает)
+
+        Raises:
+            KeyError: Если версии нет
+            ValueError: Если версия активна или доля вне 0..1
+        """
+        if persist:
+            self.sync()
+        with self._lock:
+            version = None
+            if name is not None:
+                version = self.get(name)
+                if version is self.active:
+                    raise ValueError(f'Версия {name} активна и не может быть теневой')
+                if not 0.0 <= rate <= 1.0:
+                    raise ValueError('Доля запросов для теневой проверки должна быть от 0 до 1')
+            if persist:
+                def change(state):
+                    if name is not None and state['active'] == name:
+                        raise ValueError(f'Версия {name} активна и не может быть теневой')
+                    state['shadow'], state['shadow_rate'] = name, rate if name else 0.0
+                self._update_state(change)
+            if version is None:
+                self.shadow, self.shadow_rate = None, 0.0
+            else:
+                if version is not self.shadow:
+                    self.shadow_stats = ShadowStats()
+                self.shadow, self.shadow_rate = version, rate
+        logger.info(f'Теневая проверка: {name or "выключена"}' + (f', доля запросов {rate:g}' if name else ''))
+
+    def maybe_shadow(self, image, letterbox: Optional[Letterbox], primary: Dict, primary_ms: float):
+        """
+        С вероятностью shadow_rate ставит изображение в очередь теневой проверки
+
+        Args:
+            image: Вход модели (np.ndarray или путь к файлу); массив копируется,
+                потому что буфер возвращается в пул после ответа
+            letterbox: Параметры letterbox входа
+            primary: Результат основной модели в формате detect_food
+            primary_ms: Время прогона батча основной модели (мс)
+        """
+        shadow = self.shadow
+        if shadow is None or not shadow.ready or random.random() >= self.shadow_rate:
+            return
+
+        stats = self.shadow_stats
+        with self._lock:
+            if self._shadow_pending >= config.SHADOW_MAX_PENDING:
+                stats.count('dropped')
+                shadow_total.inc(result='dropped')
+                return
+            self._shadow_pending += 1
+
+        if isinstance(image, np.ndarray):
+            image = image.copy()
+        self._shadow_executor.submit(self._run_shadow, shadow, stats, image, letterbox, primary, primary_ms)
+
+    def _run_shadow(self, shadow: ModelVersion, stats: ShadowStats, image, letterbox, primary, primary_ms):
+        try:
+            started = time.perf_counter()
+            result = shadow.model(image, verbose=False, imgsz=config.MODEL_IMGSZ)[0]
+            candidate_ms = (time.perf_counter() - started) * 1000
+            candidate = result_parser.parse_result(
+                result, shadow.labels, max(1, len(primary['top_predictions'])), letterbox
+            )
+            samples = stats.record(primary, candidate, primary_ms, candidate_ms)
+            shadow_total.inc(result='agree' if primary['top_prediction'] == candidate['top_prediction'] else 'disagree')
+            if samples % SHADOW_LOG_EVERY == 0:
+                summary = stats.summary()
+                logger.info(
+                    f"Теневая проверка {shadow.name} против {self.active.name}: {samples} сравнений, "
+                    f"топ-1 {summary['top1_agreement']:.1%}, топ-k {summary['topk_overlap']:.1%}, "
+                    f"p50 {summary['candidate_p50_ms']} мс (основная, батч: {summary['primary_p50_ms']} мс)"
+                )
+        except Exception as e:
+            stats.count('errors')
+            shadow_total.inc(result='error')
+            logger.warning(f'Ошибка теневой проверки {shadow.name}: {e}')
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def _update_state(self, change: Callable[[Dict], None]):
+        """
+        Вносит правку в файл состояния: чтение, правка и запись под блокировкой файла
+
+        Правка накладывается на текущее содержимое файла, а не на копию этого
+        воркера, поэтому одновременные изменения из разных воркеров сохраняются.
+        Запись атомарная (через временный файл).
+
+        Args:
+            change: Изменяет словарь состояния на месте; исключение отменяет запись
+        """
+        if not self.state_path:
+            return
+        with _state_lock(self.state_path):
+            try:
+                with open(self.state_path, encoding='utf-8') as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                # Первое изменение: файл создается из состояния этого воркера
+                state = {
+                    'versions': {
+                        name: {'path': v.path, 'backend': v.backend}
+                        for name, v in self._versions.items() if name != DEFAULT_VERSION
+                    },
+                    'active': self._target,
+                    'shadow': self.shadow.name if self.shadow is not None else None,
+                    'shadow_rate': self.shadow_rate,
+                }
+            state.setdefault('versions', {})
+            state.setdefault('active', DEFAULT_VERSION)
+            state.setdefault('shadow', None)
+            state.setdefault('shadow_rate', 0.0)
+            change(state)
+
+            tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+        self._state = state
+        # Файл мог содержать изменения других воркеров: следующий sync перечитает его
+        self._state_mtime = None
+
+    def sync(self):
+        """
+        Применяет состояние из state_path
+
+        Новые версии загружаются в фоне, поэтому переключение, удаление прежних
+        версий и теневая проверка повторяются на каждом шаге, пока не выполнятся.
+        """
+        # Под блокировкой: sync вызывают и фоновый поток, и изменения через /admin
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        try:
+            mtime = os.path.getmtime(self.state_path)
+        except OSError:
+            return
+
+        if mtime != self._state_mtime:
+            with open(self.state_path, encoding='utf-8') as f:
+                self._state = json.load(f)
+            self._state_mtime = mtime
+            for name, spec in self._state.get('versions', {}).items():
+                if name not in self._versions:
+                    self.register(name, spec['path'], spec.get('backend', config.MODEL_BACKEND), persist=False)
+            self._target = self._state.get('active') or DEFAULT_VERSION
+
+        if self._state is None:
+            return
+
+        target = self._versions.get(self._target)
+        if target is not None and target is not self.active and target.ready:
+            self.promote(target.name, persist=False)
+
+        versions = self._state.get('versions', {})
+        for name, version in list(self._versions.items()):
+            if name != DEFAULT_VERSION and name not in versions and version is not self.active and name != self._target:
+                self.unregister(name, persist=False)
+
+        shadow = self._state.get('shadow')
+        rate = self._state.get('shadow_rate', config.SHADOW_SAMPLE_RATE)
+        if shadow is None:
+            if self.shadow is not None:
+                self.set_shadow(None, persist=False)
+        elif shadow in self._versions and self._versions[shadow] is not self.active:
+            if self.shadow is not self._versions[shadow] or self.shadow_rate != rate:
+                self.set_shadow(shadow, rate, persist=False)
+
+    def start_sync(self):
+        """Запускает фоновое применение файла состояния (если он задан)"""
+        if not self.state_path or self._sync_thread is not None:
+            return
+
+        def sync_loop():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f'Не удалось применить состояние реестра моделей: {e}', exc_info=True)
+                time.sleep(self.poll_interval)
+
+        self._sync_thread = threading.Thread(target=sync_loop, name='model-registry-sync', daemon=True)
+        self._sync_thread.start()
+
+    def shutdown(self):
+        """Останавливает пул теневой проверки (при остановке приложения)"""
+        self._shadow_executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        """Версии, активная версия и результаты теневой проверки"""
+        with self._lock:
+            versions = {name: v.describe() for name, v in self._versions.items()}
+            shadow = self.shadow
+        return {
+            'active': self.active.name,
+            'target': self._target,
+            'switched_at': self.switched_at,
+            'state_path': self.state_path or None,
+            'versions': versions,
+            'shadow': {
+                'version': shadow.name,
+                'rate': self.shadow_rate,
+                'pending': self._shadow_pending,
+                **self.shadow_stats.summary(),
+            } if shadow is not None else None,
+        }
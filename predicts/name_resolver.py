@@ -0,0 +1,159 @@
+"""
+Нечеткий поиск продукта по названию, введенному пользователем
+
+GET /nutrition/{food_name} получает произвольный текст: русские названия,
+опечатки, множественное число. map_food_name понимает только точные метки
+модели, поэтому раньше такой текст уходил в FatSecret как есть. Резолвер
+строит при импорте индекс триграмм по всем английским и русским названиям
+(food_name_mapper, food_name_ru) и офлайн-таблице питательной ценности и
+возвращает каноническое название с оценкой сходства (коэффициент Дайса по
+триграммам, 0..1). FatSecret вызывается, только если ничего похожего нет.
+"""
+import logging
+import re
+import threading
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import config
+from food_name_mapper import FOOD_NAME_MAPPING, map_food_name
+from food_name_ru import FOOD_NAME_RU
+from offline_nutrition import nutrition_table
+
+logger = logging.getLogger(__name__)
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+class NameMatch(NamedTuple):
+    """Найденное название"""
+    name: str      # каноническое название (строка офлайн-таблицы или название для FatSecret)
+    alias: str     # совпавшее название из словарей
+    score: float   # 1.0 - точное совпадение после нормализации
+
+
+def normalize_name(text: str) -> str:
+    """Нижний регистр, ё -> е, дефисы, '_' и знаки препинания -> пробелы"""
+    return _SEPARATORS.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+
+def trigrams(text: str) -> set:
+    """Триграммы нормализованной строки с пробелом по краям (как в pg_trgm)"""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dictionary_aliases() -> Iterator[Tuple[str, str]]:
+    """
+    Все известные названия с каноническим названием продукта
+
+    Офлайн-таблица идет первой: если одно название встречается в нескольких
+    источниках, предпочтение отдается продукту с офлайн-данными.
+    """
+    yield from nutrition_table.aliases()
+    for label, name_en in FOOD_NAME_MAPPING.items():
+        yield label, name_en
+        yield name_en, name_en
+    for label, name_ru in FOOD_NAME_RU.items():
+        yield name_ru, map_food_name(label)
+
+
+class NameResolver:
+    """Индекс триграмм: триграмма -> номера названий, в которых она встречается"""
+
+    def __init__(self, aliases: Iterator[Tuple[str, str]], min_score: float = 0.5):
+        """
+        Args:
+            aliases: Пары (название, каноническое название)
+            min_score: Минимальное сходство, при котором название считается найденным
+        """
+        self.min_score = min_score
+        self._exact: Dict[str, int] = {}
+        self._aliases: List[str] = []
+        self._canonical: List[str] = []
+        self._sizes = array('H')
+        postings = defaultdict(lambda: array('I'))
+
+        for alias, canonical in aliases:
+            normalized = normalize_name(alias)
+            if not normalized or normalized in self._exact:
+                continue
+            # Каноническое название приводится к строке офлайн-таблицы, если она есть
+            canonical = nutrition_table.key(canonical) or canonical
+            index = len(self._aliases)
+            self._exact[normalized] = index
+            self._aliases.append(alias)
+            self._canonical.append(canonical)
+            grams = trigrams(normalized)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                postings[gram].append(index)
+
+        self._postings = dict(postings)
+        self._lock = threading.Lock()
+        self._counts = {'exact': 0, 'fuzzy': 0, 'miss': 0}
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def _count(self, result: str):
+        with self._lock:
+            self._counts[result] += 1
+
+    def resolve(self, text: str) -> Optional[NameMatch]:
+        """
+        Находит каноническое название для текста пользователя
+
+        Args:
+            text: Название продукта в свободной форме ('яблоки', 'bananna', 'french-fries')
+
+        Returns:
+            NameMatch или None, если сходство лучшего названия ниже min_score
+        """
+        normalized = normalize_name(text)
+        if not normalized:
+            self._count('miss')
+            return None
+
+        index = self._exact.get(normalized)
+        if index is not None:
+            self._count('exact')
+            return NameMatch(self._canonical[index], self._aliases[index], 1.0)
+
+        grams = trigrams(normalized)
+        overlaps: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                overlaps[candidate] += 1
+
+        best, best_score = None, 0.0
+        for candidate, overlap in overlaps.items():
+            score = 2 * overlap / (len(grams) + self._sizes[candidate])
+            # При равном сходстве - более короткое название (меньше лишних слов)
+            if score > best_score or (
+                score == best_score and len(self._aliases[candidate]) < len(self._aliases[best])
+            ):
+                best, best_score = candidate, score
+
+        if best is None or best_score < self.min_score:
+            self._count('miss')
+            return None
+
+        self._count('fuzzy')
+        return NameMatch(self._canonical[best], self._aliases[best], round(best_score, 3))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'aliases': len(self._aliases),
+            'trigrams': len(self._postings),
+            'min_score': self.min_score,
+            **counts,
+        }
+
+
+# Индекс строится один раз при импорте (несколько тысяч названий, доли секунды)
+name_resolver = NameResolver(dictionary_aliases(), config.NAME_RESOLVER_MIN_SCORE)
+logger.info(f'Индекс названий продуктов: {len(name_resolver)} названий')
@@ -1,8 +1,14 @@
 import os
-from typing import Dict, Optional
+import threading
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
 from requests_oauthlib import OAuth1Session
-from food_name_mapper import map_food_name
+from fatsecret_client import breaker, fatsecret_client, parse_search_response, search_params
+from labels import label_table
+from metrics import timed
+from nutrition_cache import nutrition_cache
+from offline_nutrition import nutrition_table
+import config
 import logging
 
 # Настройка логирования
@@ -20,25 +26,138 @@ FATSECRET_CONSUMER_SECRET = os.getenv('FATSECRET_CONSUMER_SECRET', '')
 logger.info(f"FatSecret API Key loaded: {bool(FATSECRET_CONSUMER_KEY)}")
 logger.info(f"FatSecret Secret loaded: {bool(FATSECRET_CONSUMER_SECRET)}")
 
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _plan(food_name: str) -> Tuple[str, Optional[Dict], Optional[Dict]]:
+    """
+    Ищет продукт в офлайн-таблице и решает, нужен ли запрос к FatSecret
+
+    Returns:
+        (название после маппинга, данные таблицы или None,
+         готовый ответ или None, если нужно обратиться к FatSecret)
+    """
+    # Название для поиска и строка офлайн-таблицы берутся из таблицы меток
+    with timed('name_mapping'):
+        mapped_name = label_table.search_name(food_name)
+        key = label_table.nutrition_key(food_name)
+
+    if key is not None:
+        offline = nutrition_table.lookup(key)
+    else:
+        offline = nutrition_table.lookup(food_name) or nutrition_table.lookup(mapped_name)
+    if offline is not None:
+        offline['original_name'] = food_name
+
+    if offline is not None and config.FATSECRET_MODE != 'prefer':
+        return mapped_name, offline, offline
+
+    if config.FATSECRET_MODE == 'off':
+        return mapped_name, offline, offline or {
+            'error': f'Блюдо "{mapped_name}" не найдено в офлайн-таблице'
+        }
+
+    return mapped_name, offline, None
+
+
+def _merge(food_name: str, offline: Optional[Dict], data: Dict) -> Dict:
+    """Объединяет ответ FatSecret с данными офлайн-таблицы"""
+    if 'error' in data:
+        # Если FatSecret недоступен, отдаем данные таблицы
+        return offline or data
+
+    result = dict(data)
+    result['original_name'] = food_name  # Сохраняем оригинальное название из модели
+    return result
+
 
 def get_nutrition_info(food_name: str) -> Optional[Dict]:
     """
-    Получает информацию о калорийности и питательных веществах блюда через FatSecret API
+    Получает информацию о калорийности и питательных веществах блюда
+
+    Основной источник - офлайн-таблица (data/nutrition_table.csv). FatSecret API
+    используется в зависимости от FATSECRET_MODE: для продуктов, которых нет
+    в таблице (fallback), в первую очередь (prefer) или не используется (off).
+    Ответы FatSecret кэшируются по названию после маппинга (см. nutrition_cache.py).
 
     Args:
         food_name: Название блюда/продукта (из модели)
 
     Returns:
-        Dict с информацией о калориях и питательных веществах или None в случае ошибки
+        Dict с информацией о калориях и питательных веществах (на 100 г) или с ключом 'error'
         {
             'calories': float,
             'protein': float,
             'fat': float,
             'carbs': float,
             'title': str,
-            'original_name': str
+            'original_name': str,
+            'source': str - 'offline' или 'fatsecret'
         }
     """
+    mapped_name, offline, ready = _plan(food_name)
+    if ready is not None:
+        return ready
+
+    data = nutrition_cache.get_or_load(
+        mapped_name.strip().lower(),
+        lambda: fetch_fatsecret_nutrition(mapped_name)
+    )
+    return _merge(food_name, offline, data)
+
+
+async def get_nutrition_info_async(food_name: str) -> Optional[Dict]:
+    """
+    Асинхронный вариант get_nutrition_info для обработчиков FastAPI
+
+    Запрос к FatSecret выполняется в event loop через общий пул соединений
+    (fatsecret_client.py) и не занимает поток из пула питательной ценности.
+
+    Args:
+        food_name: Название блюда/продукта (из модели)
+
+    Returns:
+        То же, что get_nutrition_info
+    """
+    mapped_name, offline, ready = _plan(food_name)
+    if ready is not None:
+        return ready
+
+    data = await nutrition_cache.get_or_load_async(
+        mapped_name.strip().lower(),
+        lambda: fatsecret_client.search(mapped_name)
+    )
+    return _merge(food_name, offline, data)
+
+
+def _oauth_session() -> OAuth1Session:
+    """OAuth1-сессия текущего процесса: соединения с FatSecret переиспользуются между вызовами"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = OAuth1Session(
+                FATSECRET_CONSUMER_KEY,
+                client_secret=FATSECRET_CONSUMER_SECRET
+            )
+            _session_pid = os.getpid()
+        return _session
+
+
+def fetch_fatsecret_nutrition(mapped_name: str) -> Dict:
+    """
+    Запрашивает питательную ценность продукта у FatSecret API (без кэша, синхронно)
+
+    Используется вне event loop (gui.py, скрипты); сервис вызывает
+    fatsecret_client.search. Circuit breaker у обоих клиентов общий.
+
+    Args:
+        mapped_name: Название продукта после маппинга
+
+    Returns:
+        Dict с информацией о калориях и питательных веществах или с ключом 'error'
+    """
     if not FATSECRET_CONSUMER_KEY or not FATSECRET_CONSUMER_SECRET:
         error_msg = 'FatSecret API ключи не найдены. Добавьте FATSECRET_CONSUMER_KEY и FATSECRET_CONSUMER_SECRET в .env файл'
         logger.error(error_msg)
@@ -46,90 +165,30 @@ def get_nutrition_info(food_name: str) -> Optional[Dict]:
             'error': error_msg
         }
 
-    # Преобразуем название из модели в понятное для API
-    mapped_name = map_food_name(food_name)
+    if not breaker.allow():
+        return {'error': 'FatSecret временно недоступен'}
 
     try:
-        # Создаем OAuth1 сессию для FatSecret API
-        oauth = OAuth1Session(
-            FATSECRET_CONSUMER_KEY,
-            client_secret=FATSECRET_CONSUMER_SECRET
+        response = _oauth_session().post(
+            config.FATSECRET_URL,
+            data=search_params(mapped_name),
+            timeout=config.FATSECRET_TIMEOUT
         )
-
-        # FatSecret использует метод-based интеграцию
-        url = "https://platform.fatsecret.com/rest/server.api"
-
-        params = {
-            'method': 'foods.search',
-            'search_expression': mapped_name,
-            'max_results': 1,
-            'format': 'json'
-        }
-
-        response = oauth.post(url, data=params, timeout=10)
         response.raise_for_status()
-
         data = response.json()
-
-        # Проверяем, есть ли результаты
-        if 'foods' not in data or 'food' not in data['foods']:
-            return {
-                'error': f'Блюдо "{mapped_name}" не найдено в базе данных FatSecret'
-            }
-
-        food = data['foods']['food']
-        
-        # Парсим информацию из food_description
-        # Формат: "Per 100g - Calories: 254kcal | Fat: 20.00g | Carbs: 0.00g | Protein: 17.17g"
-        description = food.get('food_description', '')
-        
-        # Извлекаем калории, жиры, углеводы, белки из описания
-        calories = 0
-        protein = 0
-        fat = 0
-        carbs = 0
-        
-        if description:
-            import re
-            # Извлекаем значения с использованием regex
-            cal_match = re.search(r'Calories:\s*([\d.]+)', description)
-            if cal_match:
-                calories = float(cal_match.group(1))
-            
-            fat_match = re.search(r'Fat:\s*([\d.]+)', description)
-            if fat_match:
-                fat = float(fat_match.group(1))
-            
-            carbs_match = re.search(r'Carbs:\s*([\d.]+)', description)
-            if carbs_match:
-                carbs = float(carbs_match.group(1))
-            
-            protein_match = re.search(r'Protein:\s*([\d.]+)', description)
-            if protein_match:
-                protein = float(protein_match.group(1))
-
-        # Извлекаем нужную информацию
-        result = {
-            'title': food.get('food_name', mapped_name),
-            'original_name': food_name,  # Сохраняем оригинальное название из модели
-            'calories': calories,
-            'protein': protein,
-            'fat': fat,
-            'carbs': carbs,
-            'calories_unit': 'kcal',
-            'protein_unit': 'g',
-            'fat_unit': 'g',
-            'carbs_unit': 'g'
-        }
-
-        return result
-
     except Exception as e:
+        breaker.record_failure()
         error_msg = f'Ошибка при запросе к API: {str(e)}'
         logger.error(error_msg, exc_info=True)
         return {
             'error': error_msg
         }
+    except BaseException:
+        breaker.release()
+        raise
+
+    breaker.record_success()
+    return parse_search_response(data, mapped_name)
 
 
 def format_nutrition_info(nutrition_data: Dict) -> str:
@@ -0,0 +1,345 @@
+"""
+Кэш информации о питательной ценности: LRU в памяти перед хранилищем SQLite
+
+Данные для одного и того же продукта практически не меняются, поэтому:
+- свежие записи отдаются сразу;
+- устаревшие (stale) записи тоже отдаются сразу, а обновляются в фоне;
+- одновременные запросы одного ключа объединяются в один запрос к API.
+
+get_or_load вызывается из потоков (загрузчик - обычная функция), get_or_load_async -
+из event loop (загрузчик - корутина, например fatsecret_client.FatSecretClient.search).
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class NutritionCache:
+    """Двухуровневый кэш (память + SQLite) со stale-while-revalidate и объединением запросов"""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        fresh_ttl: float = 7 * 24 * 3600,
+        stale_ttl: float = 90 * 24 * 3600,
+        db_path: str = None
+    ):
+        """
+        Args:
+            max_entries: Максимальное количество записей в памяти
+            fresh_ttl: Сколько секунд запись считается свежей
+            stale_ttl: Сколько секунд устаревшую запись еще можно отдавать, обновляя в фоне
+            db_path: Путь к файлу SQLite (None - только память)
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = max(stale_ttl, fresh_ttl)
+        self.db_path = db_path
+
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._async_inflight: Dict[str, 'asyncio.Task'] = {}
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='nutrition-refresh')
+        # Чтение и запись SQLite для event loop: отдельный поток, чтобы обращения к диску
+        # не ждали фоновых обновлений с запросами к API
+        self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix='nutrition-disk')
+
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._refreshes = 0
+        self._load_errors = 0
+
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """
+        Соединение с SQLite текущего процесса
+
+        Соединение открывается при первом обращении и заново после fork:
+        воркеры gunicorn не должны пользоваться соединением мастер-процесса.
+        """
+        if not self.db_path:
+            return None
+        if self._db_pid != os.getpid():
+            with self._db_lock:
+                if self._db_pid != os.getpid():
+                    self._open_db()
+                    self._db_pid = os.getpid()
+        return self._db
+
+    def _open_db(self):
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS nutrition (key TEXT PRIMARY KEY, fetched_at REAL, data TEXT)'
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f'Не удалось открыть кэш питательной ценности {self.db_path}: {e}')
+            self._db = None
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Dict]]:
+        db = self._connection()
+        if db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = db.execute(
+                    'SELECT fetched_at, data FROM nutrition WHERE key = ?', (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f'Ошибка чтения кэша питательной ценности: {e}')
+            return None
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _write_disk(self, key: str, fetched_at: float, value: Dict):
+        db = self._connection()
+        if db is None:
+            return
+        try:
+            with self._db_lock:
+                db.execute(
+                    'INSERT OR REPLACE INTO nutrition (key, fetched_at, data) VALUES (?, ?, ?)',
+                    (key, fetched_at, json.dumps(value, ensure_ascii=False))
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            logger.error(f'Ошибка записи кэша питательной ценности: {e}')
+
+    def _remember(self, key: str, fetched_at: float, value: Dict):
+        with self._lock:
+            self._entries[key] = (fetched_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup_memory(self, key: str) -> Optional[Tuple[float, Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _lookup(self, key: str) -> Optional[Tuple[float, Dict]]:
+        """Ищет запись в памяти, затем на диске"""
+        entry = self._lookup_memory(key)
+        if entry is not None:
+            return entry
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, *entry)
+        return entry
+
+    def _accept(self, key: str, value: Optional[Dict]) -> Optional[float]:
+        """Кладет успешный ответ в память; возвращает время получения (None - ответ с ошибкой)"""
+        if value is None or 'error' in value:
+            with self._lock:
+                self._load_errors += 1
+            return None
+        fetched_at = time.time()
+        self._remember(key, fetched_at, value)
+        return fetched_at
+
+    def _load(self, key: str, loader: Callable[[], Dict]) -> Dict:
+        """
+        Загружает значение, объединяя одновременные запросы одного ключа
+
+        Ответы с ключом 'error' возвращаются вызывающему, но не кэшируются.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader()
+            fetched_at = self._accept(key, value)
+            if fetched_at is not None:
+                self._write_disk(key, fetched_at, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            with self._lock:
+                self._load_errors += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Dict]):
+        with self._lock:
+            if key in self._inflight:
+                return
+            self._refreshes += 1
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                logger.warning(f'Не удалось обновить питательную ценность "{key}": {e}')
+
+        self._refresher.submit(refresh)
+
+    def get_or_load(self, key: str, loader: Callable[[], Dict]) -> Dict:
+        """
+        Возвращает значение из кэша или загружает его через loader
+
+        Args:
+            key: Ключ (нормализованное название продукта)
+            loader: Функция без аргументов, запрашивающая данные у внешнего API
+
+        Returns:
+            Dict с питательной ценностью (или с ключом 'error', если загрузить не удалось)
+        """
+        entry = self._lookup(key)
+        now = time.time()
+
+        if entry is not None:
+            fetched_at, value = entry
+            age = now - fetched_at
+            if age <= self.fresh_ttl:
+                with self._lock:
+                    self._hits += 1
+                return value
+            if age <= self.stale_ttl:
+                with self._lock:
+                    self._stale_hits += 1
+                self._refresh_in_background(key, loader)
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return self._load(key, loader)
+
+    async def _fetch_async(self, key: str, loader: Callable[[], Awaitable[Dict]]) -> Dict:
+        try:
+            value = await loader()
+        except Exception:
+            with self._lock:
+                self._load_errors += 1
+            raise
+        fetched_at = self._accept(key, value)
+        if fetched_at is not None:
+            # Запись в SQLite (с commit) не должна блокировать event loop
+            self._disk.submit(self._write_disk, key, fetched_at, value)
+        return value
+
+    def _start_async_load(self, key: str, loader: Callable[[], Awaitable[Dict]]) -> 'asyncio.Task':
+        """
+        Запускает загрузку ключа отдельной задачей (или возвращает уже идущую)
+
+        Загрузка не отменяется вместе с вызывающим (например, по сроку запроса):
+        ее результат все равно попадет в кэш и достанется следующим запросам.
+        """
+        task = self._async_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_async(key, loader))
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda _: self._async_inflight.pop(key, None))
+        else:
+            with self._lock:
+                self._coalesced += 1
+        return task
+
+    def _refresh_in_background_async(self, key: str, loader: Callable[[], Awaitable[Dict]]):
+        if key in self._async_inflight:
+            return
+        with self._lock:
+            self._refreshes += 1
+
+        def log_failure(task: 'asyncio.Task'):
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(f'Не удалось обновить питательную ценность "{key}": {task.exception()}')
+
+        self._start_async_load(key, loader).add_done_callback(log_failure)
+
+    async def get_or_load_async(self, key: str, loader: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Асинхронный вариант get_or_load для вызова из event loop
+
+        Args:
+            key: Ключ (нормализованное название продукта)
+            loader: Функция без аргументов, возвращающая корутину запроса к внешнему API
+
+        Returns:
+            Dict с питательной ценностью (или с ключом 'error', если загрузить не удалось)
+        """
+        entry = self._lookup_memory(key)
+        if entry is None and self.db_path:
+            # Запрос к SQLite ждет _db_lock, пока идет commit записи, поэтому не в event loop
+            entry = await asyncio.get_running_loop().run_in_executor(self._disk, self._lookup, key)
+        now = time.time()
+
+        if entry is not None:
+            fetched_at, value = entry
+            age = now - fetched_at
+            if age <= self.fresh_ttl:
+                with self._lock:
+                    self._hits += 1
+                return value
+            if age <= self.stale_ttl:
+                with self._lock:
+                    self._stale_hits += 1
+                self._refresh_in_background_async(key, loader)
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return await asyncio.shield(self._start_async_load(key, loader))
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий, промахов и фоновых обновлений"""
+        with self._lock:
+            lookups = self._hits + self._stale_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'persistent': bool(self.db_path),
+                'hits': self._hits,
+                'stale_hits': self._stale_hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'background_refreshes': self._refreshes,
+                'load_errors': self._load_errors,
+                'in_flight': len(self._inflight) + len(self._async_inflight),
+                'hit_rate': round((self._hits + self._stale_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Общий кэш питательной ценности (ключ - название продукта после маппинга)
+nutrition_cache = NutritionCache(
+    max_entries=config.NUTRITION_CACHE_SIZE,
+    fresh_ttl=config.NUTRITION_CACHE_FRESH_TTL,
+    stale_ttl=config.NUTRITION_CACHE_STALE_TTL,
+    db_path=config.NUTRITION_CACHE_DB or None
+)
@@ -0,0 +1,116 @@
+"""
+Офлайн-таблица питательной ценности (на 100 г) для всех меток модели
+
+Таблица собирается скриптом build_nutrition_table.py и загружается один раз
+при импорте. Значения хранятся в плоском массиве float32 по одной строке на
+каноническое название, метки указывают на строки через словарь индексов.
+"""
+import csv
+import logging
+import os
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+NUTRIENTS = ('calories', 'protein', 'fat', 'carbs')
+
+
+class NutritionTable:
+    """Компактная таблица: метка -> индекс строки -> (ккал, белки, жиры, углеводы)"""
+
+    __slots__ = ('_index', '_names', '_values')
+
+    def __init__(self, index: Dict[str, int], names: List[str], values: array):
+        self._index = index
+        self._names = names
+        self._values = values
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, name: str) -> bool:
+        return name.strip().lower() in self._index
+
+    def key(self, name: str) -> Optional[str]:
+        """Каноническое название строки таблицы для метки или названия (None - нет данных)"""
+        row = self._index.get(name.strip().lower())
+        return self._names[row] if row is not None else None
+
+    def aliases(self) -> Iterator[Tuple[str, str]]:
+        """Все метки и названия таблицы с каноническим названием их строки"""
+        for name, row in self._index.items():
+            yield name, self._names[row]
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """
+        Ищет питательную ценность по метке модели или каноническому названию
+
+        Args:
+            name: Метка модели ('bread-rye') или название ('rye bread')
+
+        Returns:
+            Dict в формате get_nutrition_info (на 100 г) или None
+        """
+        row = self._index.get(name.strip().lower())
+        if row is None:
+            return None
+
+        offset = row * 4
+        calories, protein, fat, carbs = self._values[offset:offset + 4]
+        title = self._names[row]
+        return {
+            'title': title[:1].upper() + title[1:],
+            'calories': round(calories, 2),
+            'protein': round(protein, 2),
+            'fat': round(fat, 2),
+            'carbs': round(carbs, 2),
+            'calories_unit': 'kcal',
+            'protein_unit': 'g',
+            'fat_unit': 'g',
+            'carbs_unit': 'g',
+            'per_grams': 100,
+            'source': 'offline'
+        }
+
+
+def load_nutrition_table(path: str = config.NUTRITION_TABLE_PATH) -> NutritionTable:
+    """
+    Загружает таблицу из CSV (label, name, calories, protein, fat, carbs)
+
+    Args:
+        path: Путь к data/nutrition_table.csv
+
+    Returns:
+        NutritionTable (пустая, если файла нет)
+    """
+    index: Dict[str, int] = {}
+    names: List[str] = []
+    rows_by_name: Dict[str, int] = {}
+    values = array('f')
+
+    if not os.path.exists(path):
+        logger.warning(f'Офлайн-таблица питательной ценности не найдена: {path}')
+        return NutritionTable(index, names, values)
+
+    with open(path, encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            name = record['name']
+            row = rows_by_name.get(name)
+            if row is None:
+                row = len(names)
+                rows_by_name[name] = row
+                names.append(name)
+                values.extend(float(record[n]) for n in NUTRIENTS)
+            index[record['label']] = row
+            # Каноническое название тоже ищется напрямую
+            index.setdefault(name, row)
+
+    logger.info(f'Офлайн-таблица питательной ценности: {len(index)} меток, {len(names)} продуктов')
+    return NutritionTable(index, names, values)
+
+
+# Таблица загружается один раз при импорте
+nutrition_table = load_nutrition_table()
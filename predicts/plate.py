@@ -0,0 +1,253 @@
+"""
+Разбор тарелки на отдельные продукты: все экземпляры после NMS по классам и тайловый проход
+
+Модель прогоняется по всему изображению и (для больших фото) по перекрывающимся
+фрагментам сетки PLATE_TILE_GRID x PLATE_TILE_GRID: мелкие продукты, которые
+теряются после уменьшения всего снимка до входа модели, на фрагментах крупнее.
+Рамки всех проходов переводятся в координаты изображения и объединяются NMS
+отдельно для каждого класса.
+"""
+import time
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from portion import NUTRIENT_FIELDS, estimate_item_portion, find_plate, scale_nutrition
+from preprocess import PreparedImage, decode_image, image_size, prepare_decoded
+
+
+class PlateInput:
+    """
+    Проходы модели для одного изображения: весь кадр и (если включено) фрагменты
+
+    views - PreparedImage каждого прохода, origins - левый верхний угол прохода
+    в пикселях декодированного изображения размера size. После инференса буферы
+    нужно вернуть в пул через release().
+    """
+
+    def __init__(self, views: List[PreparedImage], origins: List[Tuple[int, int]], size: Tuple[int, int], timings: Dict[str, float]):
+        self.views = views
+        self.origins = origins
+        self.size = size
+        self.timings = timings
+
+    @property
+    def tiled(self) -> bool:
+        return len(self.views) > 1
+
+    def release(self):
+        for view in self.views:
+            view.release()
+
+
+def tile_boxes(size: Tuple[int, int], grid: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    Фрагменты сетки grid x grid с перекрытием
+
+    Args:
+        size: (ширина, высота) изображения
+        grid: Количество фрагментов по каждой стороне
+        overlap: Доля перекрытия соседних фрагментов
+
+    Returns:
+        Список (x1, y1, x2, y2) в пикселях
+    """
+    width, height = size
+    tiles = []
+    for row in range(grid):
+        for col in range(grid):
+            box = []
+            for index, side in ((col, width), (row, height)):
+                step = side / grid
+                length = min(side, step * (1 + overlap))
+                start = min(max(0.0, index * step - (length - step) / 2), side - length)
+                box.append((int(round(start)), int(round(start + length))))
+            (x1, x2), (y1, y2) = box
+            tiles.append((x1, y1, x2, y2))
+    return tiles
+
+
+def prepare_plate(fp: BinaryIO, tiled: Optional[bool] = None, imgsz: int = config.MODEL_IMGSZ) -> PlateInput:
+    """
+    Декодирует изображение и готовит проходы модели
+
+    Args:
+        fp: Файловый объект с байтами изображения
+        tiled: Тайловый проход: True/False или None - автоматически, если длинная сторона
+            исходного изображения не меньше PLATE_TILE_MIN_SIDE
+        imgsz: Размер входа модели
+
+    Returns:
+        PlateInput с временами decode_ms и resize_ms в timings
+    """
+    grid = max(1, config.PLATE_TILE_GRID)
+    started = time.perf_counter()
+    if tiled is None:
+        # Решение по исходному размеру: после draft-декодирования сторона уже уменьшена
+        tiled = grid > 1 and max(image_size(fp)) >= config.PLATE_TILE_MIN_SIDE
+    # Для фрагментов нужно разрешение выше входа модели
+    img = decode_image(fp, target_size=imgsz * grid if tiled else imgsz)
+    decoded = time.perf_counter()
+
+    views = [prepare_decoded(img, imgsz)]
+    origins = [(0, 0)]
+    try:
+        if tiled and grid > 1:
+            for x1, y1, x2, y2 in tile_boxes(img.size, grid, config.PLATE_TILE_OVERLAP):
+                views.append(prepare_decoded(img.crop((x1, y1, x2, y2)), imgsz))
+                origins.append((x1, y1))
+    except BaseException:
+        for view in views:
+            view.release()
+        raise
+
+    timings = {
+        'decode_ms': (decoded - started) * 1000,
+        'resize_ms': (time.perf_counter() - decoded) * 1000,
+    }
+    return PlateInput(views, origins, img.size, timings)
+
+
+def class_aware_nms(
+    xyxy: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    iou_threshold: float,
+    containment: float = 0.85
+) -> np.ndarray:
+    """
+    Жадный NMS отдельно для каждого класса
+
+    Кроме пересечения по IoU подавляются рамки, почти целиком лежащие внутри более
+    уверенной рамки того же класса: так убираются обрезанные части продукта на
+    границах фрагментов, когда весь продукт найден на полном кадре.
+
+    Args:
+        xyxy: Рамки N x 4
+        scores: Уверенность N
+        classes: Классы N
+        iou_threshold: Порог IoU подавления
+        containment: Порог доли площади рамки внутри более уверенной рамки
+
+    Returns:
+        Индексы оставленных рамок по убыванию уверенности
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Сдвиг рамок на класс * размах координат: рамки разных классов не пересекаются
+    offset = classes.astype(np.float32)[:, None] * (float(xyxy.max()) + 1)
+    boxes = xyxy + offset
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = width * height
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        inside = inter / np.maximum(areas[rest], 1e-9)
+        order = rest[(iou <= iou_threshold) & (inside < containment)]
+    return np.array(keep, dtype=np.int64)
+
+
+def merge_views(
+    plate: PlateInput,
+    raw: List[Tuple[np.ndarray, np.ndarray, np.ndarray, Tuple[int, int]]],
+    names: Dict[int, str]
+) -> List[Dict]:
+    """
+    Переводит рамки всех проходов в координаты изображения и объединяет их NMS
+
+    Args:
+        plate: Проходы модели
+        raw: Результат result_parser.raw_detections для каждого прохода
+        names: Названия классов модели
+
+    Returns:
+        Экземпляры по убыванию уверенности:
+        {'label', 'confidence' (%), 'box' (в долях изображения), 'area_fraction'}
+    """
+    boxes, scores, classes = [], [], []
+    for (x0, y0), (xyxy, conf, cls, _) in zip(plate.origins, raw):
+        boxes.append(xyxy + np.array([x0, y0, x0, y0], dtype=np.float32))
+        scores.append(conf)
+        classes.append(cls)
+
+    xyxy = np.concatenate(boxes)
+    conf = np.concatenate(scores)
+    cls = np.concatenate(classes)
+
+    confident = conf * 100 >= config.PLATE_MIN_CONFIDENCE
+    xyxy, conf, cls = xyxy[confident], conf[confident], cls[confident]
+    keep = class_aware_nms(xyxy, conf, cls, config.PLATE_NMS_IOU)
+
+    width, height = plate.size
+    normalized = xyxy[keep] / np.array([width, height, width, height], dtype=np.float32)
+    area_fraction = (normalized[:, 2] - normalized[:, 0]) * (normalized[:, 3] - normalized[:, 1])
+
+    return [
+        {
+            'label': names[int(class_id)].lower(),
+            'confidence': float(confidence) * 100,
+            'box': [round(float(v), 4) for v in box],
+            'area_fraction': round(float(area), 4),
+        }
+        for class_id, confidence, box, area in zip(cls[keep], conf[keep], normalized, area_fraction)
+    ]
+
+
+def build_plate(detections: List[Dict], nutrition_by_label: Dict[str, Dict]) -> Dict:
+    """
+    Собирает продукты тарелки с порциями и питательной ценностью
+
+    Рамки с метками из PORTION_PLATE_LABELS считаются тарелкой (эталоном
+    размера порции), а не продуктами.
+
+    Args:
+        detections: Экземпляры из merge_views
+        nutrition_by_label: Питательная ценность на 100 г по названиям продуктов
+
+    Returns:
+        Dict с полями items, counts, total и plate
+    """
+    items = []
+    counts: Dict[str, int] = {}
+    total = {'grams': 0.0, **{field: 0.0 for field in NUTRIENT_FIELDS}, 'items_without_nutrition': 0}
+
+    for detection in detections:
+        if detection['label'] in config.PORTION_PLATE_LABELS:
+            continue
+        portion = estimate_item_portion(detection, detections)
+        nutrition = nutrition_by_label.get(detection['label'])
+
+        portion_nutrition = scale_nutrition(nutrition, portion['grams']) if nutrition is not None else None
+        if portion_nutrition is not None:
+            for field in NUTRIENT_FIELDS:
+                total[field] += portion_nutrition.get(field) or 0
+        else:
+            total['items_without_nutrition'] += 1
+
+        total['grams'] += portion['grams']
+        counts[detection['label']] = counts.get(detection['label'], 0) + 1
+        items.append({
+            **detection,
+            'portion': portion,
+            'nutrition': nutrition,
+            'portion_nutrition': portion_nutrition,
+        })
+
+    for field in ('grams',) + NUTRIENT_FIELDS:
+        total[field] = round(total[field], 1)
+
+    return {
+        'items': items,
+        'counts': counts,
+        'total': total,
+        'plate': find_plate(detections),
+    }
@@ -0,0 +1,136 @@
+"""
+Оценка размера порции по рамкам детекции и пересчет питательной ценности на порцию
+
+Порция оценивается по площади рамок продукта относительно эталона: рамки тарелки
+(метки из PORTION_PLATE_LABELS), если модель ее нашла, иначе всего кадра. Доля
+площади переводится в граммы линейно: полная тарелка - PORTION_PLATE_GRAMS,
+весь кадр - PORTION_FRAME_GRAMS. Это грубая оценка, но она ближе к реальной
+порции, чем фиксированные 100 г, и уменьшает число ручных правок в дневнике.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+
+# Разрешение сетки, на которой считается площадь объединения рамок
+_GRID = 128
+
+# Поля питательной ценности, которые пересчитываются на порцию
+NUTRIENT_FIELDS = ('calories', 'protein', 'fat', 'carbs')
+
+
+def estimate_portion(detections: List[Dict], label: str) -> Optional[Dict]:
+    """
+    Оценивает вес порции продукта по его рамкам
+
+    Args:
+        detections: Рамки из parse_result ('label', 'box' в долях изображения, 'area_fraction')
+        label: Название продукта
+
+    Returns:
+        Dict с оценкой или None, если у продукта нет рамок (модель классификации)
+        {
+            'grams': float - оценка веса порции,
+            'area_fraction': float - доля площади эталона под продуктом,
+            'reference': str - 'plate' или 'image',
+            'boxes': int - сколько рамок продукта учтено (с уверенностью от PORTION_MIN_CONFIDENCE)
+        }
+    """
+    food = [
+        d for d in detections
+        if d['label'] == label and d['confidence'] >= config.PORTION_MIN_CONFIDENCE
+    ]
+    if not food:
+        return None
+
+    # Несколько рамок одного продукта (например, ломтики) объединяются без двойного учета пересечений
+    portion = _portion_for_area(union_area([d['box'] for d in food]), detections)
+    portion['boxes'] = len(food)
+    return portion
+
+
+def estimate_item_portion(item: Dict, detections: List[Dict]) -> Dict:
+    """
+    Оценивает вес одного экземпляра продукта (одной рамки)
+
+    Args:
+        item: Рамка продукта ('box' в долях изображения)
+        detections: Все рамки изображения (для поиска тарелки-эталона)
+
+    Returns:
+        Dict в формате estimate_portion (boxes = 1)
+    """
+    portion = _portion_for_area(union_area([item['box']]), detections)
+    portion['boxes'] = 1
+    return portion
+
+
+def find_plate(detections: List[Dict]) -> Optional[Dict]:
+    """Самая большая рамка с меткой из PORTION_PLATE_LABELS (или None)"""
+    plates = [d for d in detections if d['label'] in config.PORTION_PLATE_LABELS]
+    return max(plates, key=lambda d: d['area_fraction']) if plates else None
+
+
+def _portion_for_area(area: float, detections: List[Dict]) -> Dict:
+    """Переводит площадь (в долях изображения) в граммы относительно тарелки или кадра"""
+    plate = find_plate(detections)
+    if plate is not None:
+        reference, reference_area, reference_grams = 'plate', plate['area_fraction'], config.PORTION_PLATE_GRAMS
+    else:
+        reference, reference_area, reference_grams = 'image', 1.0, config.PORTION_FRAME_GRAMS
+
+    fraction = min(1.0, area / reference_area) if reference_area > 0 else 0.0
+
+    grams = reference_grams * fraction
+    grams = min(config.PORTION_MAX_GRAMS, max(config.PORTION_MIN_GRAMS, grams))
+
+    return {
+        'grams': round(grams / 5) * 5,
+        'area_fraction': round(fraction, 3),
+        'reference': reference,
+    }
+
+
+def union_area(boxes: List[List[float]]) -> float:
+    """
+    Площадь объединения рамок (в долях изображения)
+
+    Args:
+        boxes: Рамки [x1, y1, x2, y2] в долях изображения
+
+    Returns:
+        Доля изображения, покрытая хотя бы одной рамкой
+    """
+    if len(boxes) == 1:
+        x1, y1, x2, y2 = boxes[0]
+        return max(0.0, x2 - x1) * max(0.0, y2 - y1)
+
+    cells = np.clip(np.rint(np.asarray(boxes, dtype=np.float32) * _GRID), 0, _GRID).astype(np.int32)
+    mask = np.zeros((_GRID, _GRID), dtype=bool)
+    for x1, y1, x2, y2 in cells:
+        mask[y1:y2, x1:x2] = True
+    return float(mask.mean())
+
+
+def scale_nutrition(nutrition: Dict, grams: float) -> Optional[Dict]:
+    """
+    Пересчитывает питательную ценность на 100 г в значения на порцию
+
+    Args:
+        nutrition: Питательная ценность (формат get_nutrition_info)
+        grams: Вес порции
+
+    Returns:
+        Копия nutrition с пересчитанными calories/protein/fat/carbs и полем 'grams'
+        или None, если значения не на 100 г (per_grams другой: ошибка или
+        ответ FatSecret на порцию/чашку - такие числа в граммы не переводятся)
+    """
+    if nutrition.get('per_grams') != 100:
+        return None
+    scaled = dict(nutrition)
+    for field in NUTRIENT_FIELDS:
+        if isinstance(nutrition.get(field), (int, float)):
+            scaled[field] = round(nutrition[field] * grams / 100, 1)
+    scaled['grams'] = grams
+    return scaled
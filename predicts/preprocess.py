@@ -0,0 +1,274 @@
+"""
+Предобработка изображений перед моделью: быстрое декодирование и letterbox до размера входа
+"""
+import threading
+import time
+from typing import BinaryIO, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import config
+from ingest import ImageTooLargeError, InvalidImageError
+
+try:
+    # Поддержка HEIC/HEIF с iPhone (необязательная зависимость)
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Цвет заполнения полей letterbox (как в ultralytics)
+LETTERBOX_FILL = 114
+
+
+class BufferPool:
+    """Пул переиспользуемых буферов под вход модели"""
+
+    def __init__(self, size: int, max_free: int = 64):
+        """
+        Args:
+            size: Сторона квадратного буфера (размер входа модели)
+            max_free: Сколько свободных буферов держать в пуле
+        """
+        self.size = size
+        self.max_free = max_free
+        self._free: List[np.ndarray] = []
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return np.empty((self.size, self.size, 3), dtype=np.uint8)
+
+    def release(self, buffer: np.ndarray):
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(buffer)
+
+
+class PreparedImage:
+    """
+    Изображение, приведенное к входу модели
+
+    image - буфер из пула (imgsz x imgsz, BGR). После инференса буфер нужно
+    вернуть в пул через release(); остальные поля остаются доступны.
+    source_size - (ширина, высота) декодированного изображения до letterbox,
+    scale и pad - параметры, которыми оно вписано в буфер.
+    """
+
+    __slots__ = ('image', 'source_size', 'scale', 'pad', 'timings', '_pool')
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        source_size: Tuple[int, int],
+        scale: float,
+        pad: Tuple[int, int],
+        timings: Dict[str, float],
+        pool: BufferPool
+    ):
+        self.image = image
+        self.source_size = source_size
+        self.scale = scale
+        self.pad = pad
+        self.timings = timings
+        self._pool = pool
+
+    @property
+    def content(self) -> np.ndarray:
+        """Часть буфера с самим изображением (без полей letterbox)"""
+        left, top = self.pad
+        width = max(1, round(self.source_size[0] * self.scale))
+        height = max(1, round(self.source_size[1] * self.scale))
+        return self.image[top:top + height, left:left + width]
+
+    @property
+    def letterbox(self) -> Tuple[float, Tuple[int, int], Tuple[int, int]]:
+        """(scale, pad, source_size) - чтобы перевести рамки детекций обратно в координаты изображения"""
+        return self.scale, self.pad, self.source_size
+
+    def release(self):
+        """Возвращает буфер в пул"""
+        if self.image is not None:
+            self._pool.release(self.image)
+            self.image = None
+
+
+class _PreprocessStats:
+    """Накопленные времена декодирования и ресайза"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.decode_ms = 0.0
+        self.resize_ms = 0.0
+
+    def add(self, decode_ms: float, resize_ms: float):
+        with self._lock:
+            self.images += 1
+            self.decode_ms += decode_ms
+            self.resize_ms += resize_ms
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            images = self.images
+            return {
+                'images': images,
+                'avg_decode_ms': round(self.decode_ms / images, 2) if images else 0.0,
+                'avg_resize_ms': round(self.resize_ms / images, 2) if images else 0.0,
+            }
+
+
+_buffer_pool = BufferPool(config.MODEL_IMGSZ)
+_stats = _PreprocessStats()
+
+
+def image_size(fp: BinaryIO) -> Tuple[int, int]:
+    """
+    Читает размер исходного изображения из заголовка, не декодируя пиксели
+
+    Позиция файла возвращается на начало, чтобы затем вызвать decode_image().
+
+    Args:
+        fp: Файловый объект с байтами изображения (с поддержкой seek)
+
+    Returns:
+        Tuple (ширина, высота) без учета EXIF-ориентации
+
+    Raises:
+        InvalidImageError: Если данные не являются изображением
+    """
+    try:
+        with Image.open(fp) as img:
+            return img.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError('Не удалось прочитать изображение') from e
+    finally:
+        fp.seek(0)
+
+
+def decode_image(fp: BinaryIO, target_size: int = None, max_pixels: int = config.MAX_IMAGE_PIXELS) -> Image.Image:
+    """
+    Декодирует изображение в RGB с учетом EXIF-ориентации
+
+    Для JPEG используется draft-режим: libjpeg сразу декодирует уменьшенную
+    в 2/4/8 раз копию (масштабирование в DCT-области), не меньшую target_size.
+
+    Args:
+        fp: Файловый объект с байтами изображения
+        target_size: Минимальная нужная сторона (None - декодировать полностью)
+        max_pixels: Максимальное количество пикселей исходного изображения
+
+    Returns:
+        PIL.Image в режиме RGB
+
+    Raises:
+        InvalidImageError: Если данные не являются изображением
+        ImageTooLargeError: Если изображение больше max_pixels
+    """
+    try:
+        with Image.open(fp) as img:
+            if img.width * img.height > max_pixels:
+                raise ImageTooLargeError(
+                    f'Изображение слишком большое: {img.width}x{img.height}'
+                )
+
+            if target_size:
+                img.draft('RGB', (target_size, target_size))
+
+            # Телефоны сохраняют поворот в EXIF, а не в пикселях
+            img = ImageOps.exif_transpose(img)
+            return img.convert('RGB')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError('Не удалось прочитать изображение') from e
+
+
+def letterbox(img: Image.Image, out: np.ndarray) -> Tuple[float, Tuple[int, int]]:
+    """
+    Масштабирует изображение с сохранением пропорций и вписывает его в квадратный буфер
+
+    Args:
+        img: Изображение RGB
+        out: Буфер (size x size x 3), в который пишется результат в порядке BGR
+
+    Returns:
+        Tuple (масштаб, (отступ_слева, отступ_сверху))
+    """
+    size = out.shape[0]
+    width, height = img.size
+    scale = min(size / width, size / height)
+    new_w = max(1, round(width * scale))
+    new_h = max(1, round(height * scale))
+
+    if (new_w, new_h) != (width, height):
+        img = img.resize((new_w, new_h), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    left = (size - new_w) // 2
+    top = (size - new_h) // 2
+
+    # Заполняем только поля, центральная часть перезаписывается изображением
+    out[:top] = LETTERBOX_FILL
+    out[top + new_h:] = LETTERBOX_FILL
+    out[top:top + new_h, :left] = LETTERBOX_FILL
+    out[top:top + new_h, left + new_w:] = LETTERBOX_FILL
+
+    # RGB -> BGR одним векторным копированием
+    out[top:top + new_h, left:left + new_w] = np.asarray(img)[:, :, ::-1]
+
+    return scale, (left, top)
+
+
+def prepare_image(fp: BinaryIO, imgsz: int = config.MODEL_IMGSZ) -> PreparedImage:
+    """
+    Декодирует изображение и приводит его к входу модели
+
+    Args:
+        fp: Файловый объект с байтами изображения
+        imgsz: Размер входа модели
+
+    Returns:
+        PreparedImage с буфером из пула и временами decode/resize в timings
+    """
+    started = time.perf_counter()
+    img = decode_image(fp, target_size=imgsz)
+    decoded_ms = (time.perf_counter() - started) * 1000
+
+    prepared = prepare_decoded(img, imgsz)
+    prepared.timings['decode_ms'] = decoded_ms
+    _stats.add(decoded_ms, prepared.timings['resize_ms'])
+    return prepared
+
+
+def prepare_decoded(img: Image.Image, imgsz: int = config.MODEL_IMGSZ) -> PreparedImage:
+    """
+    Приводит уже декодированное изображение (или его фрагмент) к входу модели
+
+    Args:
+        img: Изображение RGB
+        imgsz: Размер входа модели
+
+    Returns:
+        PreparedImage с буфером из пула и временем resize в timings
+    """
+    started = time.perf_counter()
+    pool = _buffer_pool if imgsz == _buffer_pool.size else BufferPool(imgsz, max_free=0)
+    buffer = pool.acquire()
+    try:
+        scale, pad = letterbox(img, buffer)
+    except BaseException:
+        pool.release(buffer)
+        raise
+
+    timings = {'resize_ms': (time.perf_counter() - started) * 1000}
+    return PreparedImage(buffer, img.size, scale, pad, timings, pool)
+
+
+def preprocess_stats() -> Dict:
+    """Средние времена декодирования и ресайза, а также число буферов в пуле"""
+    stats = _stats.as_dict()
+    stats['buffers_allocated'] = _buffer_pool.allocated
+    return stats
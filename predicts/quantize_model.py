@@ -0,0 +1,240 @@
+"""
+INT8-квантование модели и отчет о точности, задержке и памяти по сравнению с FP32
+
+Скрипт экспортирует best.pt в ONNX (как бэкенд onnx), квантует граф
+средствами ONNX Runtime и сохраняет результат в model/best.int8.onnx,
+который выбирается через MODEL_BACKEND=onnx-int8.
+
+- static (по умолчанию) - веса и активации в INT8, диапазоны активаций
+  калибруются на изображениях из --calibration;
+- dynamic - в INT8 только веса, калибровка не нужна.
+
+Затем каждая модель замеряется в отдельном процессе (чтобы RSS не смешивался):
+совпадение топ-1/топ-5 с FP32, средняя и p95 задержка, RSS после загрузки.
+
+Использование:
+    python quantize_model.py                                  # static, калибровка на imgs/
+    python quantize_model.py --mode dynamic
+    python quantize_model.py --report-only --images imgs --report report.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List
+
+import numpy as np
+
+import config
+from backends import ensure_exported, exported_path
+
+
+def to_model_input(image: np.ndarray) -> np.ndarray:
+    """Буфер prepare_image (HWC, BGR, uint8) -> вход ONNX-модели (1, 3, H, W), RGB, float32 0..1"""
+    return np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+class ImageCalibrationReader:
+    """Подает калибровочные изображения в onnxruntime.quantization по одному"""
+
+    def __init__(self, input_name: str, images: List[np.ndarray]):
+        self.input_name = input_name
+        self._images = iter(images)
+
+    def get_next(self):
+        image = next(self._images, None)
+        return None if image is None else {self.input_name: to_model_input(image)}
+
+
+def copy_metadata(source: str, target: str):
+    """Переносит метаданные ultralytics (names, imgsz, task...) в квантованную модель"""
+    import onnx
+
+    metadata = {p.key: p.value for p in onnx.load(source, load_external_data=False).metadata_props}
+    model = onnx.load(target)
+    existing = {p.key for p in model.metadata_props}
+    for key, value in metadata.items():
+        if key not in existing:
+            model.metadata_props.add(key=key, value=value)
+    onnx.save(model, target)
+
+
+def quantize(fp32_path: str, int8_path: str, mode: str, calibration: List[np.ndarray]):
+    """
+    Квантует ONNX-модель
+
+    Args:
+        fp32_path: Исходная ONNX-модель
+        int8_path: Куда сохранить квантованную модель
+        mode: static или dynamic
+        calibration: Изображения для калибровки (для static)
+    """
+    import onnxruntime
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quant_pre_process, quantize_dynamic, quantize_static
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Вывод форм и свертка констант улучшают результат квантования
+        prepared = os.path.join(tmp, 'prepared.onnx')
+        try:
+            quant_pre_process(fp32_path, prepared)
+        except Exception as e:
+            print(f'Предобработка графа пропущена: {e}')
+            shutil.copyfile(fp32_path, prepared)
+
+        if mode == 'dynamic':
+            quantize_dynamic(prepared, int8_path, weight_type=QuantType.QInt8)
+        else:
+            session = onnxruntime.InferenceSession(prepared, providers=['CPUExecutionProvider'])
+            input_name = session.get_inputs()[0].name
+            del session
+            quantize_static(
+                prepared,
+                int8_path,
+                ImageCalibrationReader(input_name, calibration),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                weight_type=QuantType.QInt8,
+                activation_type=QuantType.QUInt8,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+
+    copy_metadata(fp32_path, int8_path)
+
+
+def measure(backend: str, model_path: str, image_paths: List[str], top_k: int) -> Dict:
+    """
+    Замеряет модель (выполняется в отдельном процессе)
+
+    Returns:
+        Dict с предсказаниями, задержками и памятью (прирост - относительно процесса
+        до загрузки модели и изображений)
+    """
+    from backends import load_model
+    from evaluation import load_images, peak_rss_mb, rss_mb
+    from result_parser import parse_result
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    model = load_model(backend, model_path)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    model(load_images(image_paths[:1])[0], verbose=False, imgsz=config.MODEL_IMGSZ)  # прогрев
+
+    predictions = []
+    latencies = []
+    # Изображения читаются по одному: пиковый RSS не должен зависеть от размера набора
+    for path in image_paths:
+        image = load_images([path])[0]
+        started = time.perf_counter()
+        result = model(image, verbose=False, imgsz=config.MODEL_IMGSZ)[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        predictions.append(parse_result(result, model.names, top_k))
+
+    return {
+        'backend': backend,
+        'predictions': predictions,
+        'load_ms': round(load_ms, 1),
+        'mean_ms': round(float(np.mean(latencies)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'rss_mb': round(rss_mb(), 1),
+        'model_rss_mb': round(rss_mb() - rss_before, 1),
+        'peak_rss_mb': round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def build_report(model_path: str, image_paths: List[str], backends: List[str], top_k: int) -> Dict:
+    """Замеряет каждую модель в отдельном процессе и сравнивает с FP32 (onnx)"""
+    from evaluation import top1_agreement, topk_agreement
+
+    measurements = {}
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            measurements[backend] = pool.submit(measure, backend, model_path, image_paths, top_k).result()
+
+    reference = measurements['onnx']['predictions']
+    report = {'images': len(image_paths), 'top_k': top_k, 'models': {}}
+    for backend, m in measurements.items():
+        path = exported_path(model_path, backend)
+        report['models'][backend] = {
+            'path': path,
+            'size_mb': round(_size_mb(path), 1),
+            'top1_agreement': round(top1_agreement(reference, m['predictions']), 4),
+            f'top{top_k}_agreement': round(topk_agreement(reference, m['predictions'], top_k), 4),
+            **{k: v for k, v in m.items() if k not in ('backend', 'predictions')},
+        }
+    return report
+
+
+def _size_mb(path: str) -> float:
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path) for name in files
+        ) / (1024 * 1024)
+    return os.path.getsize(path) / (1024 * 1024)
+
+
+def print_report(report: Dict):
+    top_k = report['top_k']
+    print(f'\nИзображений: {report["images"]}, эталон - FP32 (onnx)')
+    header = f'{"модель":12} {"МБ":>7} {"top-1":>7} {f"top-{top_k}":>7} {"мс":>8} {"p95 мс":>8} {"RSS МБ":>8} {"модель МБ":>10}'
+    print(header)
+    print('-' * len(header))
+    for backend, m in report['models'].items():
+        print(
+            f'{backend:12} {m["size_mb"]:7.1f} {m["top1_agreement"]:7.1%} {m[f"top{top_k}_agreement"]:7.1%} '
+            f'{m["mean_ms"]:8.1f} {m["p95_ms"]:8.1f} {m["rss_mb"]:8.1f} {m["model_rss_mb"]:10.1f}'
+        )
+
+
+def main():
+    from evaluation import list_images, load_images
+
+    parser = argparse.ArgumentParser(description='INT8-квантование модели и сравнение с FP32')
+    parser.add_argument('--model', default=config.MODEL_PATH, help='Путь к модели PyTorch (.pt)')
+    parser.add_argument('--mode', choices=('static', 'dynamic'), default='static', help='Тип квантования')
+    parser.add_argument('--calibration', default='imgs', help='Папка с калибровочными изображениями')
+    parser.add_argument('--images', default=None, help='Папка с изображениями для отчета (по умолчанию --calibration)')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--with-torch', action='store_true', help='Добавить в отчет модель PyTorch')
+    parser.add_argument('--report-only', action='store_true', help='Не квантовать, только построить отчет')
+    parser.add_argument('--report', help='Сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    fp32_path = ensure_exported(args.model, 'onnx')
+    int8_path = exported_path(args.model, 'onnx-int8')
+
+    if not args.report_only:
+        calibration = list_images(args.calibration)
+        if args.mode == 'static' and not calibration:
+            print(f'В папке {args.calibration} нет изображений для калибровки')
+            sys.exit(1)
+        print(f'Квантование {fp32_path} ({args.mode}, калибровка: {len(calibration)} изображений)...')
+        started = time.perf_counter()
+        quantize(fp32_path, int8_path, args.mode, load_images(calibration))
+        print(f'Сохранено в {int8_path} за {time.perf_counter() - started:.1f} с')
+
+    image_paths = list_images(args.images or args.calibration)
+    if not image_paths:
+        print('Нет изображений для отчета')
+        sys.exit(1)
+
+    backends = ['onnx', 'onnx-int8'] + (['torch'] if args.with_torch else [])
+    report = build_report(args.model, image_paths, backends, args.top_k)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\nОтчет сохранен в {args.report}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Кэш результатов распознавания по хешу содержимого и перцептивному хешу изображения
+
+Повторные загрузки того же фото (ретраи мобильного клиента) находятся по
+точному SHA-256 байтов, похожие фото - по расстоянию Хэмминга между dHash.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def perceptual_hash(image: np.ndarray) -> int:
+    """
+    Вычисляет 64-битный разностный хеш (dHash) изображения
+
+    Args:
+        image: Изображение (H, W, 3) в BGR или (H, W) в оттенках серого
+
+    Returns:
+        int - 64-битный хеш
+    """
+    if image.ndim == 3:
+        # Яркость из BGR
+        gray = image[:, :, 0] * 0.114 + image[:, :, 1] * 0.587 + image[:, :, 2] * 0.299
+        image = gray.astype(np.uint8)
+
+    small = np.asarray(
+        Image.fromarray(image).resize((9, 8), Image.Resampling.BILINEAR),
+        dtype=np.int16
+    )
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class CacheEntry:
+    """Закэшированный результат распознавания (и питательная ценность, если уже получена)"""
+
+    __slots__ = ('key', 'phash', 'result', 'nutrition', 'created_at')
+
+    def __init__(self, key: str, phash: Optional[int], result: Dict,
+                 nutrition: Optional[Dict] = None, created_at: float = None):
+        self.key = key
+        self.phash = phash
+        self.result = result
+        self.nutrition = nutrition
+        self.created_at = created_at if created_at is not None else time.time()
+
+
+class PredictionCache:
+    """
+    LRU-кэш результатов распознавания с TTL и необязательным хранением в SQLite
+
+    Запись на диск выполняется фоновым потоком, поэтому put() не блокирует
+    event loop. При запуске кэш заполняется непросроченными записями из базы.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        phash_distance: int = -1,
+        db_path: str = None
+    ):
+        """
+        Args:
+            max_entries: Максимальное количество записей в памяти
+            ttl_seconds: Время жизни записи (сек)
+            phash_distance: Максимальное расстояние Хэмминга между dHash для
+                поиска похожих изображений (-1 - поиск по похожести выключен)
+            db_path: Путь к файлу SQLite (None - только память)
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.phash_distance = phash_distance
+        self.db_path = db_path
+
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._similar_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._write_dropped = 0
+
+        self._write_queue = None
+        self._writer_pid = None
+        if db_path:
+            self._load_from_disk()
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return self.phash_distance >= 0
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Ищет запись по точному хешу содержимого
+
+        Args:
+            key: SHA-256 байтов изображения
+
+        Returns:
+            CacheEntry или None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def get_similar(self, phash: int, prefix: str = '') -> Optional[CacheEntry]:
+        """
+        Ищет запись с ближайшим перцептивным хешем в пределах phash_distance
+
+        Args:
+            phash: dHash изображения
+            prefix: Учитываются только записи с ключом, начинающимся с prefix (версия модели)
+
+        Returns:
+            CacheEntry или None
+        """
+        if not self.similarity_enabled:
+            return None
+
+        now = time.time()
+        best = None
+        best_distance = self.phash_distance + 1
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.phash is None or self._expired(entry, now) or not entry.key.startswith(prefix):
+                    continue
+                distance = (entry.phash ^ phash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+                    if distance == 0:
+                        break
+
+            if best is not None:
+                self._entries.move_to_end(best.key)
+                self._similar_hits += 1
+                # Промах по точному хешу уже учтен в get()
+                self._misses -= 1
+            return best
+
+    def put(self, entry: CacheEntry):
+        """Сохраняет (или обновляет) запись"""
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+        if self.db_path:
+            self._ensure_writer()
+            try:
+                self._write_queue.put_nowait(entry)
+            except queue.Full:
+                # Запись на диск не успевает: запись остается только в памяти
+                with self._lock:
+                    self._write_dropped += 1
+
+    def clear(self):
+        """Удаляет все записи (в том числе из SQLite), например после смены модели"""
+        with self._lock:
+            self._entries.clear()
+
+        if self.db_path:
+            self._ensure_writer()
+            # Ожидающие записи больше не нужны; очередь не блокирует вызывающего (event loop)
+            try:
+                while True:
+                    self._write_queue.get_nowait()
+            except queue.Empty:
+                pass
+            # None в очереди записи - удалить все сохраненные записи
+            try:
+                self._write_queue.put_nowait(None)
+            except queue.Full:
+                # Очередь успели заполнить новые записи: старые строки останутся в базе,
+                # но ключи с прежней версией модели новыми запросами не используются
+                logger.warning('Очередь записи кэша предсказаний заполнена, очистка базы пропущена')
+
+    def _ensure_writer(self):
+        """Запускает фоновый поток записи (в том числе заново после fork)"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._write_queue = queue.Queue(maxsize=self.max_entries)
+            threading.Thread(target=self._writer_loop, name='prediction-cache-writer', daemon=True).start()
+            self._writer_pid = os.getpid()
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            lookups = self._hits + self._similar_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'phash_distance': self.phash_distance,
+                'persistent': bool(self.db_path),
+                'hits': self._hits,
+                'similar_hits': self._similar_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'write_dropped': self._write_dropped,
+                'hit_rate': round((self._hits + self._similar_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'key TEXT PRIMARY KEY, phash TEXT, created_at REAL, result TEXT, nutrition TEXT)'
+        )
+        return conn
+
+    def _load_from_disk(self):
+        """Загружает непросроченные записи из SQLite"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM predictions WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+                conn.commit()
+                rows = conn.execute(
+                    'SELECT key, phash, created_at, result, nutrition FROM predictions '
+                    'ORDER BY created_at DESC LIMIT ?', (self.max_entries,)
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f'Не удалось загрузить кэш предсказаний из {self.db_path}: {e}')
+            return
+
+        for key, phash, created_at, result, nutrition in reversed(rows):
+            self._entries[key] = CacheEntry(
+                key,
+                int(phash, 16) if phash else None,
+                json.loads(result),
+                json.loads(nutrition) if nutrition else None,
+                created_at
+            )
+        logger.info(f'Кэш предсказаний: загружено {len(rows)} записей из {self.db_path}')
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            entry = self._write_queue.get()
+            try:
+                if entry is None:
+                    conn.execute('DELETE FROM predictions')
+                    conn.commit()
+                    continue
+                conn.execute(
+                    'INSERT OR REPLACE INTO predictions (key, phash, created_at, result, nutrition) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (
+                        entry.key,
+                        format(entry.phash, '016x') if entry.phash is not None else None,
+                        entry.created_at,
+                        json.dumps(entry.result, ensure_ascii=False),
+                        json.dumps(entry.nutrition, ensure_ascii=False) if entry.nutrition else None,
+                    )
+                )
+                conn.commit()
+            except Exception as e:
+                # Любая ошибка записи (SQLite, сериализация) не должна останавливать поток записи
+                logger.error(f'Не удалось сохранить запись кэша предсказаний: {e}')
+
+
+# Общий кэш результатов распознавания
+prediction_cache = PredictionCache(
+    max_entries=config.PREDICTION_CACHE_SIZE,
+    ttl_seconds=config.PREDICTION_CACHE_TTL,
+    phash_distance=config.PREDICTION_CACHE_PHASH_DISTANCE,
+    db_path=config.PREDICTION_CACHE_DB or None
+)
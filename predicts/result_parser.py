@@ -0,0 +1,143 @@
+"""
+Разбор результатов ultralytics в формат detect_food
+
+Модуль не загружает модель, поэтому его можно использовать в скриптах,
+которые сами выбирают бэкенд (сравнение, квантизация, бенчмарки).
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# (scale, (отступ_слева, отступ_сверху), (ширина, высота)) - см. preprocess.PreparedImage.letterbox
+Letterbox = Tuple[float, Tuple[int, int], Tuple[int, int]]
+
+
+def _as_numpy(values) -> np.ndarray:
+    """Тензор PyTorch или массив ultralytics -> np.ndarray"""
+    if hasattr(values, 'cpu'):
+        values = values.cpu()
+    if hasattr(values, 'numpy'):
+        values = values.numpy()
+    return np.asarray(values)
+
+
+def box_geometry(result, letterbox: Optional[Letterbox] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Рамки детекций в координатах исходного изображения
+
+    Args:
+        result: Результат ultralytics для одного изображения (с boxes)
+        letterbox: Параметры letterbox, которым изображение вписано во вход модели
+            (None - рамки уже в координатах изображения)
+
+    Returns:
+        Tuple (массив N x 4 [x1, y1, x2, y2] в пикселях, (ширина, высота) изображения)
+    """
+    xyxy = _as_numpy(result.boxes.xyxy).astype(np.float32).reshape(-1, 4)
+
+    if letterbox is not None:
+        scale, (left, top), (width, height) = letterbox
+        xyxy = (xyxy - np.array([left, top, left, top], dtype=np.float32)) / scale
+    else:
+        height, width = result.orig_shape[:2]
+
+    np.clip(xyxy[:, 0::2], 0, width, out=xyxy[:, 0::2])
+    np.clip(xyxy[:, 1::2], 0, height, out=xyxy[:, 1::2])
+    return xyxy, (int(width), int(height))
+
+
+def raw_detections(result, letterbox: Optional[Letterbox] = None) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, Tuple[int, int]]]:
+    """
+    Все рамки результата без дедупликации
+
+    Args:
+        result: Результат ultralytics для одного изображения
+        letterbox: Параметры letterbox входа модели (см. box_geometry)
+
+    Returns:
+        Tuple (рамки N x 4 в пикселях изображения, уверенность N (0-1), классы N, (ширина, высота))
+        или None для модели классификации
+    """
+    if getattr(result, 'boxes', None) is None:
+        return None
+    if len(result.boxes) == 0:
+        height, width = result.orig_shape[:2] if letterbox is None else letterbox[2][::-1]
+        empty = np.zeros(0, dtype=np.float32)
+        return np.zeros((0, 4), dtype=np.float32), empty, empty.astype(np.int64), (int(width), int(height))
+
+    conf = _as_numpy(result.boxes.conf).astype(np.float32).reshape(-1)
+    cls = _as_numpy(result.boxes.cls).astype(np.int64).reshape(-1)
+    xyxy, size = box_geometry(result, letterbox)
+    return xyxy, conf, cls, size
+
+
+def parse_result(result, names: Dict[int, str], top_n: int = 5, letterbox: Optional[Letterbox] = None) -> Dict:
+    """
+    Преобразует результат модели для одного изображения в словарь предсказаний
+
+    Args:
+        result: Результат ultralytics для одного изображения
+        names: Названия классов модели (model.names или список по номеру класса, см. labels.py)
+        top_n: Количество топ предсказаний
+        letterbox: Параметры letterbox входа модели (для рамок в координатах изображения)
+
+    Returns:
+        Dict в формате detect_food; для моделей детекции также:
+        'detections' - все рамки по убыванию уверенности
+            ({'label', 'confidence', 'box': [x1, y1, x2, y2] в долях изображения, 'area_fraction'}),
+        'image_size' - (ширина, высота) изображения
+    """
+    result_dict = {
+        'top_prediction': None,
+        'confidence': 0.0,
+        'top_predictions': []
+    }
+
+    # Проверяем, это модель классификации или детекции
+    if hasattr(result, 'probs') and result.probs is not None:
+        # Модель классификации
+        top_indices = result.probs.top5[:top_n] if top_n <= 5 else result.probs.top5
+        top_conf = result.probs.top5conf.tolist()[:top_n] if top_n <= 5 else result.probs.top5conf.tolist()
+
+        predictions = []
+        for idx, conf in zip(top_indices, top_conf):
+            class_name = names[idx].lower()
+            confidence_percent = conf * 100
+            predictions.append((class_name, confidence_percent))
+
+        if predictions:
+            result_dict['top_prediction'] = predictions[0][0]
+            result_dict['confidence'] = predictions[0][1]
+            result_dict['top_predictions'] = predictions
+
+    elif hasattr(result, 'boxes') and result.boxes is not None and len(result.boxes) > 0:
+        # Модель детекции объектов (best.pt)
+        xyxy, conf, cls, (width, height) = raw_detections(result, letterbox)
+
+        # Все рамки по убыванию уверенности
+        order = np.argsort(-conf, kind='stable')
+        normalized = xyxy[order] / np.array([width, height, width, height], dtype=np.float32)
+        area_fraction = (normalized[:, 2] - normalized[:, 0]) * (normalized[:, 3] - normalized[:, 1])
+
+        # Лучшая рамка каждого класса (дедупликация): первое вхождение класса в отсортированном порядке
+        _, first = np.unique(cls[order], return_index=True)
+        best = np.sort(first)[:top_n]
+
+        top_detections = [(names[int(cls[order[i]])].lower(), float(conf[order[i]]) * 100) for i in best]
+        if top_detections:
+            result_dict['top_prediction'] = top_detections[0][0]
+            result_dict['confidence'] = top_detections[0][1]
+            result_dict['top_predictions'] = top_detections
+
+        result_dict['detections'] = [
+            {
+                'label': names[int(class_id)].lower(),
+                'confidence': float(confidence) * 100,
+                'box': [round(float(v), 4) for v in box],
+                'area_fraction': round(float(area), 4),
+            }
+            for class_id, confidence, box, area in zip(cls[order], conf[order], normalized, area_fraction)
+        ]
+        result_dict['image_size'] = (width, height)
+
+    return result_dict
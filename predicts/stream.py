@@ -0,0 +1,388 @@
+"""
+Распознавание потока кадров камеры по WebSocket (/ws/stream)
+
+Клиент присылает уменьшенные JPEG-кадры бинарными сообщениями, сервер отвечает
+JSON-сообщениями только тогда, когда набор продуктов в кадре изменился.
+
+- Последний кадр: пока идет инференс, новые кадры перезаписывают слот
+  LatestFrameSlot, устаревшие отбрасываются (dropped), и задержка не растет,
+  даже если модель не успевает за камерой.
+- Отсев похожих кадров: каждый кадр сравнивается с последним распознанным
+  по уменьшенной серой копии (средняя разница яркости). Если камера почти не
+  сдвинулась, модель не запускается (skipped).
+- Инкрементальные ответы: клиенту отправляются только добавленные, изменившиеся
+  и пропавшие продукты относительно уже отправленного состояния.
+"""
+import asyncio
+import io
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import config
+from executors import run_inference
+from labels import label_table
+from ingest import ImageTooLargeError, InvalidImageError
+from metrics import record_error, record_prediction, record_stage, stream_frames_total
+from preprocess import PreparedImage, decode_image, prepare_decoded
+from use_model import detect_food
+
+logger = logging.getLogger(__name__)
+
+# Код закрытия WebSocket: сервер перегружен, повторить позже (RFC 6455)
+CLOSE_TRY_AGAIN_LATER = 1013
+# Код закрытия WebSocket: сообщение слишком большое
+CLOSE_MESSAGE_TOO_BIG = 1009
+
+
+class LatestFrameSlot:
+    """
+    Слот на один кадр: новый кадр вытесняет еще не обработанный
+
+    Работает в одном event loop: put() вызывает задача приема, get() - задача обработки.
+    """
+
+    def __init__(self):
+        self._frame: Optional[Tuple[int, bytes, float]] = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, seq: int, data: bytes):
+        """Кладет кадр; необработанный предыдущий кадр отбрасывается"""
+        if self._frame is not None:
+            self.dropped += 1
+            stream_frames_total.inc(result='dropped')
+        self._frame = (seq, data, time.perf_counter())
+        self._event.set()
+
+    def close(self):
+        """Больше кадров не будет: get() вернет None после последнего кадра"""
+        self._closed = True
+        self._event.set()
+
+    async def get(self) -> Optional[Tuple[int, bytes, float]]:
+        """
+        Ждет кадр
+
+        Returns:
+            Tuple (номер кадра, байты, время получения) или None, если поток закрыт
+        """
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+def frame_signature(img: Image.Image, size: int = config.STREAM_DIFF_SIZE) -> np.ndarray:
+    """Уменьшенная серая копия кадра для сравнения с предыдущим"""
+    small = img.convert('L').resize((size, size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.asarray(small, dtype=np.int16)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Средняя разница яркости двух сигнатур (0-255)"""
+    return float(np.abs(a - b).mean())
+
+
+def prepare_frame(
+    data: bytes,
+    reference: Optional[np.ndarray],
+    threshold: float
+) -> Tuple[Optional[PreparedImage], np.ndarray, float, Dict[str, float]]:
+    """
+    Декодирует кадр и решает, нужен ли инференс
+
+    Args:
+        data: Байты JPEG-кадра
+        reference: Сигнатура последнего распознанного кадра (None - еще не было)
+        threshold: Минимальная разница с reference, при которой кадр распознается
+
+    Returns:
+        Tuple (PreparedImage или None, если кадр почти не изменился;
+        сигнатура кадра; разница с reference; времена decode_ms/resize_ms)
+    """
+    started = time.perf_counter()
+    img = decode_image(io.BytesIO(data), target_size=config.MODEL_IMGSZ)
+    signature = frame_signature(img)
+    timings = {'decode_ms': (time.perf_counter() - started) * 1000}
+
+    difference = frame_difference(signature, reference) if reference is not None else float('inf')
+    if difference < threshold:
+        return None, signature, difference, timings
+
+    prepared = prepare_decoded(img, config.MODEL_IMGSZ)
+    timings['resize_ms'] = prepared.timings['resize_ms']
+    return prepared, signature, difference, timings
+
+
+def summarize_result(result: Dict, min_confidence: float = config.STREAM_MIN_CONFIDENCE) -> Dict[str, Dict]:
+    """
+    Продукты кадра: лучшая рамка каждого продукта (для классификации - топ-предсказания)
+
+    Args:
+        result: Результат detect_food
+        min_confidence: Минимальная уверенность (%)
+
+    Returns:
+        Dict: название продукта -> {'label', 'confidence', 'box' (для моделей детекции)}
+    """
+    items = {}
+    if 'detections' in result:
+        # Рамки отсортированы по убыванию уверенности: первая рамка продукта - лучшая
+        for detection in result['detections']:
+            if detection['confidence'] >= min_confidence and detection['label'] not in items:
+                items[detection['label']] = {
+                    'label': detection['label'],
+                    'confidence': round(detection['confidence'], 1),
+                    'box': detection['box'],
+                }
+    else:
+        for label, confidence in result['top_predictions']:
+            if confidence >= min_confidence:
+                items[label] = {'label': label, 'confidence': round(confidence, 1)}
+    return items
+
+
+def diff_items(
+    sent: Dict[str, Dict],
+    current: Dict[str, Dict],
+    confidence_delta: float = config.STREAM_CONFIDENCE_DELTA,
+    box_delta: float = config.STREAM_BOX_DELTA
+) -> Tuple[list, list, list]:
+    """
+    Изменения продуктов относительно отправленного клиенту состояния
+
+    Продукт считается изменившимся, если уверенность сдвинулась на confidence_delta
+    процентов или любая координата рамки - на box_delta доли изображения.
+
+    Args:
+        sent: Состояние, уже отправленное клиенту
+        current: Продукты текущего кадра (summarize_result)
+        confidence_delta: Порог изменения уверенности (%)
+        box_delta: Порог сдвига рамки (доля изображения)
+
+    Returns:
+        Tuple (добавленные, изменившиеся, названия пропавших)
+    """
+    added, updated = [], []
+    for label, item in current.items():
+        previous = sent.get(label)
+        if previous is None:
+            added.append(item)
+        elif abs(item['confidence'] - previous['confidence']) >= confidence_delta:
+            updated.append(item)
+        elif 'box' in item and 'box' in previous and max(abs(a - b) for a, b in zip(item['box'], previous['box'])) >= box_delta:
+            updated.append(item)
+    removed = [label for label in sent if label not in current]
+    return added, updated, removed
+
+
+class StreamStats:
+    """Счетчики одного потока и пропускная способность"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.received = 0
+        self.skipped = 0
+        self.inferred = 0
+        self.errors = 0
+        self.inference_ms = 0.0
+
+    def as_dict(self, dropped: int) -> Dict:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        # Процессорное время всего процесса: при нескольких потоках в воркере fps_per_core занижен
+        cpu_seconds = time.process_time() - self.cpu_started
+        return {
+            'received': self.received,
+            'dropped': dropped,
+            'skipped': self.skipped,
+            'inferred': self.inferred,
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 2),
+            'fps': round(self.received / elapsed, 2),
+            'inference_fps': round(self.inferred / elapsed, 2),
+            'cpu_cores': round(cpu_seconds / elapsed, 2),
+            # Распознанных кадров на секунду процессорного времени (одно ядро)
+            'fps_per_core': round(self.inferred / cpu_seconds, 2) if cpu_seconds > 0 else None,
+            'avg_inference_ms': round(self.inference_ms / self.inferred, 1) if self.inferred else None,
+        }
+
+
+class StreamSession:
+    """Один поток кадров: задача приема кадров и цикл распознавания"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.slot = LatestFrameSlot()
+        self.stats = StreamStats()
+        self.sent: Dict[str, Dict] = {}
+        self.reference: Optional[np.ndarray] = None
+        self._stats_sent_at = time.perf_counter()
+        # Код закрытия, если соединение закрывает сервер
+        self.close_code: Optional[int] = None
+
+    async def receive_frames(self):
+        """Читает кадры клиента в слот (текстовые сообщения игнорируются)"""
+        seq = 0
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                data = message.get('bytes')
+                if data is None:
+                    continue
+
+                if len(data) > config.STREAM_MAX_FRAME_BYTES:
+                    # Закрывает соединение цикл обработки, чтобы не отправлять сообщения параллельно
+                    stream_frames_total.inc(result='error')
+                    self.close_code = CLOSE_MESSAGE_TOO_BIG
+                    break
+
+                seq += 1
+                self.stats.received += 1
+                stream_frames_total.inc(result='received')
+                self.slot.put(seq, data)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.slot.close()
+
+    async def process_frame(self, seq: int, data: bytes, received_at: float) -> Optional[Dict]:
+        """
+        Распознает кадр, если он заметно отличается от последнего распознанного
+
+        Returns:
+            Сообщение с изменениями продуктов или None, если менять нечего
+        """
+        prepared, signature, difference, timings = await run_inference(
+            prepare_frame, data, self.reference, config.STREAM_DIFF_THRESHOLD
+        )
+        record_stage('decode', timings['decode_ms'])
+        if prepared is None:
+            self.stats.skipped += 1
+            stream_frames_total.inc(result='skipped')
+            return None
+
+        record_stage('preprocess', timings['resize_ms'])
+        try:
+            started = time.perf_counter()
+            result = await run_inference(detect_food, prepared.image, top_n=5, letterbox=prepared.letterbox)
+            self.stats.inference_ms += (time.perf_counter() - started) * 1000
+        finally:
+            prepared.release()
+
+        self.reference = signature
+        self.stats.inferred += 1
+        stream_frames_total.inc(result='inferred')
+        if result['top_prediction']:
+            record_prediction(result['top_prediction'])
+
+        current = summarize_result(result)
+        added, updated, removed = diff_items(self.sent, current)
+        if not (added or updated or removed):
+            return None
+
+        for item in added + updated:
+            self.sent[item['label']] = item
+        for label in removed:
+            del self.sent[label]
+
+        return {
+            'type': 'detections',
+            'frame': seq,
+            'added': [{**item, 'label_ru': label_table.russian_name(item['label'])} for item in added],
+            'updated': updated,
+            'removed': removed,
+            'difference': round(difference, 2) if difference != float('inf') else None,
+            'latency_ms': round((time.perf_counter() - received_at) * 1000, 1),
+        }
+
+    async def maybe_send_stats(self):
+        """Отправляет статистику не чаще STREAM_STATS_INTERVAL секунд"""
+        now = time.perf_counter()
+        if now - self._stats_sent_at < config.STREAM_STATS_INTERVAL:
+            return
+        self._stats_sent_at = now
+        await self.websocket.send_text(json.dumps({'type': 'stats', **self.stats.as_dict(self.slot.dropped)}))
+
+    async def run(self):
+        """Обрабатывает поток до отключения клиента"""
+        receiver = asyncio.create_task(self.receive_frames())
+        try:
+            while True:
+                # Статистика отправляется и тогда, когда кадры не приходят
+                until_stats = config.STREAM_STATS_INTERVAL - (time.perf_counter() - self._stats_sent_at)
+                try:
+                    frame = await asyncio.wait_for(self.slot.get(), timeout=max(until_stats, 0.05))
+                except asyncio.TimeoutError:
+                    await self.maybe_send_stats()
+                    continue
+                if frame is None:
+                    break
+                seq, data, received_at = frame
+                try:
+                    message = await self.process_frame(seq, data, received_at)
+                except (ImageTooLargeError, InvalidImageError) as e:
+                    message = {'type': 'error', 'frame': seq, 'detail': str(e)}
+                except Exception as e:
+                    logger.exception(f"Ошибка при анализе кадра {seq} потока")
+                    record_error(type(e).__name__)
+                    message = {'type': 'error', 'frame': seq, 'detail': f"Ошибка при анализе кадра: {e}"}
+                if message is not None:
+                    if message['type'] == 'error':
+                        self.stats.errors += 1
+                        stream_frames_total.inc(result='error')
+                    await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+                await self.maybe_send_stats()
+
+            if self.close_code is not None:
+                await self.websocket.close(code=self.close_code)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+            stats = self.stats.as_dict(self.slot.dropped)
+            logger.info(
+                f"Поток закрыт: кадров {stats['received']}, отброшено {stats['dropped']}, "
+                f"пропущено {stats['skipped']}, распознано {stats['inferred']}, {stats['fps_per_core']} кадр/с на ядро"
+            )
+
+
+# Количество открытых потоков в этом воркере
+_active_streams = 0
+
+
+async def serve_stream(websocket: WebSocket):
+    """
+    Обслуживает подключение /ws/stream
+
+    Если в воркере уже открыто STREAM_MAX_CONNECTIONS потоков, подключение
+    закрывается с кодом 1013 (повторить позже).
+    """
+    global _active_streams
+    if _active_streams >= config.STREAM_MAX_CONNECTIONS:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+
+    _active_streams += 1
+    try:
+        await websocket.accept()
+        await StreamSession(websocket).run()
+    finally:
+        _active_streams -= 1
+
+
+def streams_stats() -> Dict:
+    """Количество открытых потоков"""
+    return {'active': _active_streams, 'max': config.STREAM_MAX_CONNECTIONS}
@@ -1,95 +1,281 @@
-from ultralytics import YOLO
-from PIL import Image
-from typing import Dict, List, Tuple
-import torch
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+import config
+from backends import load_model
+import result_parser
+from result_parser import Letterbox
+from batching import InferenceBatcher
+from model_registry import DEFAULT_VERSION, ModelRegistry, ModelVersion
+from preprocess import LETTERBOX_FILL
+from metrics import cascade_total, record_stage, timed
+from cascade import cascade, STAGE_DETECTOR
+from labels import label_table
 
-# Загрузка модели (глобально, чтобы не загружать каждый раз)
-model = YOLO('model/best.pt')
+logger = logging.getLogger(__name__)
 
 
-def detect_food(image_path: str, top_n: int = 5) -> Dict:
+def _warmup(model) -> int:
+    """
+    Прогревает модель синтетическими изображениями
+
+    Прогоняются батчи размера 1 и INFERENCE_BATCH_SIZE, чтобы заранее
+    выделить память под оба крайних размера батча.
+
+    Returns:
+        Количество выполненных прогонов
+    """
+    image = np.full((config.MODEL_IMGSZ, config.MODEL_IMGSZ, 3), LETTERBOX_FILL, dtype=np.uint8)
+    runs = 0
+    for batch_size in sorted({1, config.INFERENCE_BATCH_SIZE}):
+        for _ in range(config.MODEL_WARMUP_RUNS):
+            model([image] * batch_size, verbose=False, batch=batch_size, imgsz=config.MODEL_IMGSZ)
+            runs += 1
+    return runs
+
+
+def _classify(future, timings: Dict[str, float], top_n: int) -> Optional[Dict]:
+    """
+    Ответ классификатора каскада
+
+    Returns:
+        Результат со stage='classifier' или None, если изображение нужно передать
+        модели детекции (классификатор не уверен или завершился ошибкой)
+    """
+    try:
+        return cascade.finish(future, timings, top_n)
+    except Exception as e:
+        logger.warning(f'Ошибка классификатора каскада, изображение передано модели детекции: {e}')
+        cascade_total.inc(stage=STAGE_DETECTOR)
+        return None
+
+
+def _load_model():
+    """Загружает модель и сверяет с ней таблицу меток (см. labels.py)"""
+    model = load_model()
+    label_table.bind(model.names)
+    return model
+
+
+# Реестр версий модели: при старте активна модель из MODEL_PATH, которая загружается
+# при первом обращении (или в фоне при старте API); бэкенд задается MODEL_BACKEND
+registry = ModelRegistry(
+    ModelVersion(DEFAULT_VERSION, config.MODEL_PATH, config.MODEL_BACKEND, _warmup, loader=_load_model),
+    warmup=_warmup,
+    state_path=config.MODEL_REGISTRY_PATH,
+    model_dir=config.MODEL_REGISTRY_DIR,
+    poll_interval=config.MODEL_REGISTRY_POLL_INTERVAL
+)
+# Модель из MODEL_PATH (gunicorn загружает ее в мастер-процессе)
+model_manager = registry.active.manager
+
+
+def _run_model(images: List) -> List[Tuple[object, ModelVersion]]:
+    """
+    Прогоняет батч изображений через активную версию модели одним вызовом
+
+    Returns:
+        Для каждого изображения (результат, версия модели): результат разбирается
+        по названиям классов той версии, которая его получила, даже если между
+        прогоном и разбором трафик переключили на другую
+    """
+    version = registry.active
+    results = version.model(images, verbose=False, batch=len(images), imgsz=config.MODEL_IMGSZ)
+    return [(result, version) for result in results]
+
+
+# Планировщик, собирающий одновременные запросы в батчи
+batcher = InferenceBatcher(
+    _run_model,
+    max_batch_size=config.INFERENCE_BATCH_SIZE,
+    max_wait_ms=config.INFERENCE_BATCH_WAIT_MS
+)
+
+
+def _record_inference(timings: Dict[str, float], seen_batches: set = None):
+    """
+    Учитывает ожидание батча и прогон модели в метриках запроса
+
+    Args:
+        timings: Времена изображения из batcher.submit_timed
+        seen_batches: Уже учтенные батчи запроса (прогон общего батча учитывается один раз)
+    """
+    record_stage('queue_wait', timings['queue_wait_ms'])
+    if seen_batches is not None:
+        if timings['batch_started'] in seen_batches:
+            return
+        seen_batches.add(timings['batch_started'])
+    record_stage('model_forward', timings['model_forward_ms'])
+
+
+def parse_result(result, top_n: int = 5, names: Dict[int, str] = None, letterbox: Letterbox = None) -> Dict:
+    """
+    Преобразует результат модели для одного изображения в словарь предсказаний
+
+    Args:
+        result: Результат ultralytics для одного изображения
+        top_n: Количество топ предсказаний
+        names: Названия классов (по умолчанию - метки таблицы меток, сверенной с активной моделью)
+        letterbox: Параметры letterbox входа (PreparedImage.letterbox) для рамок в координатах изображения
+
+    Returns:
+        Dict в формате detect_food
+    """
+    if names is None:
+        registry.active.manager.get()
+        names = label_table.labels
+    return result_parser.parse_result(result, names, top_n, letterbox)
+
+
+def detect_food(image: Union[str, np.ndarray], top_n: int = 5, letterbox: Letterbox = None, use_cascade: bool = True) -> Dict:
     """
     Определяет продукт/блюдо на изображении
 
+    Изображение проходит через общий планировщик, поэтому одновременные
+    запросы объединяются в один батчевый прогон модели. Если включен каскад
+    (CASCADE_MODEL_PATH), сначала изображение распознает быстрый классификатор,
+    а модель детекции запускается, только если он не уверен (см. cascade.py).
+
     Args:
-        image_path: Путь к изображению
+        image: Путь к изображению или декодированное изображение (np.ndarray, BGR)
         top_n: Количество топ предсказаний (по умолчанию 5)
+        letterbox: Параметры letterbox, если image - подготовленный вход модели (PreparedImage.letterbox)
+        use_cascade: Использовать каскад, если он включен и классификатор готов
 
     Returns:
         Dict с результатами:
         {
             'top_prediction': str - название продукта с максимальной уверенностью,
             'confidence': float - уверенность в процентах (0-100),
-            'top_predictions': List[Tuple[str, float]] - список (название, уверенность%)
+            'top_predictions': List[Tuple[str, float]] - список (название, уверенность%),
+            'stage': str - какая модель ответила: 'classifier' или 'detector'
         }
+        Для моделей детекции также 'detections' и 'image_size' (см. result_parser.parse_result)
     """
-    results = model(image_path, verbose=False)
+    if use_cascade and cascade.active and isinstance(image, np.ndarray):
+        result = _classify(*cascade.submit(image, letterbox), top_n)
+        if result is not None:
+            return result
 
-    result_dict = {
-        'top_prediction': None,
-        'confidence': 0.0,
-        'top_predictions': []
-    }
+    future, timings = batcher.submit_timed(image)
+    result, version = future.result()
+    _record_inference(timings)
+    with timed('postprocess'):
+        result = parse_result(result, top_n, version.labels, letterbox)
+    result['stage'] = STAGE_DETECTOR
+    registry.maybe_shadow(image, letterbox, result, timings['model_forward_ms'])
+    return result
 
-    for result in results:
-        # Проверяем, это модель классификации или детекции
-        if hasattr(result, 'probs') and result.probs is not None:
-            # Модель классификации
-            top_indices = result.probs.top5[:top_n] if top_n <= 5 else result.probs.top5
-            top_conf = result.probs.top5conf.tolist()[:top_n] if top_n <= 5 else result.probs.top5conf.tolist()
 
-            predictions = []
-            for idx, conf in zip(top_indices, top_conf):
-                class_name = model.names[idx].lower()
-                confidence_percent = conf * 100
-                predictions.append((class_name, confidence_percent))
+def detect_food_batch(
+    images: List[Union[str, np.ndarray]],
+    top_n: int = 5,
+    return_exceptions: bool = False,
+    letterboxes: List[Letterbox] = None,
+    use_cascade: bool = True
+) -> List[Union[Dict, Exception]]:
+    """
+    Определяет продукты на нескольких изображениях
 
-            if predictions:
-                result_dict['top_prediction'] = predictions[0][0]
-                result_dict['confidence'] = predictions[0][1]
-                result_dict['top_predictions'] = predictions
+    Все изображения ставятся в очередь планировщика сразу, поэтому они
+    попадают в общие батчи (по INFERENCE_BATCH_SIZE изображений). При
+    включенном каскаде сначала все изображения проходят через классификатор,
+    и в модель детекции одним набором батчей уходят только те, в которых он не уверен.
 
-        elif hasattr(result, 'boxes') and result.boxes is not None and len(result.boxes) > 0:
-            # Модель детекции объектов (best.pt)
-            boxes = result.boxes
+    Args:
+        images: Пути к изображениям или декодированные изображения (np.ndarray, BGR)
+        top_n: Количество топ предсказаний
+        return_exceptions: Вернуть исключение на месте неудачного изображения,
+            а не выбрасывать его
+        letterboxes: Параметры letterbox каждого изображения (см. detect_food)
+        use_cascade: Использовать каскад, если он включен и классификатор готов
 
-            # Собираем лучший confidence для каждого класса (дедупликация)
-            best_per_class = {}
-            for i in range(len(boxes)):
-                cls_id = int(boxes.cls[i].item())
-                conf = boxes.conf[i].item()
-                class_name = model.names[cls_id].lower()
-                confidence_percent = conf * 100
+    Returns:
+        Список результатов в формате detect_food в порядке images
+    """
+    letterboxes = letterboxes or [None] * len(images)
+    results: List[Union[Dict, Exception, None]] = [None] * len(images)
 
-                if class_name not in best_per_class or confidence_percent > best_per_class[class_name]:
-                    best_per_class[class_name] = confidence_percent
+    if use_cascade and cascade.active:
+        classified = [
+            (i, cascade.submit(image, letterboxes[i]))
+            for i, image in enumerate(images)
+            if isinstance(image, np.ndarray)
+        ]
+        for i, (future, timings) in classified:
+            results[i] = _classify(future, timings, top_n)
 
-            # Преобразуем в список и сортируем по уверенности
-            detections = [(name, conf) for name, conf in best_per_class.items()]
-            detections.sort(key=lambda x: x[1], reverse=True)
+    pending = [i for i, result in enumerate(results) if result is None]
+    submitted = [(i, batcher.submit_timed(images[i])) for i in pending]
 
-            # Берем топ N
-            top_detections = detections[:top_n]
+    seen_batches = set()
+    for i, (future, timings) in submitted:
+        try:
+            result, version = future.result()
+            _record_inference(timings, seen_batches)
+            with timed('postprocess'):
+                results[i] = parse_result(result, top_n, version.labels, letterboxes[i])
+            results[i]['stage'] = STAGE_DETECTOR
+            registry.maybe_shadow(images[i], letterboxes[i], results[i], timings['model_forward_ms'])
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results[i] = e
+    return results
+
+
+def detect_boxes_batch(
+    images: List[np.ndarray],
+    letterboxes: List[Letterbox]
+) -> Tuple[List[Tuple[np.ndarray, np.ndarray, np.ndarray, Tuple[int, int]]], Dict[int, str]]:
+    """
+    Все рамки детекции (без дедупликации по классам) для нескольких входов модели
 
-            if top_detections:
-                result_dict['top_prediction'] = top_detections[0][0]
-                result_dict['confidence'] = top_detections[0][1]
-                result_dict['top_predictions'] = top_detections
+    Используется разбором тарелки: проходы по кадру и фрагментам ставятся в
+    очередь планировщика сразу и попадают в общие батчи. Номера классов всех
+    проходов должны относиться к одной модели, поэтому если во время прогона
+    трафик переключили на другую версию, проходы повторяются.
+
+    Args:
+        images: Подготовленные входы модели (np.ndarray, BGR)
+        letterboxes: Параметры letterbox каждого входа
+
+    Returns:
+        Tuple (результаты result_parser.raw_detections в порядке images, названия классов модели)
+
+    Raises:
+        ValueError: Если загружена модель классификации (у результата нет рамок)
+    """
+    while True:
+        submitted = [batcher.submit_timed(image) for image in images]
 
-    return result_dict
+        raw = []
+        versions = set()
+        seen_batches = set()
+        for (future, timings), letterbox in zip(submitted, letterboxes):
+            result, version = future.result()
+            versions.add(version)
+            _record_inference(timings, seen_batches)
+            with timed('postprocess'):
+                detections = result_parser.raw_detections(result, letterbox)
+            if detections is None:
+                raise ValueError('Модель классификации не возвращает рамки продуктов')
+            raw.append(detections)
+        if len(versions) == 1:
+            return raw, version.labels
 
 
-def detect_food_simple(image_path: str) -> Tuple[str, float]:
+def detect_food_simple(image: Union[str, np.ndarray]) -> Tuple[str, float]:
     """
     Упрощенная версия - возвращает только название продукта и уверенность
 
     Args:
-        image_path: Путь к изображению
+        image: Путь к изображению или декодированное изображение (np.ndarray, BGR)
 
     Returns:
         Tuple (название_продукта, уверенность_в_процентах)
     """
-    result = detect_food(image_path)
+    result = detect_food(image)
     return result['top_prediction'], result['confidence']
 
 